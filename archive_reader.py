@@ -0,0 +1,293 @@
+import codecs
+import mmap
+import re
+import zipfile
+from configparser import ConfigParser
+from datetime import datetime
+from os import fstat, getpid, listdir
+from os.path import isdir, isfile, join, splitext
+from typing import Dict, List, Tuple
+
+from logger import create_logger
+from parse_cache import get_file_fingerprint, get_file_hash
+
+config = ConfigParser()
+config_read = config.read('config.ini', encoding='utf8')
+log_level = 'DEBUG'
+if config_read:
+    log_level = config['main_parameters'].get('log_level', 'DEBUG')
+logger = create_logger('logs/vk_parser.log', 'archive_reader', log_level)
+
+# Количество первых байт файла, в которых ищется объявление кодировки (как в стандарте HTML)
+charset_sniff_size = 1024
+
+charset_pattern = re.compile(rb'<meta[^>]*?charset\s*=\s*["\']?\s*([\w.:-]+)', re.IGNORECASE)
+
+
+def sniff_encoding(head: bytes, default: str = 'cp1251') -> str:
+    '''
+    Возвращает кодировку `.html` файла по метке порядка байтов или по `<meta charset>` в начале файла.
+    Если кодировка не указана или неизвестна Python, возвращает `default`
+    `head`: первые байты файла
+    `default`: кодировка по умолчанию
+    '''
+    if head.startswith(codecs.BOM_UTF8):
+        return 'utf-8-sig'
+    found = charset_pattern.search(head)
+    if found is None:
+        return default
+    name = found.group(1).decode('ascii')
+    try:
+        return codecs.lookup(name).name
+    except LookupError:
+        logger.debug(f'Неизвестная кодировка {name} в начале файла, будет использована {default}')
+        return default
+
+
+class ArchiveFile():
+    def __init__(self, data: bytes | mmap.mmap, encoding: str, file_path: str | None = None) -> None:
+        '''
+        Файл архива VK в виде байтов: весь файл не декодируется в строку, пока его не прочитают целиком.
+        Обработчики `.html` файлов, умеющие работать с байтами, разбирают `data` напрямую
+        и декодируют только найденные ссылки и даты через `decode`.
+        Для остальных обработчиков ведет себя как открытый текстовый файл: `read()` и `read(size)`
+        `data`: содержимое файла
+        `encoding`: кодировка файла
+        `file_path`: путь до файла, если он был открыт с диска
+        '''
+        self.data = data
+        self.encoding = encoding
+        self.file_path = file_path
+        self.position = 0
+        self.decoder = codecs.getincrementaldecoder(encoding)()
+        self.file = None
+
+    @classmethod
+    def open(self, file_path: str, default_encoding: str = 'cp1251') -> 'ArchiveFile':
+        '''
+        Отображает файл в память через `mmap` и определяет его кодировку через `sniff_encoding`
+        `file_path`: путь до файла
+        `default_encoding`: кодировка, если она не указана в самом файле
+        '''
+        file = open(file_path, 'rb')
+        try:
+            # Пустой файл нельзя отобразить в память
+            data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) if fstat(file.fileno()).st_size else b''
+        except BaseException:
+            file.close()
+            raise
+        archive_file = ArchiveFile(data, sniff_encoding(data[:charset_sniff_size], default_encoding), file_path)
+        archive_file.file = file
+        return archive_file
+
+    def decode(self, raw: bytes) -> str:
+        '''
+        Декодирует часть файла в строку
+        `raw`: байты из `data`
+        '''
+        return raw.decode(self.encoding)
+
+    def read(self, size: int = -1) -> str:
+        '''
+        Возвращает следующие `size` байт файла, декодированные в строку, или весь остаток файла
+        `size`: количество байт. Если меньше `0`, читается весь остаток файла
+        '''
+        end = len(self.data) if size is None or size < 0 else self.position + size
+        chunk = self.data[self.position:end]
+        self.position += len(chunk)
+        return self.decoder.decode(chunk, final=self.position >= len(self.data))
+
+    def close(self) -> None:
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def __enter__(self) -> 'ArchiveFile':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+class DirectorySource():
+    '''
+    Источник файлов архива VK - распакованная папка архива. Пути до файлов - обычные пути файловой системы
+    '''
+    def list_dirs(self, path: str) -> List[str]:
+        '''
+        Возвращает пути до всех папок, находящихся в папке `path`
+        `path`: путь до папки
+        '''
+        return [join(path, f) for f in listdir(path) if isdir(join(path, f))]
+
+    def list_files(self, path: str, ext: list) -> List[str]:
+        '''
+        Возвращает пути до всех файлов с расширениями из `ext`, находящихся в папке `path`
+        `path`: путь до папки
+        `ext`: расширения файлов
+        '''
+        return [join(path, f) for f in listdir(path) if isfile(join(path, f)) and splitext(f)[1] in ext]
+
+    def is_dir(self, path: str) -> bool:
+        return isdir(path)
+
+    def is_file(self, path: str) -> bool:
+        return isfile(path)
+
+    def open(self, file_path: str, default_encoding: str = 'cp1251') -> ArchiveFile:
+        '''
+        Открывает файл архива через `ArchiveFile.open`
+        `file_path`: путь до файла
+        `default_encoding`: кодировка, если она не указана в самом файле
+        '''
+        return ArchiveFile.open(file_path, default_encoding)
+
+    def get_fingerprint(self, file_path: str) -> Tuple[int, int]:
+        return get_file_fingerprint(file_path)
+
+    def get_hash(self, file_path: str) -> str:
+        return get_file_hash(file_path)
+
+    def close(self) -> None:
+        pass
+
+
+# Открытые `.zip` архивы и их оглавления:
+# `(номер процесса, путь до архива): (ZipFile, файлы по пути, папки и файлы каждой папки)`.
+# Каждый процесс-обработчик открывает архив один раз, а не для каждого файла.
+# Архив открывается заново в каждом процессе: процессы-обработчики, созданные через `fork`, получают копию
+# этого словаря вместе с открытым файлом основного процесса, а общий файл нельзя читать из нескольких процессов сразу.
+# Процессы-обработчики закрывают архив при завершении, основной процесс - через `ZipSource.close`
+opened_zip_files: Dict[Tuple[int, str], Tuple[zipfile.ZipFile, Dict[str, zipfile.ZipInfo], Dict[str, Tuple[set, list]]]] = {}
+
+
+class ZipSource():
+    def __init__(self, zip_path: str) -> None:
+        '''
+        Источник файлов архива VK - скачанный `.zip` архив без распаковки.
+        Пути до файлов строятся так же, как для распакованной папки, только вместо папки указан сам архив:
+        `<архив>.zip/messages/<id>/messages0.html`.
+        Если все содержимое архива лежит в одной папке, пути считаются от нее.
+        Объект передается в процессы-обработчики, каждый из которых читает файлы из архива сам
+        `zip_path`: путь до `.zip` архива
+        '''
+        self.zip_path = zip_path
+
+    def get_zip(self) -> Tuple[zipfile.ZipFile, Dict[str, zipfile.ZipInfo], Dict[str, Tuple[set, list]]]:
+        '''
+        Возвращает открытый архив, его файлы по пути внутри архива и папки и файлы каждой папки.
+        Архив открывается и оглавление строится один раз в каждом процессе
+        '''
+        key = (getpid(), self.zip_path)
+        opened = opened_zip_files.get(key)
+        if opened is not None:
+            return opened
+        zip_file = zipfile.ZipFile(self.zip_path)
+        names = [info.filename for info in zip_file.infolist() if not info.is_dir()]
+        top = {name.split('/', 1)[0] for name in names}
+        root = ''
+        if len(top) == 1 and all('/' in name for name in names):
+            root = top.pop() + '/'
+        members = {}
+        tree = {'': (set(), [])}
+        for info in zip_file.infolist():
+            if info.is_dir() or not info.filename.startswith(root):
+                continue
+            name = info.filename[len(root):]
+            members[name] = info
+            parts = name.split('/')
+            parent = ''
+            for part in parts[:-1]:
+                tree[parent][0].add(part)
+                parent = f'{parent}/{part}' if parent else part
+                tree.setdefault(parent, (set(), []))
+            tree[parent][1].append(parts[-1])
+        opened = opened_zip_files[key] = (zip_file, members, tree)
+        return opened
+
+    def get_member_name(self, path: str) -> str:
+        '''
+        Возвращает путь внутри архива
+        `path`: путь вида `<архив>.zip/<путь внутри архива>`
+        '''
+        if not path.startswith(self.zip_path):
+            raise FileNotFoundError(f'{path} находится вне архива {self.zip_path}')
+        return path[len(self.zip_path):].replace('\\', '/').strip('/')
+
+    def get_info(self, file_path: str) -> zipfile.ZipInfo:
+        info = self.get_zip()[1].get(self.get_member_name(file_path))
+        if info is None:
+            raise FileNotFoundError(f'{file_path} не найден в архиве')
+        return info
+
+    def list_dirs(self, path: str) -> List[str]:
+        '''
+        Возвращает пути до всех папок, находящихся в папке `path` внутри архива
+        `path`: путь до папки
+        '''
+        dirs, _ = self.get_zip()[2].get(self.get_member_name(path), (set(), []))
+        return [join(path, name) for name in sorted(dirs)]
+
+    def list_files(self, path: str, ext: list) -> List[str]:
+        '''
+        Возвращает пути до всех файлов с расширениями из `ext`, находящихся в папке `path` внутри архива
+        `path`: путь до папки
+        `ext`: расширения файлов
+        '''
+        _, files = self.get_zip()[2].get(self.get_member_name(path), (set(), []))
+        return [join(path, name) for name in files if splitext(name)[1] in ext]
+
+    def is_dir(self, path: str) -> bool:
+        return path.startswith(self.zip_path) and self.get_member_name(path) in self.get_zip()[2]
+
+    def is_file(self, path: str) -> bool:
+        return path.startswith(self.zip_path) and self.get_member_name(path) in self.get_zip()[1]
+
+    def open(self, file_path: str, default_encoding: str = 'cp1251') -> ArchiveFile:
+        '''
+        Читает файл из архива. Файл распаковывается в память как байты и не декодируется целиком
+        `file_path`: путь до файла
+        `default_encoding`: кодировка, если она не указана в самом файле
+        '''
+        data = self.get_zip()[0].read(self.get_info(file_path))
+        return ArchiveFile(data, sniff_encoding(data[:charset_sniff_size], default_encoding), file_path)
+
+    def get_fingerprint(self, file_path: str) -> Tuple[int, int]:
+        '''
+        Возвращает размер файла в архиве в байтах и время его изменения в наносекундах
+        `file_path`: путь до файла
+        '''
+        info = self.get_info(file_path)
+        return info.file_size, int(datetime(*info.date_time).timestamp()) * 10 ** 9
+
+    def get_hash(self, file_path: str) -> str:
+        '''
+        Возвращает вместо хэша содержимого контрольную сумму `CRC-32` файла из оглавления архива, не распаковывая файл.
+        `ParseCache` считает ее хэшем содержимого: совпадение `CRC-32` при измененном содержимом маловероятно,
+        но, в отличие от `sha256` распакованных файлов, возможно
+        `file_path`: путь до файла
+        '''
+        return f'crc32:{self.get_info(file_path).CRC:08x}'
+
+    def close(self) -> None:
+        '''
+        Закрывает архив, если он был открыт в текущем процессе
+        '''
+        opened = opened_zip_files.pop((getpid(), self.zip_path), None)
+        if opened is not None:
+            opened[0].close()
+
+
+directory_source = DirectorySource()
+
+
+def get_archive_source(archive_path: str) -> DirectorySource | ZipSource:
+    '''
+    Возвращает источник файлов архива VK: `ZipSource`, если указан `.zip` архив, иначе `DirectorySource`
+    `archive_path`: путь до папки архива или до `.zip` архива
+    '''
+    if isfile(archive_path) and zipfile.is_zipfile(archive_path):
+        return ZipSource(archive_path)
+    return directory_source
@@ -0,0 +1,244 @@
+'''
+Генератор синтетического архива VK в кодировке `cp1251` с разметкой, которую ожидают обработчики `html_parsers`:
+диалоги из нескольких файлов `messagesK.html`, альбомы фото, лайкнутые фото и `documents.html`.
+
+Запуск из корня репозитория:
+```
+python -m benchmarks.archive_generator bench/Archive --dialogs 200 --pages 5 --base-url http://127.0.0.1:8765
+```
+Если указан `--base-url`, все ссылки архива ведут на `benchmarks.mock_cdn`, иначе - на vk.com и userapi.com.
+'''
+import argparse
+import random
+from os import makedirs
+from os.path import dirname, join
+from typing import Dict, List
+
+months = ['янв', 'фев', 'мар', 'апр', 'мая', 'июн', 'июл', 'авг', 'сен', 'окт', 'ноя', 'дек']
+
+page_head = (
+    '<!DOCTYPE html><html><head>'
+    '<meta http-equiv="Content-Type" content="text/html; charset=windows-1251"><title>VK</title>'
+    '</head><body><div class="page_header">'
+    '<div class="ui_crumb">{crumb}</div>'
+    '</div><div class="wrap_page_content">'
+)
+page_tail = '</div></body></html>'
+
+# Количество сообщений в одном файле `messagesK.html` настоящего архива, `K` растет с этим шагом
+archive_page_step = 50
+
+
+class LinkFactory():
+    def __init__(self, base_url: str | None = None) -> None:
+        '''
+        Создает ссылки архива
+        `base_url`: адрес `benchmarks.mock_cdn`. Если не указан, ссылки ведут на vk.com и userapi.com
+        '''
+        self.base_url = base_url.rstrip('/') if base_url else None
+
+    def make(self, host: str, path: str) -> str:
+        if self.base_url is None:
+            return f'https://{host}/{path}'
+        # Адрес исходного сервера сохраняется в пути, чтобы `data_downloader` распознал тип ссылки
+        return f'{self.base_url}/{host}/{path}'
+
+    def image(self, name: str) -> str:
+        return self.make(f'sun9-{len(name) % 90}.userapi.com', f'impf/{name}.jpg?size=604x453&quality=96&type=album')
+
+    def photo_page(self, owner_id: int, photo_id: int) -> str:
+        return self.make('vk.com', f'photo{owner_id}_{photo_id}')
+
+    def doc_page(self, owner_id: int, doc_id: int) -> str:
+        return self.make('vk.com', f'doc{owner_id}_{doc_id}?hash=a{doc_id:x}')
+
+
+def write_page(path: str, content: str) -> int:
+    '''
+    Записывает страницу архива в `cp1251` и возвращает ее размер в байтах
+    `path`: путь до файла
+    `content`: содержимое страницы
+    '''
+    makedirs(dirname(path), exist_ok=True)
+    data = content.encode('cp1251')
+    with open(path, 'wb') as f:
+        f.write(data)
+    return len(data)
+
+
+def random_date(rnd: random.Random, year: int) -> str:
+    return f'{rnd.randint(1, 28)} {rnd.choice(months)} {year}'
+
+
+def message_attachment(rnd: random.Random, links: LinkFactory, dialog: int, page: int, message: int) -> str:
+    '''
+    Возвращает ссылку вложения сообщения: чаще всего изображение, реже страница фото, документ или внешняя ссылка
+    '''
+    kind = rnd.random()
+    if kind < 0.6:
+        return links.image(f'c{dialog}_{page}_{message}')
+    elif kind < 0.8:
+        return links.photo_page(dialog, page * archive_page_step + message)
+    elif kind < 0.95:
+        return links.doc_page(dialog, page * archive_page_step + message)
+    return f'https://github.com/user{dialog}/repo{message}'
+
+
+def generate_messages(
+    root: str,
+    rnd: random.Random,
+    links: LinkFactory,
+    dialogs: int,
+    pages: int,
+    messages: int,
+    attachment_share: float
+) -> Dict[str, int]:
+    stats = {'files': 0, 'bytes': 0, 'links': 0}
+    for dialog in range(dialogs):
+        # Каждый третий диалог - беседа, ее папка начинается с `-`
+        dialog_id = f'-{2000000000 + dialog}' if dialog % 3 == 0 else f'{100000 + dialog}'
+        for page in range(pages):
+            parts = [page_head.format(crumb=f'Собеседник {dialog}')]
+            for message in range(messages):
+                attachment = ''
+                if rnd.random() < attachment_share:
+                    href = message_attachment(rnd, links, dialog, page, message)
+                    attachment = (
+                        '<div class="kludges"><div class="attachment">'
+                        '<div class="attachment__description">Фотография</div>'
+                        f'<a class="attachment__link" href="{href}">{href}</a></div></div>'
+                    )
+                    stats['links'] += 1
+                parts.append(
+                    f'<div class="item"><div class="item__main"><div class="message" data-id="{message}">'
+                    f'<div class="message__header"><a href="https://vk.com/id{dialog}">Имя Фамилия</a>, '
+                    f'{random_date(rnd, 2020)} в {rnd.randint(0, 23)}:{rnd.randint(0, 59):02}:00</div>'
+                    f'<div>Текст сообщения {message}{attachment}</div></div></div></div>\n'
+                )
+            parts.append(page_tail)
+            path = join(root, 'messages', dialog_id, f'messages{page * archive_page_step}.html')
+            stats['bytes'] += write_page(path, ''.join(parts))
+            stats['files'] += 1
+    return stats
+
+
+def generate_photos(root: str, rnd: random.Random, links: LinkFactory, albums: int, photos: int) -> Dict[str, int]:
+    stats = {'files': 0, 'bytes': 0, 'links': 0}
+    for album in range(albums):
+        parts = [page_head.format(crumb=f'Альбом {album}')]
+        for photo in range(photos):
+            parts.append(
+                f'<div class="item"><div class="clear_fix">{random_date(rnd, 2021)} в 12:00</div>'
+                f'<img src="{links.image(f"a{album}_{photo}")}"></div>\n'
+            )
+        parts.append(page_tail)
+        stats['bytes'] += write_page(join(root, 'photos', 'photo-albums', f'album{album}.html'), ''.join(parts))
+        stats['files'] += 1
+        stats['links'] += photos
+    return stats
+
+
+def generate_likes(root: str, links: LinkFactory, likes: int) -> Dict[str, int]:
+    parts = [page_head.format(crumb='Фотографии')]
+    for like in range(likes):
+        href = links.photo_page(1, 500000 + like)
+        parts.append(f'<div class="item"><a href="{href}">{href}</a></div>\n')
+    parts.append(page_tail)
+    return {
+        'files': 1,
+        'bytes': write_page(join(root, 'likes', 'photo', 'photo0.html'), ''.join(parts)),
+        'links': likes
+    }
+
+
+def generate_documents(root: str, rnd: random.Random, links: LinkFactory, documents: int) -> Dict[str, int]:
+    parts = [page_head.format(crumb='Документы')]
+    for doc in range(documents):
+        parts.append(
+            f'<div class="item"><div class="item__main"><a href="{links.doc_page(1, 900000 + doc)}">file{doc}.pdf</a></div>'
+            f'<div class="item__tertiary">{random_date(rnd, 2019)}\nв 11:00</div></div>\n'
+        )
+    parts.append(page_tail)
+    return {
+        'files': 1,
+        'bytes': write_page(join(root, 'profile', 'documents.html'), ''.join(parts)),
+        'links': documents
+    }
+
+
+def generate_archive(
+    root: str,
+    dialogs: int = 50,
+    pages: int = 4,
+    messages: int = 50,
+    attachment_share: float = 0.3,
+    albums: int = 5,
+    photos: int = 100,
+    likes: int = 200,
+    documents: int = 50,
+    base_url: str | None = None,
+    seed: int = 0
+) -> Dict[str, int]:
+    '''
+    Создает синтетический архив VK и возвращает количество созданных `.html` файлов (`files`),
+    их общий размер в байтах (`bytes`) и количество ссылок в них (`links`)
+    `root`: путь до папки архива
+    `dialogs`: количество диалогов
+    `pages`: количество файлов `messagesK.html` в каждом диалоге
+    `messages`: количество сообщений в одном файле
+    `attachment_share`: доля сообщений с вложением
+    `albums`: количество альбомов фото
+    `photos`: количество фото в одном альбоме
+    `likes`: количество лайкнутых фото
+    `documents`: количество документов профиля
+    `base_url`: адрес `benchmarks.mock_cdn`. Если не указан, ссылки ведут на vk.com и userapi.com
+    `seed`: начальное значение генератора случайных чисел. Одинаковые параметры дают одинаковый архив
+    '''
+    rnd = random.Random(seed)
+    links = LinkFactory(base_url)
+    parts: List[Dict[str, int]] = [
+        generate_messages(root, rnd, links, dialogs, pages, messages, attachment_share),
+        generate_photos(root, rnd, links, albums, photos),
+        generate_likes(root, links, likes),
+        generate_documents(root, rnd, links, documents)
+    ]
+    return {key: sum(part[key] for part in parts) for key in ('files', 'bytes', 'links')}
+
+
+def add_generator_arguments(parser: argparse.ArgumentParser) -> None:
+    '''
+    Добавляет в `parser` параметры архива, общие для генератора и `benchmarks.runner`
+    '''
+    parser.add_argument('--dialogs', type=int, default=50, help='количество диалогов')
+    parser.add_argument('--pages', type=int, default=4, help='количество файлов messagesK.html в диалоге')
+    parser.add_argument('--messages', type=int, default=50, help='количество сообщений в файле')
+    parser.add_argument('--attachment-share', type=float, default=0.3, help='доля сообщений с вложением')
+    parser.add_argument('--albums', type=int, default=5, help='количество альбомов фото')
+    parser.add_argument('--photos', type=int, default=100, help='количество фото в альбоме')
+    parser.add_argument('--likes', type=int, default=200, help='количество лайкнутых фото')
+    parser.add_argument('--documents', type=int, default=50, help='количество документов профиля')
+    parser.add_argument('--seed', type=int, default=0, help='начальное значение генератора случайных чисел')
+
+
+def get_generator_options(args: argparse.Namespace) -> Dict[str, int | float]:
+    return {
+        'dialogs': args.dialogs,
+        'pages': args.pages,
+        'messages': args.messages,
+        'attachment_share': args.attachment_share,
+        'albums': args.albums,
+        'photos': args.photos,
+        'likes': args.likes,
+        'documents': args.documents,
+        'seed': args.seed
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('root', help='путь до папки архива')
+    parser.add_argument('--base-url', default=None, help='адрес benchmarks.mock_cdn')
+    add_generator_arguments(parser)
+    args = parser.parse_args()
+    stats = generate_archive(args.root, base_url=args.base_url, **get_generator_options(args))
+    print(f'Создано файлов: {stats["files"]}, {stats["bytes"] / 1024 / 1024:.2f} МиБ, ссылок: {stats["links"]}')
@@ -0,0 +1,201 @@
+'''
+Локальный сервер, имитирующий vk.com и CDN изображений для ссылок из `benchmarks.archive_generator`:
+- `/vk.com/photo...`: страница фото с `og:image:secure_url`;
+- `/vk.com/doc...`: страница документа с `docUrl`;
+- любой другой путь: файл (изображение или документ).
+
+Часть страниц может отдаваться как страница ошибки VK, часть первых запросов к пути - с кодом 429 и `Retry-After`.
+Выбор зависит только от пути, поэтому повторный запуск дает те же ошибки.
+Задержка ответа и скорость отдачи файлов настраиваются.
+
+Запуск из корня репозитория:
+```
+python -m benchmarks.mock_cdn --port 8765 --latency 0.05 --bandwidth 2000000 --error-rate 0.02
+```
+'''
+import argparse
+import asyncio
+import hashlib
+import random
+import zlib
+from typing import Callable
+
+from aiohttp import web
+
+error_page_photo = (
+    '<html><head><title>Ошибка | ВКонтакте</title></head><body>'
+    '<div class="message_page_title">Ошибка</div>'
+    '<div class="message_page_body">Вы не можете просмотреть эту фотографию.\n<br></div>'
+    '</body></html>'
+)
+error_page_doc = '<html><head><title>Ошибка | ВКонтакте</title></head><body>Документ недоступен</body></html>'
+
+
+def is_selected(path: str, rate: float, salt: str) -> bool:
+    '''
+    Определяет по пути, попадает ли запрос в долю `rate`
+    '''
+    return zlib.crc32(f'{salt}{path}'.encode()) % 10000 < rate * 10000
+
+
+class MockCDN():
+    def __init__(
+        self,
+        latency: float = 0.0,
+        bandwidth: int = 0,
+        file_size: int = 64 * 1024,
+        error_rate: float = 0.0,
+        throttle_rate: float = 0.0,
+        chunk_size: int = 16 * 1024
+    ) -> None:
+        '''
+        Обработчики запросов сервера
+        `latency`: задержка перед ответом в секундах
+        `bandwidth`: скорость отдачи одного файла в байтах в секунду, `0` - без ограничения
+        `file_size`: размер отдаваемых файлов в байтах
+        `error_rate`: доля страниц фото и документов, которые отдаются как страница ошибки VK
+        `throttle_rate`: доля путей, на первый запрос к которым отвечается кодом 429
+        `chunk_size`: размер части файла, отдаваемой за один раз
+        '''
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.file_size = file_size
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.chunk_size = chunk_size
+        # Содержимое файлов отличается только началом, чтобы не тратить время сервера на генерацию данных
+        self.filler = random.Random(0).randbytes(file_size)
+        self.throttled = set()
+        self.stats = {'pages': 0, 'files': 0, 'errors': 0, 'throttled': 0, 'bytes': 0}
+
+    def create_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get('/vk.com/{name:photo.+}', self.with_delay(self.photo_page))
+        app.router.add_get('/vk.com/{name:doc.+}', self.with_delay(self.doc_page))
+        app.router.add_get('/{path:.+}', self.with_delay(self.file))
+        return app
+
+    def with_delay(self, handler: Callable) -> Callable:
+        '''
+        Добавляет к обработчику задержку ответа и ответы с кодом 429
+        '''
+        async def wrapper(request: web.Request) -> web.StreamResponse:
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            path = request.path_qs
+            if self.throttle_rate and path not in self.throttled and is_selected(path, self.throttle_rate, 'throttle'):
+                # Каждый путь ограничивается только один раз, повторный запрос будет выполнен
+                self.throttled.add(path)
+                self.stats['throttled'] += 1
+                return web.Response(status=429, headers={'Retry-After': '1'})
+            return await handler(request)
+        return wrapper
+
+    def base_url(self, request: web.Request) -> str:
+        return f'{request.scheme}://{request.host}'
+
+    async def photo_page(self, request: web.Request) -> web.Response:
+        self.stats['pages'] += 1
+        if self.error_rate and is_selected(request.path, self.error_rate, 'error'):
+            self.stats['errors'] += 1
+            return web.Response(text=error_page_photo, content_type='text/html')
+        name = request.match_info['name']
+        image = f'{self.base_url(request)}/sun9-1.userapi.com/impg/{name}.jpg?size=1280x960'
+        text = (
+            f'<html><head><title>Фотография</title>'
+            f'<meta name="og:image:secure_url" value="{image}"></head>'
+            f'<body><img src="{image}"></body></html>'
+        )
+        return web.Response(text=text, content_type='text/html')
+
+    async def doc_page(self, request: web.Request) -> web.Response:
+        self.stats['pages'] += 1
+        if self.error_rate and is_selected(request.path, self.error_rate, 'error'):
+            self.stats['errors'] += 1
+            return web.Response(text=error_page_doc, content_type='text/html')
+        doc_url = f'{self.base_url(request)}/psv4.userapi.com/{request.match_info["name"]}.pdf'.replace('/', '\\/')
+        text = (
+            '<html><head><title>Документ</title></head><body><script>'
+            f'var Docs = {{"docUrl":"{doc_url}","docBuyLink":""}};'
+            '</script></body></html>'
+        )
+        return web.Response(text=text, content_type='text/html')
+
+    async def file(self, request: web.Request) -> web.StreamResponse:
+        self.stats['files'] += 1
+        path = request.match_info['path']
+        content_type = 'application/pdf' if path.endswith('.pdf') else 'image/jpeg'
+        response = web.StreamResponse(headers={'Content-Type': content_type})
+        response.content_length = self.file_size
+        await response.prepare(request)
+        head = hashlib.sha256(request.path.encode()).digest()
+        body = memoryview(head + self.filler[len(head):])
+        for start in range(0, self.file_size, self.chunk_size):
+            chunk = body[start:start + self.chunk_size]
+            await response.write(chunk)
+            if self.bandwidth:
+                await asyncio.sleep(len(chunk) / self.bandwidth)
+        self.stats['bytes'] += self.file_size
+        await response.write_eof()
+        return response
+
+
+async def start_server(cdn: MockCDN, host: str = '127.0.0.1', port: int = 8765) -> web.AppRunner:
+    '''
+    Запускает сервер и возвращает его `AppRunner`, через который сервер останавливается (`cleanup`)
+    `cdn`: обработчики запросов
+    `host`: адрес сервера
+    `port`: порт сервера
+    '''
+    runner = web.AppRunner(cdn.create_app(), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+
+def run_server(host: str, port: int, ready=None, **options) -> None:
+    '''
+    Запускает сервер и работает до завершения процесса. Используется для запуска сервера в отдельном процессе
+    `host`: адрес сервера
+    `port`: порт сервера
+    `ready`: `multiprocessing.Event`, устанавливаемый после запуска сервера
+    `options`: параметры `MockCDN`
+    '''
+    async def serve() -> None:
+        await start_server(MockCDN(**options), host, port)
+        if ready is not None:
+            ready.set()
+        await asyncio.Event().wait()
+
+    asyncio.run(serve())
+
+
+def add_server_arguments(parser: argparse.ArgumentParser) -> None:
+    '''
+    Добавляет в `parser` параметры сервера, общие для сервера и `benchmarks.runner`
+    '''
+    parser.add_argument('--port', type=int, default=8765, help='порт сервера')
+    parser.add_argument('--latency', type=float, default=0.02, help='задержка ответа в секундах')
+    parser.add_argument('--bandwidth', type=int, default=0, help='скорость отдачи одного файла в байтах в секунду, 0 - без ограничения')
+    parser.add_argument('--file-size', type=int, default=64 * 1024, help='размер файлов в байтах')
+    parser.add_argument('--error-rate', type=float, default=0.02, help='доля страниц фото и документов с ошибкой VK')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='доля ответов с кодом 429')
+
+
+def get_server_options(args: argparse.Namespace) -> dict:
+    return {
+        'latency': args.latency,
+        'bandwidth': args.bandwidth,
+        'file_size': args.file_size,
+        'error_rate': args.error_rate,
+        'throttle_rate': args.throttle_rate
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1', help='адрес сервера')
+    add_server_arguments(parser)
+    args = parser.parse_args()
+    print(f'Сервер запущен на http://{args.host}:{args.port}')
+    run_server(args.host, args.port, **get_server_options(args))
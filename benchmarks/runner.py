@@ -0,0 +1,241 @@
+'''
+Сквозной замер производительности на синтетическом архиве: создание архива (`benchmarks.archive_generator`),
+поиск ссылок (`links_finder.VKLinkFinder`) и их скачивание через `scheduler.DownloadScheduler`
+с локального сервера `benchmarks.mock_cdn`, запущенного в отдельном процессе.
+
+Выводит скорость обработки архива (файлов/с, ссылок/с), скорость скачивания (ссылок/с, МиБ/с),
+задержку цикла событий во время скачивания и пиковое потребление памяти (RSS) основного процесса
+и процессов обработки архива.
+
+Запуск из корня репозитория:
+```
+python -m benchmarks.runner --dialogs 200 --pages 5 --html-parser lxml --latency 0.05 --bandwidth 4000000
+```
+Для сравнения с выполнением блокирующих операций в цикле событий добавьте `--no-offload-blocking`.
+'''
+import argparse
+import asyncio
+import multiprocessing
+import shutil
+import sys
+import tempfile
+import time
+from collections import Counter
+from json import dump
+from os.path import getsize, join
+from typing import Any, Dict, List
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+import data_downloader
+import metrics
+from benchmarks.archive_generator import add_generator_arguments, generate_archive, get_generator_options
+from benchmarks.mock_cdn import add_server_arguments, get_server_options, run_server
+from links_finder import VKLinkFinder
+from main import submit_links
+from retry import RetryPolicy
+from scheduler import AdaptiveLimiter, DownloadScheduler
+
+folder_names = {
+    'messages': 'messages',
+    'likes/photo': 'likes/photo',
+    'photos': 'photos/photo-albums',
+    'profile': 'profile'
+}
+# Классы скачиваний типов данных, как в `main.main`
+data_type_pools = {
+    'messages': 'small',
+    'likes/photo': 'big',
+    'photos': 'small',
+    'profile': 'big'
+}
+mib = 1024 * 1024
+# Постоянный `User-Agent`: локальному серверу он не важен, а случайный загружается из сети
+benchmark_user_agent = 'Mozilla/5.0 (X11; Linux x86_64) vk-archive-benchmark'
+# Период измерения задержки цикла событий и задержка, считающаяся остановкой, в секундах
+loop_lag_interval = 0.01
+loop_lag_threshold = 0.05
+
+
+def get_peak_rss(children: bool = False) -> float | None:
+    '''
+    Возвращает пиковое потребление памяти в МиБ или `None`, если его не удается получить
+    `children`: если `True`, возвращается максимум среди завершенных дочерних процессов
+    '''
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF)
+    # В Linux `ru_maxrss` указывается в КиБ, в macOS - в байтах
+    return usage.ru_maxrss / (mib if sys.platform == 'darwin' else 1024)
+
+
+def collect_links(info: Any) -> List[str]:
+    '''
+    Возвращает все ссылки из части `VKLinkFinder.link_info`
+    '''
+    if isinstance(info, dict):
+        return [link for value in info.values() for link in collect_links(value)]
+    if isinstance(info, list):
+        return list(info)
+    return []
+
+
+def run_parse(archive_path: str, html_parser: str, core_count: int) -> Dict[str, Any]:
+    start = time.perf_counter()
+    finder = VKLinkFinder(archive_path, folder_names, core_count=core_count, html_parser=html_parser)
+    elapsed = time.perf_counter() - start
+    links = {data_type: collect_links(info) for data_type, info in finder.link_info.items()}
+    return {'elapsed': elapsed, 'links': links}
+
+
+async def run_download(
+    links: Dict[str, List[str]],
+    output_path: str,
+    pools: Dict[str, AdaptiveLimiter],
+    retry_policy: RetryPolicy | None
+) -> Dict[str, Any]:
+    scheduler = DownloadScheduler(data_downloader.get_info, pools, retry_policy=retry_policy)
+    scheduler.start()
+    loop_lag_monitor = metrics.LoopLagMonitor(loop_lag_interval, loop_lag_threshold)
+    loop_lag_task = asyncio.create_task(loop_lag_monitor.run())
+    results = []
+    name_counters = {}
+    start = time.perf_counter()
+    async with data_downloader.create_session(user_agent=benchmark_user_agent) as session:
+        futures = []
+        for data_type, data_links in links.items():
+            futures.extend(submit_links(
+                scheduler,
+                data_type_pools[data_type],
+                results.append,
+                data_links,
+                join(output_path, data_type),
+                name_counters,
+                session=session
+            ))
+        await asyncio.gather(*futures)
+        await scheduler.stop()
+    elapsed = time.perf_counter() - start
+    loop_lag_task.cancel()
+    downloaded = sum(getsize(res['path']) for res in results if res and res.get('path'))
+    return {
+        'elapsed': elapsed,
+        'links': len(results),
+        'bytes': downloaded,
+        'file_info': Counter(res['file_info'] for res in results if res),
+        'pools': scheduler.get_stats(),
+        'loop_lag': loop_lag_monitor.get_stats()
+    }
+
+
+def start_mock_cdn(port: int, options: Dict[str, Any]) -> multiprocessing.Process:
+    '''
+    Запускает `benchmarks.mock_cdn` в отдельном процессе, чтобы сервер не занимал цикл событий замеряемого кода
+    '''
+    ready = multiprocessing.Event()
+    process = multiprocessing.Process(target=run_server, args=('127.0.0.1', port, ready), kwargs=options, daemon=True)
+    process.start()
+    if not ready.wait(10):
+        process.terminate()
+        raise RuntimeError(f'Не удалось запустить сервер на порту {port}')
+    return process
+
+
+def main(args: argparse.Namespace) -> Dict[str, Any]:
+    workdir = args.workdir or tempfile.mkdtemp(prefix='vk_bench_')
+    archive_path = join(workdir, 'Archive')
+    report = {'html_parser': args.html_parser, 'offload_blocking': not args.no_offload_blocking}
+    data_downloader.offload_blocking = not args.no_offload_blocking
+    try:
+        base_url = f'http://127.0.0.1:{args.port}'
+        archive = generate_archive(archive_path, base_url=base_url, **get_generator_options(args))
+        report['archive'] = archive
+        print(f'Архив: {archive["files"]} файлов, {archive["bytes"] / mib:.2f} МиБ, {archive["links"]} ссылок')
+
+        parse = run_parse(archive_path, args.html_parser, args.core_count)
+        links_count = sum(len(links) for links in parse['links'].values())
+        report['parse'] = {
+            'elapsed': parse['elapsed'],
+            'files_per_second': archive['files'] / parse['elapsed'],
+            'links': links_count,
+            'links_per_second': links_count / parse['elapsed'],
+            'workers_peak_rss_mib': get_peak_rss(children=True)
+        }
+        print(
+            f'Обработка архива ({args.html_parser}): {parse["elapsed"]:.2f} с, '
+            f'{report["parse"]["files_per_second"]:.1f} файлов/с, {report["parse"]["links_per_second"]:.1f} ссылок/с'
+        )
+
+        if not args.skip_download:
+            server = start_mock_cdn(args.port, get_server_options(args))
+            pools = {
+                'small': AdaptiveLimiter('small', args.small, args.small if args.fixed_concurrency else 1, args.small_max),
+                'big': AdaptiveLimiter('big', args.big, args.big if args.fixed_concurrency else 1, args.big_max)
+            }
+            try:
+                download = asyncio.run(run_download(
+                    parse['links'],
+                    join(workdir, 'output'),
+                    pools,
+                    RetryPolicy() if args.retry else None
+                ))
+            finally:
+                server.terminate()
+                server.join()
+            report['download'] = {
+                'elapsed': download['elapsed'],
+                'links': download['links'],
+                'links_per_second': download['links'] / download['elapsed'],
+                'mib': download['bytes'] / mib,
+                'mib_per_second': download['bytes'] / mib / download['elapsed'],
+                'file_info': dict(download['file_info']),
+                'pools': download['pools'],
+                'loop_lag': download['loop_lag']
+            }
+            print(
+                f'Скачивание: {download["links"]} ссылок за {download["elapsed"]:.2f} с, '
+                f'{report["download"]["links_per_second"]:.1f} ссылок/с, '
+                f'{report["download"]["mib"]:.2f} МиБ, {report["download"]["mib_per_second"]:.2f} МиБ/с'
+            )
+            print(f'Результаты: {report["download"]["file_info"]}')
+            print(
+                f'Задержка цикла событий: максимум {download["loop_lag"]["max_lag"] * 1000:.1f} мс, '
+                f'задержек от {loop_lag_threshold * 1000:g} мс: {download["loop_lag"]["stalls"]}'
+            )
+
+        report['peak_rss_mib'] = get_peak_rss()
+        if report['peak_rss_mib'] is not None:
+            print(
+                f'Пиковый RSS: основной процесс {report["peak_rss_mib"]:.1f} МиБ, '
+                f'процессы обработки архива {report["parse"]["workers_peak_rss_mib"]:.1f} МиБ'
+            )
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workdir', default=None, help='папка для архива и скачанных файлов. Если не указана, используется временная папка, которая будет удалена')
+    parser.add_argument('--html-parser', default='bs4', help='обработчик .html файлов: bs4, lxml, selectolax, stream или bytes')
+    parser.add_argument('--core-count', type=int, default=0, help='количество процессов обработки архива, 0 - по числу ядер')
+    parser.add_argument('--skip-download', action='store_true', help='замерить только обработку архива')
+    parser.add_argument('--small', type=int, default=10, help='начальное количество одновременных скачиваний small')
+    parser.add_argument('--small-max', type=int, default=40, help='максимальное количество одновременных скачиваний small')
+    parser.add_argument('--big', type=int, default=4, help='начальное количество одновременных скачиваний big')
+    parser.add_argument('--big-max', type=int, default=8, help='максимальное количество одновременных скачиваний big')
+    parser.add_argument('--fixed-concurrency', action='store_true', help='не уменьшать количество одновременных скачиваний при ошибках')
+    parser.add_argument('--retry', action='store_true', help='повторять неудачные скачивания по политике retry.RetryPolicy')
+    parser.add_argument('--no-offload-blocking', action='store_true', help='выполнять блокирующие операции скачивания в цикле событий')
+    parser.add_argument('--json', default=None, help='путь до файла для сохранения результатов в JSON')
+    add_generator_arguments(parser)
+    add_server_arguments(parser)
+    args = parser.parse_args()
+    report = main(args)
+    if args.json:
+        with open(args.json, 'w', encoding='utf8') as f:
+            dump(report, f, indent=4, ensure_ascii=False)
@@ -0,0 +1,94 @@
+'''
+Сравнение переиспользования соединений: отдельная сессия на каждый тип данных (как было раньше)
+против одной общей сессии `data_downloader.create_session`.
+
+Запуск из корня репозитория:
+```
+python -m benchmarks.session_reuse --requests 2000 --concurrency 10
+```
+'''
+import argparse
+import asyncio
+import time
+from typing import Dict
+
+import aiohttp
+from aiohttp import web
+
+import data_downloader
+
+data_types = ('messages', 'likes/photo', 'photos', 'profile')
+
+
+async def start_server(port: int, connections: set) -> web.AppRunner:
+    '''
+    Запускает локальный сервер, который отдает небольшое изображение и запоминает все открытые с ним соединения
+    `port`: порт сервера
+    `connections`: множество, в которое будут добавлены адреса клиентов
+    '''
+    body = b'\xff\xd8' + b'0' * 4096
+
+    async def handler(request: web.Request) -> web.Response:
+        connections.add(request.transport.get_extra_info('peername'))
+        return web.Response(body=body, content_type='image/jpeg')
+
+    app = web.Application()
+    app.router.add_get('/{name}', handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, '127.0.0.1', port).start()
+    return runner
+
+
+async def fetch_all(session: aiohttp.ClientSession, urls: list, concurrency: int) -> None:
+    sema = asyncio.BoundedSemaphore(concurrency)
+
+    async def fetch(url: str) -> None:
+        async with sema:
+            async with session.get(url) as response:
+                await response.read()
+
+    await asyncio.gather(*(fetch(url) for url in urls))
+
+
+async def per_type_sessions(urls_by_type: Dict[str, list], concurrency: int) -> None:
+    '''
+    Прежнее поведение: новая сессия и новый TCP коннектор для каждого типа данных, типы обрабатываются по очереди
+    '''
+    for urls in urls_by_type.values():
+        async with aiohttp.ClientSession(connector=data_downloader.get_ssl_context_tcp_connector()) as session:
+            await fetch_all(session, urls, concurrency)
+
+
+async def shared_session(urls_by_type: Dict[str, list], concurrency: int) -> None:
+    '''
+    Новое поведение: одна сессия на все типы данных. Типы обрабатываются по очереди, чтобы сравнивать только
+    переиспользование соединений
+    '''
+    async with data_downloader.create_session(user_agent='VKArchiveDownloader benchmark') as session:
+        for urls in urls_by_type.values():
+            await fetch_all(session, urls, concurrency)
+
+
+async def main(requests_count: int, concurrency: int, port: int) -> None:
+    urls_by_type = {
+        data_type: [f'http://127.0.0.1:{port}/{n}_{i}.jpg' for i in range(requests_count // len(data_types))]
+        for n, data_type in enumerate(data_types)
+    }
+    for name, func in (('per_type_sessions', per_type_sessions), ('shared_session', shared_session)):
+        connections = set()
+        runner = await start_server(port, connections)
+        start = time.perf_counter()
+        await func(urls_by_type, concurrency)
+        elapsed = time.perf_counter() - start
+        await runner.cleanup()
+        print(f'{name}: {elapsed:.2f} s, {requests_count / elapsed:.0f} req/s, TCP соединений: {len(connections)}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=2000, help='общее количество запросов')
+    parser.add_argument('--concurrency', type=int, default=10, help='количество одновременных запросов на тип данных')
+    parser.add_argument('--port', type=int, default=8787, help='порт локального сервера')
+    args = parser.parse_args()
+    asyncio.run(main(args.requests, args.concurrency, args.port))
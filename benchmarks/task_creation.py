@@ -0,0 +1,78 @@
+'''
+Скорость создания задач на скачивание: прежний `file_name=links.index(v)` (квадратичная сложность)
+против `main.submit_links` (линейная сложность).
+
+Запуск из корня репозитория:
+```
+python -m benchmarks.task_creation --links 100000 --max-seconds 2
+```
+Завершается с кодом 1, если `submit_links` создает задачи дольше `--max-seconds` секунд
+или выдает повторяющиеся номера файлов.
+'''
+import argparse
+import asyncio
+import sys
+import time
+
+from main import submit_links
+
+
+class DummyScheduler():
+    '''
+    Планировщик, который только запоминает задачи, ничего не выполняя
+    '''
+    def __init__(self) -> None:
+        self.jobs = []
+
+    def submit(self, pool: str, on_result=None, **kwargs) -> asyncio.Future:
+        self.jobs.append(kwargs)
+        return asyncio.get_running_loop().create_future()
+
+
+def index_submit(scheduler: DummyScheduler, links: list, save_path: str) -> None:
+    '''
+    Прежнее поведение обработчиков
+    '''
+    [scheduler.submit('small', None, url=v, save_path=save_path, file_name=links.index(v)) for v in links]
+
+
+async def main(links_count: int, index_links_count: int, max_seconds: float) -> int:
+    # Каждая десятая ссылка повторяется, как пересланные фото в диалогах
+    photo_ids = [i - 9 if i % 10 == 9 else i for i in range(links_count)]
+    links = [f'https://sun9-{n % 90}.userapi.com/photo_{n}.jpg' for n in photo_ids]
+
+    scheduler = DummyScheduler()
+    start = time.perf_counter()
+    index_submit(scheduler, links[:index_links_count], 'output/likes')
+    index_elapsed = time.perf_counter() - start
+    index_names = len({job['file_name'] for job in scheduler.jobs})
+    print(f'links.index: {index_links_count} ссылок за {index_elapsed:.3f} с, уникальных номеров: {index_names}')
+
+    scheduler = DummyScheduler()
+    start = time.perf_counter()
+    submit_links(scheduler, 'small', {}, links, 'output/likes', {})
+    elapsed = time.perf_counter() - start
+    names = len({job['file_name'] for job in scheduler.jobs})
+    print(f'submit_links: {links_count} ссылок за {elapsed:.3f} с, уникальных номеров: {names}')
+
+    if names != links_count:
+        print('Ошибка: номера файлов повторяются')
+        return 1
+    if elapsed > max_seconds:
+        print(f'Ошибка: создание задач заняло больше {max_seconds} с')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--links', type=int, default=100000, help='количество ссылок')
+    parser.add_argument(
+        '--index-links',
+        type=int,
+        default=20000,
+        help='количество ссылок для прежнего поведения (квадратичная сложность, 100000 ссылок обрабатываются минуты)'
+    )
+    parser.add_argument('--max-seconds', type=float, default=2, help='допустимое время создания задач')
+    args = parser.parse_args()
+    sys.exit(asyncio.run(main(args.links, args.index_links, args.max_seconds)))
@@ -1,17 +1,31 @@
 import asyncio
+import hashlib
+import re
 import ssl
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from configparser import ConfigParser
-from os.path import join
+from contextlib import nullcontext, suppress
+from functools import partial
+from html import unescape
+from os import replace
+from os.path import dirname, getsize, join, split
 from traceback import format_exc
-from typing import Coroutine, Dict
+from typing import Any, BinaryIO, Callable, Coroutine, Dict, List, Tuple
 
-import aiofiles
 import aiohttp
-from bs4 import BeautifulSoup
 from latest_user_agents import get_random_user_agent
 
+import metrics
 import tools
+from archive_reader import charset_sniff_size, sniff_encoding
+from dedup import FileDeduplicator
+from link_classifier import LinkClassifier
 from logger import create_logger
+from manifest import DownloadManifest
+from rate_limiter import HostRateLimiter
+from retry import parse_retry_after
+from scheduler import JobDeferred
 
 config = ConfigParser()
 config_read = config.read('config.ini', encoding='utf8')
@@ -20,6 +34,35 @@ if config_read:
     log_level = config['main_parameters'].get('log_level', 'DEBUG')
 logger = create_logger('logs/vk_parser.log', 'data_downloader', log_level)
 
+# Размер буфера скачиваемого файла в байтах: данные записываются на диск, когда буфер заполнен
+download_buffer_size = 1024 * 1024
+if config_read:
+    download_buffer_size = int(config['main_parameters'].get('download_buffer_size', download_buffer_size))
+# Правила классификации ссылок, которые не нужно скачивать
+link_rules_file = 'link_rules.txt'
+if config_read:
+    link_rules_file = config['main_parameters'].get('link_rules_file', link_rules_file)
+links_classifier = LinkClassifier.from_file(link_rules_file)
+# Ограничение частоты запросов к страницам VK, серверам файлов и остальным сайтам
+rate_limiter = HostRateLimiter.from_config(
+    config['connection_parameters'] if config.has_section('connection_parameters') else {}
+)
+# Размер части файла, читаемой из сети за один раз
+read_chunk_size = 64 * 1024
+# Потоки записи скачиваемых файлов на диск, чтобы запись и подсчет хэша не останавливали цикл событий
+file_writer_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='file_writer')
+# Выполнять ли блокирующие операции (создание папок, разбор страниц документов) в потоках `blocking_executor`,
+# а операции с `manifest` и файлами `dedup` - в потоке `state_executor`.
+# `False` - выполнять в цикле событий, как раньше, например, для сравнения скорости скачивания
+offload_blocking = True
+if config_read:
+    offload_blocking = config['main_parameters'].getboolean('offload_blocking', offload_blocking)
+# Потоки для блокирующих операций, чтобы они не останавливали цикл событий
+blocking_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='blocking')
+# Поток для записей `manifest` и файлов `dedup`: запросы к SQLite и проверки файлов на диске
+# выполняются по одному, не останавливая цикл событий
+state_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='state')
+
 error_titles = [
     'Ошибка | ВКонтакте',
     'Ошибка',
@@ -29,6 +72,126 @@ error_titles = [
 
 error_titles_html = [f'<title>{x}</title>' for x in error_titles]
 
+# Размер части страницы фото VK, читаемой за один раз при поиске ссылки на фото
+photo_page_chunk_size = 16 * 1024
+photo_meta_pattern = re.compile(rb'<meta\s[^>]*?(?:name|property)\s*=\s*["\']og:image:secure_url["\'][^>]*>', re.IGNORECASE)
+meta_value_pattern = re.compile(rb'\s(?:value|content)\s*=\s*(?:"([^"]*)"|\'([^\']*)\')', re.IGNORECASE)
+message_page_pattern = re.compile(
+    rb'<div[^>]*\sclass\s*=\s*["\'][^"\']*\bmessage_page_(title|body)\b[^"\']*["\'][^>]*>(.*?)</div>',
+    re.IGNORECASE | re.DOTALL
+)
+markup_pattern = re.compile(rb'<[^>]*>')
+
+
+class ResponseStatusError(Exception):
+    def __init__(self, status: int, retry_after: str | None = None) -> None:
+        '''
+        Ответ сервера с неожиданным кодом состояния
+        `status`: код состояния ответа
+        `retry_after`: значение заголовка `Retry-After`, если есть
+        '''
+        super().__init__(f'Response status: {status}')
+        self.status = status
+        self.retry_after = retry_after
+
+
+class VKErrorPageError(Exception):
+    '''
+    Вместо файла VK вернул страницу с ошибкой доступа
+    '''
+
+
+def check_response_status(response: aiohttp.ClientResponse) -> None:
+    '''
+    Вызывает `ResponseStatusError`, если код состояния ответа не `200`.
+    При ответе `429` запросы к хосту приостанавливаются на время из заголовка `Retry-After`
+    `response`: ответ на запрос
+    '''
+    if response.status != 200:
+        retry_after = response.headers.get('Retry-After')
+        if response.status == 429:
+            rate_limiter.pause(str(response.url), parse_retry_after(retry_after))
+        raise ResponseStatusError(response.status, retry_after)
+
+
+def get_error_class(e: Exception) -> str:
+    '''
+    Возвращает класс ошибки скачивания:
+    - `timeout`: тайм-аут
+    - `throttled`: слишком много запросов (`429`)
+    - `server_error`: ошибка сервера (`5xx`)
+    - `connection_error`: разрыв или ошибка соединения
+    - `vk_error_page`: VK вернул страницу с ошибкой доступа
+    - `error`: любая другая ошибка
+    `e`: ошибка
+    '''
+    if isinstance(e, asyncio.TimeoutError):
+        return 'timeout'
+    if isinstance(e, VKErrorPageError):
+        return 'vk_error_page'
+    if isinstance(e, ResponseStatusError):
+        if e.status == 429:
+            return 'throttled'
+        if e.status >= 500:
+            return 'server_error'
+        return 'error'
+    if isinstance(e, (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError, ConnectionError)):
+        return 'connection_error'
+    return 'error'
+
+
+def get_ssl_context_tcp_connector(
+    disable_ssl: bool = False,
+    limit: int = 100,
+    limit_per_host: int = 0,
+    ttl_dns_cache: int | None = 300,
+    keepalive_timeout: float = 30
+) -> aiohttp.TCPConnector:
+    '''
+    Возвращает TCP коннектор с настроенным SSL контекстом и пулом соединений
+    `disable_ssl`: отключить ли проверку SSL сертификата
+    `limit`: максимальное количество одновременных соединений. `0` - без ограничений
+    `limit_per_host`: максимальное количество одновременных соединений с одним хостом. `0` - без ограничений
+    `ttl_dns_cache`: время хранения результатов DNS запросов в секундах. `None` - хранить всегда
+    `keepalive_timeout`: время в секундах, в течение которого неиспользуемое соединение остается открытым
+    '''
+    ssl_context = ssl.create_default_context()
+    if disable_ssl:
+        ssl_context.check_hostname = False
+        ssl_context.verify_mode = ssl.CERT_NONE
+    else:
+        ssl_context.check_hostname = True
+        ssl_context.verify_mode = ssl.CERT_REQUIRED
+    return aiohttp.TCPConnector(
+        ssl=ssl_context,
+        limit=limit,
+        limit_per_host=limit_per_host,
+        use_dns_cache=True,
+        ttl_dns_cache=ttl_dns_cache,
+        keepalive_timeout=keepalive_timeout
+    )
+
+
+def create_session(disable_ssl: bool = False, user_agent: str | None = None, **connector_options) -> aiohttp.ClientSession:
+    '''
+    Создает сессию ClientSession, общую для всех обработчиков.
+    Одна сессия переиспользует соединения, DNS кэш и SSL контекст для всех типов данных
+    `disable_ssl`: отключить ли проверку SSL сертификата
+    `user_agent`: заголовок `User-Agent`. Если не указан, будет выбран случайный из актуальных
+    `connector_options`: параметры пула соединений для `get_ssl_context_tcp_connector`
+
+    Время и количество выполняемых запросов сессии учитываются в `metrics`
+    '''
+    headers = {
+        'Accept-Language': 'ru',
+        'User-Agent': user_agent if user_agent is not None else get_random_user_agent()
+    }
+    return aiohttp.ClientSession(
+        headers=headers,
+        connector=get_ssl_context_tcp_connector(disable_ssl, **connector_options),
+        trace_configs=[metrics.create_trace_config()]
+    )
+
 
 def get_response_info(content_type: str) -> Dict[str, str]:
     '''
@@ -80,112 +243,459 @@ def get_file_name_by_link(link: str) -> str | None:
         return None
 
 
-def check_vk_title_error(soup: BeautifulSoup) -> str | bool:
+async def run_blocking(func: Callable, *args) -> Any:
+    '''
+    Выполняет блокирующую функцию в потоке `blocking_executor`, если включен `offload_blocking`, иначе - в цикле событий
+    `func`: функция
+    `args`: аргументы функции
+    '''
+    if not offload_blocking:
+        return func(*args)
+    return await asyncio.get_running_loop().run_in_executor(blocking_executor, func, *args)
+
+
+async def run_state(func: Callable, *args, **kwargs) -> Any:
     '''
-    Проверяет наличие ошибки доступа к содержимому VK
-    `soup`: экземпляр `BeautifulSoup` для работы с `HTML` контентом
+    Выполняет операцию с `manifest` или файлами `dedup` в потоке `state_executor`,
+    если включен `offload_blocking`, иначе - в цикле событий
+    `func`: функция
+    `args`, `kwargs`: аргументы функции
+    '''
+    if not offload_blocking:
+        return func(*args, **kwargs)
+    return await asyncio.get_running_loop().run_in_executor(state_executor, partial(func, *args, **kwargs))
+
+
+def check_vk_title_error(page: bytes, encoding: str) -> str | bool:
+    '''
+    Проверяет наличие ошибки доступа к содержимому VK по блокам `message_page_title` и `message_page_body`.
+    Страница не разбирается целиком: декодируется только текст этих блоков
+    `page`: страница VK
+    `encoding`: кодировка страницы
 
     Возвращает:
-    - `True`: Ошибки нет
-    - `False`: Ошибки есть (ошибки доступа, недоступности, скрытия)
-    '''
-    mes = soup.find('div', class_='message_page_title')
-    if mes is not None:
-        if any(ext in mes.text for ext in error_titles):
-            details = soup.find('div', class_='message_page_body').text.strip().split('\n')[0]
-            return details
+    - текст ошибки: Ошибки есть (ошибки доступа, недоступности, скрытия)
+    - `False`: Ошибки нет
+    '''
+    blocks = {}
+    for found in message_page_pattern.finditer(page):
+        blocks.setdefault(found.group(1).lower(), found.group(2))
+    title = blocks.get(b'title')
+    if title is None:
+        return False
+    title = unescape(markup_pattern.sub(b'', title).decode(encoding, errors='replace'))
+    if any(ext in title for ext in error_titles):
+        body = unescape(markup_pattern.sub(b'', blocks.get(b'body', b'')).decode(encoding, errors='replace'))
+        return body.strip().split('\n')[0]
     return False
 
 
+async def find_photo_url(response: aiohttp.ClientResponse) -> str | None:
+    '''
+    Возвращает ссылку на фото из мета-тега `og:image:secure_url` страницы фото VK или `None`, если ее нет.
+    Страница читается по частям и не разбирается в дерево: чтение прекращается, как только найден мета-тег
+    в `<head>`, поэтому остаток страницы не загружается, а ответ освобождается. Если мета-тега нет, страница дочитывается
+    и проверяется на ошибку доступа VK
+    `response`: ответ со страницей фото
+    '''
+    page = bytearray()
+    async for chunk in response.content.iter_chunked(photo_page_chunk_size):
+        # Мета-тег мог начаться в конце предыдущей части
+        start = max(page.rfind(b'<'), 0)
+        page += chunk
+        found = photo_meta_pattern.search(page, start)
+        if found is not None:
+            value = meta_value_pattern.search(found.group(0))
+            if value is not None:
+                link = (value.group(1) if value.group(1) is not None else value.group(2)).decode(response.charset or 'utf8')
+                # Недочитанный ответ освобождается сразу: соединение с остатком страницы закрывается,
+                # а не возвращается в пул
+                response.release()
+                return unescape(link)
+    encoding = response.charset or sniff_encoding(bytes(page[:charset_sniff_size]), 'utf8')
+    check = check_vk_title_error(bytes(page), encoding)
+    if check:
+        raise VKErrorPageError(f'Ошибка доступа к фото: {check}')
+    return None
+
+
+def get_doc_url(text: str | bytes, encoding: str | None = None) -> str:
+    '''
+    Возвращает ссылку на файл со страницы документа VK
+    `text`: текст страницы документа или сама страница, если она еще не декодирована
+    `encoding`: кодировка страницы. Если не указана, определяется по `<meta charset>`
+    '''
+    if isinstance(text, bytes):
+        text = text.decode(encoding or sniff_encoding(text[:charset_sniff_size], 'utf8'), errors='replace')
+    doc_url_pattern = 'docUrl":"'
+    doc_buy_pattern = '","docBuyLink'
+    if any(ext in text for ext in error_titles_html):
+        raise VKErrorPageError('Ошибка доступа к документу')
+    first = text.find(doc_url_pattern)
+    if first == -1:
+        raise ValueError('Ссылка на документ не найдена на странице')
+    second = text.find(doc_buy_pattern, first)
+    return text[first + len(doc_url_pattern):second].replace('\\/', '/')
+
+
+def get_manifest_record(manifest: DownloadManifest, url: str, save_path: str) -> Tuple[Dict[str, Any] | None, Dict[str, str] | None]:
+    '''
+    Возвращает запись о скачивании из `manifest` и результат обработки ссылки, если она уже обработана
+    `manifest`: хранилище информации о скачиваниях
+    `url`: исходная ссылка
+    `save_path`: папка сохранения
+    '''
+    record = manifest.get(url, save_path)
+    return record, manifest.get_complete_result(record)
+
+
+def reserve_request(url: str) -> None:
+    '''
+    Занимает запрос по ссылке `url` в `rate_limiter`, не дожидаясь допустимой частоты запросов.
+    Если запрос нужно отложить, выбрасывает `JobDeferred`: `DownloadScheduler` вернет задачу в очередь
+    ко времени занятого запроса, и место одновременного скачивания не будет занято на время ожидания
+    `url`: ссылка
+    '''
+    delay = rate_limiter.try_acquire(url)
+    if delay > 0:
+        raise JobDeferred(delay)
+
+
+async def fetch_resolved_url(
+    url: str,
+    resolved_url: str,
+    save_path: str,
+    file_name: str,
+    session: aiohttp.ClientSession,
+    manifest: DownloadManifest,
+    dedup: FileDeduplicator | None = None
+) -> Dict[str, str] | None:
+    '''
+    Скачивает файл по найденной ранее ссылке, не загружая страницу документа VK.
+    Возвращает `None`, если ссылка устарела: в этом случае она удаляется из `manifest`
+    `url`: ссылка на страницу документа VK
+    `resolved_url`: найденная ранее ссылка на файл
+    `save_path`: путь до папки, куда будет сохранен файл
+    `file_name`: имя файла, если его не удастся получить из ссылки
+    `session`: сессия ClientSession
+    `manifest`: хранилище информации о скачиваниях
+    `dedup`: поиск повторяющихся файлов
+    '''
+    reserve_request(resolved_url)
+    async with session.get(resolved_url, timeout=900) as response:
+        if response.status != 200 or 'text/html' in response.headers.get('content-type', ''):
+            logger.debug(f'Ссылка на файл для 🔗 {url} устарела ({response.status}), страница документа будет загружена заново')
+            await run_state(manifest.set_resolved_url, url, None)
+            return None
+        return await save_response(
+            response=response,
+            url=url,
+            save_path=save_path,
+            file_name=file_name,
+            name_link=resolved_url,
+            manifest=manifest,
+            dedup=dedup
+        )
+
+
 async def find_link_by_url(url: str, pattern: str, cookies=None, response=None, session: aiohttp.ClientSession = None) -> str:
     '''
     Находит ссылку на файл из документа VK. Если не найдено, возвращает переданный `url`
     `url`: ссылка на документ VK, где нужно найти ссылку
     `pattern`: паттерн для поиска
     `cookies` куки для `aiohttp.ClientResponse`
-    `response`: ответ от первого запроса, если нужен
+    `response`: ответ от первого запроса. Для документов, если не указан, страница будет загружена через `session`
     `session`: сессия ClientSession, если нужна
     '''
     if 'doc' in pattern:
-        async with session.get(url, timeout=60, cookies=cookies) as response:
-            doc_url_pattern = 'docUrl":"'
-            doc_buy_pattern = '","docBuyLink'
-            assert response.status == 200, f'Response status: {response.status}'
+        # Страница документа, уже полученная вызывающим, не загружается повторно
+        if response is None:
+            await rate_limiter.acquire(url)
+        request = nullcontext(response) if response is not None else session.get(url, timeout=60, cookies=cookies)
+        async with request as response:
+            check_response_status(response)
             if 'text/html' in response.headers['content-type']:
-                text = await response.text()
-                assert not any(ext in text for ext in error_titles_html), 'Ошибка доступа к документу'
-                first = text.find(doc_url_pattern)
-                second = text.find(doc_buy_pattern)
-                return text[first + len(doc_url_pattern):second].replace('\/', '/')
+                # Страница документа может быть большой, поэтому декодируется и просматривается не в цикле событий
+                return await run_blocking(get_doc_url, await response.read(), response.charset)
     elif 'photo' in pattern:
-        soup = BeautifulSoup(await response.text(), 'html.parser')
-        check = check_vk_title_error(soup)
-        assert not check, f'Ошибка доступа к фото: {check}'
-        link = soup.find('meta', attrs={'name': 'og:image:secure_url'})
+        link = await find_photo_url(response)
         if link:
-            return link['value']
+            return link
     redirect_url = str(response.url)
     if redirect_url != url:
         return redirect_url
     return url
 
 
-async def downloader(response: aiohttp.ClientResponse, path: str, name: str) -> Coroutine:
+class PartFileWriter():
+    def __init__(self, file_path: str, append: bool = False) -> None:
+        '''
+        Запись скачиваемого файла во временный файл `tools.get_part_path`, который переименовывается в `file_path`
+        только после записи всех данных. Прерванное скачивание никогда не оставляет под именем `file_path` неполный файл.
+        `write` и `commit` выполняют запись на диск и вызываются в потоке записи `file_writer_executor`
+        `file_path`: путь до файла
+        `append`: дописывать ли данные в конец существующего временного файла (продолжение скачивания)
+        '''
+        self.file_path = file_path
+        self.part_path = tools.get_part_path(file_path)
+        self.append = append
+        # Хэш дописанного файла был бы неполным, поэтому он не считается
+        self.digest = None if append else hashlib.sha256()
+        self.file = None
+        self.closed = False
+        # Запись и закрытие файла могут быть вызваны из разных потоков
+        self.lock = threading.RLock()
+
+    def open(self) -> BinaryIO:
+        mode = 'ab' if self.append else 'wb'
+        try:
+            return open(self.part_path, mode)
+        except FileNotFoundError:
+            # Папка могла быть удалена после того, как была запомнена `tools.create_folder_cached`
+            tools.create_folder(dirname(self.part_path))
+            return open(self.part_path, mode)
+
+    def write(self, chunks: List[bytes]) -> None:
+        '''
+        Записывает части файла и учитывает их в хэше
+        `chunks`: части файла по порядку
+        '''
+        with self.lock:
+            if self.closed:
+                return
+            if self.file is None:
+                self.file = self.open()
+            for chunk in chunks:
+                if self.digest is not None:
+                    self.digest.update(chunk)
+                self.file.write(chunk)
+
+    def commit(self, chunks: List[bytes]) -> None:
+        '''
+        Записывает последние части файла и переименовывает временный файл в `file_path`.
+        Существующий файл `file_path` заменяется новым, а не перезаписывается, так как может быть жесткой ссылкой на другой файл.
+        Если временный файл уже закрыт, он не переименовывается
+        `chunks`: последние части файла по порядку
+        '''
+        with self.lock:
+            if self.closed:
+                return
+            self.write(chunks)
+            self.close()
+            replace(self.part_path, self.file_path)
+
+    def close(self) -> None:
+        '''
+        Закрывает временный файл. Если скачивание не завершено, временный файл остается для продолжения скачивания.
+        Части файла, запись которых начнется после закрытия, не записываются
+        '''
+        with self.lock:
+            self.closed = True
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+    def get_hash(self) -> str | None:
+        return None if self.digest is None else self.digest.hexdigest()
+
+
+async def downloader(
+    response: aiohttp.ClientResponse,
+    path: str,
+    name: str,
+    append: bool = False,
+    buffer_size: int | None = None
+) -> str | None:
     '''
-    Скачивает файл из `response`:
+    Скачивает файл из `response` и возвращает хэш `sha256` его содержимого
+    (или `None`, если файл был дописан, так как хэш будет неполным).
+    Данные накапливаются в буфере и записываются на диск вместе с подсчетом хэша в потоке записи,
+    пока из сети читается следующая часть файла
     `response`: ответ на запрос
     `path`: путь, куда будет сохранен файл
     `name`: имя сохраняемого файла
+    `append`: дописывать ли данные в конец уже скачанной части файла (продолжение скачивания)
+    `buffer_size`: размер буфера в байтах. Если не указан, используется `download_buffer_size`
+    '''
+    if path not in tools.created_folders:
+        await run_blocking(tools.create_folder_cached, path)
+    buffer_size = buffer_size or download_buffer_size
+    writer = PartFileWriter(join(path, name), append)
+    loop = asyncio.get_running_loop()
+    chunks = []
+    buffered = 0
+    pending_write = None
+    try:
+        async for data in response.content.iter_chunked(min(buffer_size, read_chunk_size)):
+            chunks.append(data)
+            buffered += len(data)
+            metrics.downloaded_bytes.inc(len(data))
+            if buffered >= buffer_size:
+                # Части файла записываются по порядку: следующая запись начинается только после предыдущей
+                if pending_write is not None:
+                    await pending_write
+                pending_write = loop.run_in_executor(file_writer_executor, writer.write, chunks)
+                chunks = []
+                buffered = 0
+        if pending_write is not None:
+            await pending_write
+        # Небольшой файл записывается целиком за одно обращение к потоку записи
+        pending_write = loop.run_in_executor(file_writer_executor, writer.commit, chunks)
+        chunks = []
+        await pending_write
+    except BaseException:
+        # Уже полученные данные сохраняются для продолжения скачивания, если не выполняется запись предыдущей части
+        if pending_write is None or pending_write.done():
+            with suppress(OSError):
+                writer.write(chunks)
+        writer.close()
+        raise
+    return writer.get_hash()
+
+
+async def save_response(
+    response: aiohttp.ClientResponse,
+    url: str,
+    save_path: str,
+    file_name: str,
+    name_link: str,
+    manifest: DownloadManifest | None = None,
+    dedup: FileDeduplicator | None = None
+) -> Dict[str, str]:
+    '''
+    Сохраняет файл из `response`, отмечая ход скачивания в `manifest`, и возвращает информацию о нем
+    `response`: ответ на запрос файла
+    `url`: исходная ссылка из архива
+    `save_path`: путь до папки, куда будет сохранен файл
+    `file_name`: имя файла, если его не удастся получить из ссылки
+    `name_link`: ссылка, из которой будет получено имя файла
+    `manifest`: хранилище информации о скачиваниях
+    `dedup`: поиск повторяющихся файлов
+    '''
+    response_info = get_response_info(response.headers['content-type'])
+    download_path = tools.clear_charters_by_pattern(join(save_path, response_info['full_type_info']))
+    download_file_name = get_file_name_by_link(name_link)
+    if download_file_name is None:
+        download_file_name = f'{file_name}.{response_info["extension"]}'
+    result = {'url': str(response.url), 'file_info': response_info['full_type_info']}
+    file_path = join(download_path, download_file_name)
+    if manifest is not None:
+        await run_state(
+            manifest.update,
+            url,
+            save_path,
+            final_url=result['url'],
+            path=file_path,
+            size=response.content_length,
+            content_type=response_info['full_type_info'],
+            status='partial'
+        )
+    sha256 = await asyncio.create_task(
+        downloader(
+            response=response,
+            path=download_path,
+            name=download_file_name
+        )
+    )
+    size = await run_state(getsize, file_path)
+    if dedup is not None:
+        file_path = await run_state(dedup.register_hash, sha256, file_path, size)
+        dedup.complete(url, {
+            'path': file_path,
+            'final_url': result['url'],
+            'content_type': result['file_info'],
+            'size': size
+        })
+    if manifest is not None:
+        await run_state(manifest.update, url, save_path, path=file_path, size=size, sha256=sha256, status='done')
+    result['path'] = file_path
+    return result
+
+
+async def resume_download(
+    record: Dict[str, str],
+    downloaded: int,
+    session: aiohttp.ClientSession,
+    manifest: DownloadManifest,
+    dedup: FileDeduplicator | None = None
+) -> Dict[str, str] | None:
+    '''
+    Продолжает прерванное скачивание файла по записи из `manifest`, используя заголовок `Range`.
+    Если сервер не поддерживает `Range`, файл будет скачан заново.
+    Возвращает информацию о файле или `None`, если продолжить скачивание не удалось
+    `record`: запись о скачивании
+    `downloaded`: количество уже скачанных байт
+    `session`: сессия ClientSession
+    `manifest`: хранилище информации о скачиваниях
+    `dedup`: поиск повторяющихся файлов
     '''
-    tools.create_folder(path)
-    block_size = 16384
-    async with aiofiles.open(join(path, name), 'wb') as f:
-        while True:
-            data = await response.content.read(block_size)
-            if not data:
-                break
-            await f.write(data)
+    result = {'url': record['final_url'], 'file_info': record['content_type']}
+    if record['size'] is None or downloaded != record['size']:
+        result = await resume_response(record, downloaded, session, manifest)
+        if result is None:
+            return None
+    else:
+        # Файл был скачан полностью, но не успел получить свое имя
+        await run_state(replace, tools.get_part_path(record['path']), record['path'])
+    size = await run_state(getsize, record['path'])
+    await run_state(manifest.update, record['url'], record['save_path'], size=size, status='done')
+    if dedup is not None:
+        dedup.complete(record['url'], {
+            'path': record['path'],
+            'final_url': result['url'],
+            'content_type': result['file_info'],
+            'size': size
+        })
+    return {**result, 'path': record['path']}
+
+
+async def resume_response(
+    record: Dict[str, str],
+    downloaded: int,
+    session: aiohttp.ClientSession,
+    manifest: DownloadManifest
+) -> Dict[str, str] | None:
+    '''
+    Дописывает файл по записи из `manifest` с места остановки.
+    Возвращает информацию о файле или `None`, если продолжить скачивание не удалось
+    `record`: запись о скачивании
+    `downloaded`: количество уже скачанных байт
+    `session`: сессия ClientSession
+    `manifest`: хранилище информации о скачиваниях
+    '''
+    result = {'url': record['final_url'], 'file_info': record['content_type']}
+    headers = {'Range': f'bytes={downloaded}-'}
+    reserve_request(record['final_url'])
+    async with session.get(record['final_url'], timeout=900, headers=headers) as response:
+        if 'text/html' in response.headers.get('content-type', ''):
+            return None
+        if response.status == 206 and response.headers.get('content-range', '').startswith(f'bytes {downloaded}-'):
+            append = True
+            logger.debug(f'Продолжение скачивания 🔗 {record["url"]} с {downloaded} байт')
+        elif response.status == 200:
+            append = False
+            logger.debug(f'Сервер не поддерживает продолжение скачивания 🔗 {record["url"]}, файл будет скачан заново')
+        else:
+            return None
+        await run_state(manifest.update, record['url'], record['save_path'], status='partial')
+        path, name = split(record['path'])
+        await asyncio.create_task(
+            downloader(
+                response=response,
+                path=path,
+                name=name,
+                append=append
+            )
+        )
+    return result
 
 
 def links_filter(url: str) -> Dict[str, str] | None:
-    if 'vk.com/video' in url:
-        return {'url': url, 'file_info': 'vk_video'}
-    elif 'vk.com/id' in url or 'vk.com/public' in url:
-        return {'url': url, 'file_info': 'vk_contact'}
-    elif 'vk.com/story' in url:
-        return {'url': url, 'file_info': 'vk_story'}
-    elif 'vk.com/club' in url:
-        return {'url': url, 'file_info': 'vk_club'}
-    elif 'github.com' in url:
-        return {'url': url, 'file_info': 'github_link'}
-    elif 'aliexpress.com' in url:
-        return {'url': url, 'file_info': 'aliexpress_link'}
-    elif 'pastebin.com' in url:
-        return {'url': url, 'file_info': 'pastebin_link'}
-    elif 'drive.google.com' in url:
-        return {'url': url, 'file_info': 'gdrive_link'}
-    elif 'google.com' in url:
-        return {'url': url, 'file_info': 'google_link'}
-    elif 'wikipedia.org' in url:
-        return {'url': url, 'file_info': 'wikipedia_link'}
-    elif 'pornhub.com' in url:
-        return {'url': url, 'file_info': '🍓'}
-    elif 't.me' in url:
-        return {'url': url, 'file_info': 'telegram_contact'}
-    elif 'dns-shop.ru' in url:
-        return {'url': url, 'file_info': 'dns_shop_link'}
-    elif 'habr.com' in url:
-        return {'url': url, 'file_info': 'habr_link'}
-    elif 'goo.gl' in url:
-        return {'url': url, 'file_info': 'google_link'}
-    elif 'onedrive.live.com' in url:
-        return {'url': url, 'file_info': 'onedrive_link'}
-    elif 'onedrive.com' in url:
-        return {'url': url, 'file_info': 'onedrive_link'}
-    elif 'youtube.com' in url:
-        return {'url': url, 'file_info': 'youtube_link'}
-    elif 'vk.com/login' in url:
-        return {}
+    '''
+    Классифицирует ссылку по правилам `links_classifier`, см. `LinkClassifier.classify`
+    `url`: ссылка
+    '''
+    return links_classifier.classify(url)
 
 
 async def get_info(
@@ -193,15 +703,20 @@ async def get_info(
     save_path: str,
     file_name: str,
     session: aiohttp.ClientSession,
-    semaphore: asyncio.BoundedSemaphore,
-    cookies=None
+    semaphore: asyncio.BoundedSemaphore | None = None,
+    cookies=None,
+    manifest: DownloadManifest | None = None,
+    dedup: FileDeduplicator | None = None
 ) -> Dict[str, str] | None:
     '''
     Скачивает файл из `response`, возвращая о нем информацию:
     ```
     {
         'url': URL скаченного файла,
-        'file_info': информация о типе файла
+        'file_info': информация о типе файла,
+        'path': путь до сохраненного файла, только если файл сохранен,
+        'error_class': класс ошибки из `get_error_class`, только если произошла ошибка,
+        'retry_after': значение заголовка `Retry-After`, только если сервер его передал
     }
     ```
 
@@ -209,42 +724,104 @@ async def get_info(
     `save_path`: путь до папки, куда будет сохранен файл
     `file_name`: имя файла
     `session`: сессия ClientSession
+    `semaphore`: семафор для ограничения одновременных скачиваний. Не нужен, если количество
+    одновременных вызовов ограничивает `DownloadScheduler`
     `cookies` куки для `aiohttp.ClientSession`
-    `sleep`: нужна ли задержка перед выполнением цикла, если да - какая в секундах
+    `manifest`: хранилище информации о скачиваниях. Если указано, уже скачанные файлы будут пропущены,
+    а прерванные скачивания - продолжены
+    `dedup`: поиск повторяющихся файлов. Если указан, уже скачанный по такой же ссылке файл не будет скачан повторно
+
+    Если запрос нужно отложить из-за ограничения частоты запросов или файл по такой же ссылке
+    сейчас скачивается, выбрасывает `JobDeferred`, поэтому вызывается через `DownloadScheduler`
     '''
+    dedup_owner = False
+    url_reserved = False
     try:
         filter_result = links_filter(url)
         if isinstance(filter_result, dict):
             return filter_result
 
-        async with semaphore:
-            async with session.get(url, timeout=45) as response:
-                assert response.status == 200, f'Response status: {response.status}'
+        record = None
+        if manifest is not None:
+            record, complete_result = await run_state(get_manifest_record, manifest, url, save_path)
+            if complete_result is not None:
+                logger.debug(f'🔗 {url} уже обработана ранее, она будет пропущена')
+                return complete_result
+
+        # Запрос по ссылке занимается до остальных обращений к `manifest` и `dedup`, чтобы отложенная задача
+        # выполняла их только один раз. Уже обработанные ссылки проверяются раньше, чтобы при повторном запуске
+        # они не ждали своей очереди запросов. Если запрос не понадобится, он возвращается в `finally`
+        reserve_request(url)
+        url_reserved = True
+
+        if dedup is not None:
+            while (original := dedup.acquire(url)) is not None:
+                path = await run_state(dedup.link_duplicate, original, save_path)
+                if path is None:
+                    logger.debug(f'Ранее скачанный файл {original["path"]} не найден, 🔗 {url} будет скачана заново')
+                    dedup.forget(url, original)
+                    continue
+                logger.debug(f'🔗 {url} уже скачана в {original["path"]}, файл не будет скачан повторно')
+                if manifest is not None:
+                    await run_state(
+                        manifest.update,
+                        url,
+                        save_path,
+                        final_url=original['final_url'],
+                        path=path,
+                        size=original['size'],
+                        content_type=original['content_type'],
+                        status='done'
+                    )
+                return {'url': original['final_url'], 'file_info': original['content_type'], 'path': path}
+            dedup_owner = True
+
+        async with semaphore if semaphore is not None else nullcontext():
+            downloaded = None if manifest is None else await run_state(manifest.get_resume_offset, record)
+            if downloaded is not None:
+                resume_result = await resume_download(record, downloaded, session, manifest, dedup)
+                if resume_result is not None:
+                    return resume_result
+
+            is_doc = 'vk.com/doc' in url
+            if is_doc and manifest is not None:
+                resolved_url = await run_state(manifest.get_resolved_url, url)
+                if resolved_url is not None:
+                    resolved_result = await fetch_resolved_url(
+                        url, resolved_url, save_path, file_name, session, manifest, dedup
+                    )
+                    if resolved_result is not None:
+                        return resolved_result
+
+            # Страница документа загружается с cookies, чтобы найти на ней ссылку без повторного запроса
+            url_reserved = False
+            async with session.get(url, timeout=45, cookies=cookies if is_doc else None) as response:
+                check_response_status(response)
                 if any(t in response.headers['content-type'] for t in ('image', 'audio')):
-                    response_info = get_response_info(response.headers['content-type'])
-                    download_path = tools.clear_charters_by_pattern(join(save_path, response_info['full_type_info']))
-                    download_file_name = get_file_name_by_link(str(response.url))
-                    if download_file_name is None:
-                        download_file_name = f'{file_name}.{response_info["extension"]}'
-                    await asyncio.create_task(
-                        downloader(
-                            response=response,
-                            path=download_path,
-                            name=download_file_name
-                        )
+                    return await save_response(
+                        response=response,
+                        url=url,
+                        save_path=save_path,
+                        file_name=file_name,
+                        name_link=str(response.url),
+                        manifest=manifest,
+                        dedup=dedup
                     )
-                    return {'url': str(response.url), 'file_info': response_info['full_type_info']}
                 target_content_type = response.headers['content-type']
 
+                # Ссылка на файл ищется только на страницах документов и фото VK, для остальных остается исходная ссылка
+                find_res = url
                 if 'text/html' in target_content_type:
-                    if 'vk.com/doc' in url:
+                    if is_doc:
                         find_res = await asyncio.create_task(find_link_by_url(
                             url=url,
                             pattern='doc',
-                            session=session,
+                            response=response,
                             cookies=cookies
                         ))
-                    elif 'vk.com/photo':
+                        if find_res != url and manifest is not None:
+                            await run_state(manifest.set_resolved_url, url, find_res)
+                    elif 'vk.com/photo' in url:
                         find_res = await asyncio.create_task(find_link_by_url(
                             url=url,
                             pattern='photo',
@@ -252,30 +829,47 @@ async def get_info(
                             cookies=cookies
                         ))
                     if find_res == url:
+                        if manifest is not None:
+                            await run_state(manifest.update, url, save_path, final_url=url, status='not_parse')
                         return {'url': find_res, 'file_info': 'not_parse'}
+            if is_doc and manifest is not None:
+                # Найденная ссылка уже сохранена в `manifest`, поэтому отложенная задача не загрузит страницу повторно
+                reserve_request(find_res)
+            else:
+                await rate_limiter.acquire(find_res)
             async with session.get(find_res, timeout=900) as response:
                 filter_result = links_filter(find_res)
                 if isinstance(filter_result, dict):
                     return filter_result
-                response_info = get_response_info(response.headers['content-type'])
-                download_path = tools.clear_charters_by_pattern(join(save_path, response_info['full_type_info']))
-                download_file_name = get_file_name_by_link(find_res)
-                if download_file_name is None:
-                    download_file_name = f'{file_name}.{response_info["extension"]}'
-                await asyncio.create_task(
-                    downloader(
-                        response=response,
-                        path=download_path,
-                        name=download_file_name
-                    )
+                return await save_response(
+                    response=response,
+                    url=url,
+                    save_path=save_path,
+                    file_name=file_name,
+                    name_link=find_res,
+                    manifest=manifest,
+                    dedup=dedup
                 )
-                return {'url': str(response.url), 'file_info': response_info['full_type_info']}
 
+    except JobDeferred:
+        raise
     except asyncio.TimeoutError as e:
         logger.error(f'Ошибка 🔗 {url}: тайм-аут скачивания')
         logger.debug(format_exc())
-        return {'url': url, 'file_info': 'timeout_error'}
+        if manifest is not None:
+            await run_state(manifest.update, url, save_path, status='timeout_error')
+        return {'url': url, 'file_info': 'timeout_error', 'error_class': 'timeout'}
     except Exception as e:
         logger.error(f'Ошибка 🔗 {url}: {e}')
         logger.debug(format_exc())
-        return {'url': url, 'file_info': 'error'}
+        if manifest is not None:
+            await run_state(manifest.update, url, save_path, status='error')
+        result = {'url': url, 'file_info': 'error', 'error_class': get_error_class(e)}
+        if getattr(e, 'retry_after', None):
+            result['retry_after'] = e.retry_after
+        return result
+    finally:
+        if url_reserved:
+            rate_limiter.cancel(url)
+        if dedup_owner:
+            dedup.release(url)
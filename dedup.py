@@ -0,0 +1,189 @@
+import asyncio
+from configparser import ConfigParser
+from os import link, remove, symlink
+from os.path import abspath, basename, dirname, exists, islink, join
+from typing import Any, Dict
+
+import tools
+from logger import create_logger
+from manifest import DownloadManifest
+from scheduler import JobDeferred
+
+config = ConfigParser()
+config_read = config.read('config.ini', encoding='utf8')
+log_level = 'DEBUG'
+if config_read:
+    log_level = config['main_parameters'].get('log_level', 'DEBUG')
+logger = create_logger('logs/vk_parser.log', 'dedup', log_level)
+
+dedup_modes = ('hardlink', 'symlink', 'reference')
+
+
+def normalize_url(url: str) -> str:
+    '''
+    Возвращает ссылку без параметров `?extra=` и `?size=`, как в `data_downloader.get_file_name_by_link`.
+    Одинаковые файлы, пересланные в разные диалоги, имеют одинаковую нормализованную ссылку
+    `url`: ссылка
+    '''
+    if '?extra=' in url:
+        return url.split('?extra=')[0]
+    elif '?size=' in url:
+        return url.split('?size=')[0]
+    return url
+
+
+class FileDeduplicator():
+    def __init__(self, mode: str = 'hardlink', manifest: DownloadManifest | None = None) -> None:
+        '''
+        Поиск повторяющихся файлов среди скачиваний.
+        До скачивания файлы сравниваются по нормализованной ссылке, после скачивания - по хэшу `sha256`.
+        Повторяющийся файл не скачивается и не хранится повторно, вместо него создается ссылка на уже скачанный файл
+
+        `mode`: способ сохранения повторяющихся файлов:
+        - `hardlink`: жесткая ссылка на уже скачанный файл
+        - `symlink`: символическая ссылка на уже скачанный файл
+        - `reference`: файл не создается, в результатах и `manifest` указывается путь до уже скачанного файла
+        `manifest`: хранилище информации о скачиваниях. Если указано, будут учтены файлы, скачанные при прошлых запусках
+        '''
+        self.mode = mode
+        self.by_url: Dict[str, Dict[str, Any]] = {}
+        self.by_hash: Dict[str, Dict[str, Any]] = {}
+        self.in_progress: Dict[str, asyncio.Future] = {}
+        self.stats = {
+            'url_duplicates': 0,
+            'hash_duplicates': 0,
+            'bytes_not_downloaded': 0,
+            'bytes_not_stored': 0
+        }
+        if manifest is not None:
+            for record in manifest.get_done_files():
+                if not exists(record['path']):
+                    continue
+                self.by_url.setdefault(normalize_url(record['url']), record)
+                if record['sha256'] is not None:
+                    self.by_hash.setdefault(record['sha256'], record)
+            logger.debug(f'Загружена информация о {len(self.by_url)} ранее скачанных файлах')
+
+    def acquire(self, url: str) -> Dict[str, Any] | None:
+        '''
+        Возвращает информацию об уже скачанном файле с такой же нормализованной ссылкой.
+        Наличие файла на диске не проверяется, чтобы не обращаться к диску из цикла событий:
+        это делает `link_duplicate`, а пропавший файл убирается через `forget`.
+        Если такой файл сейчас скачивается, выбрасывает `JobDeferred` с окончанием скачивания:
+        `DownloadScheduler` вернет задачу в очередь, когда оно закончится, и место одновременного скачивания
+        не будет занято на время ожидания.
+        Если файла нет, возвращает `None`, а вызывающий становится ответственным за скачивание
+        и должен вызвать `complete` или `release`
+        `url`: ссылка
+        '''
+        key = normalize_url(url)
+        info = self.by_url.get(key)
+        if info is not None:
+            return info
+        future = self.in_progress.get(key)
+        if future is not None:
+            raise JobDeferred(future)
+        self.in_progress[key] = asyncio.get_running_loop().create_future()
+        return None
+
+    def complete(self, url: str, info: Dict[str, Any]) -> None:
+        '''
+        Запоминает скачанный файл и передает информацию о нем ожидающим скачиваниям с той же ссылкой
+        `url`: ссылка
+        `info`: информация о файле: `path`, `final_url`, `content_type`, `size`
+        '''
+        key = normalize_url(url)
+        self.by_url[key] = info
+        future = self.in_progress.pop(key, None)
+        if future is not None and not future.done():
+            future.set_result(info)
+
+    def forget(self, url: str, info: Dict[str, Any]) -> None:
+        '''
+        Забывает ранее скачанный файл, если его больше нет на диске.
+        Следующий вызов `acquire` с той же ссылкой сделает вызывающего ответственным за скачивание
+        `url`: ссылка
+        `info`: информация о файле, полученная из `acquire`
+        '''
+        key = normalize_url(url)
+        if self.by_url.get(key) is info:
+            del self.by_url[key]
+
+    def release(self, url: str) -> None:
+        '''
+        Снимает ответственность за скачивание, если оно не завершилось успешно.
+        Первое из ожидающих скачиваний с той же ссылкой, вернувшееся в очередь, выполнит скачивание самостоятельно
+        `url`: ссылка
+        '''
+        future = self.in_progress.pop(normalize_url(url), None)
+        if future is not None and not future.done():
+            future.set_result(None)
+
+    def link_file(self, source: str, target: str) -> str:
+        '''
+        Создает ссылку `target` на файл `source` в соответствии с `mode` и возвращает путь, по которому доступен файл
+        `source`: путь до уже сохраненного файла
+        `target`: путь, по которому должен быть доступен файл
+        '''
+        if abspath(source) == abspath(target) or self.mode == 'reference':
+            return source
+        tools.create_folder(dirname(target))
+        if exists(target) or islink(target):
+            remove(target)
+        try:
+            if self.mode == 'symlink':
+                symlink(abspath(source), target)
+            else:
+                link(source, target)
+        except OSError as e:
+            logger.warning(f'Не удалось создать ссылку {target} на {source}: {e}. Будет использован путь до исходного файла')
+            return source
+        return target
+
+    def link_duplicate(self, info: Dict[str, Any], save_path: str) -> str | None:
+        '''
+        Сохраняет повторяющийся по ссылке файл в `save_path`, не скачивая его, и возвращает путь до него.
+        Если уже скачанного файла больше нет на диске, возвращает `None`
+        `info`: информация об уже скачанном файле
+        `save_path`: путь до папки, куда должен был быть сохранен файл
+        '''
+        if not exists(info['path']):
+            return None
+        download_path = tools.clear_charters_by_pattern(join(save_path, info['content_type']))
+        path = self.link_file(info['path'], join(download_path, basename(info['path'])))
+        self.stats['url_duplicates'] += 1
+        self.stats['bytes_not_downloaded'] += info['size'] or 0
+        return path
+
+    def register_hash(self, sha256: str, path: str, size: int) -> str:
+        '''
+        Запоминает хэш скачанного файла. Если файл с таким же хэшем уже есть, скачанный файл заменяется
+        ссылкой на него. Возвращает путь, по которому доступен файл
+        `sha256`: хэш содержимого файла
+        `path`: путь до скачанного файла
+        `size`: размер файла в байтах
+        '''
+        existing = self.by_hash.get(sha256)
+        if existing is None or not exists(existing['path']) or abspath(existing['path']) == abspath(path):
+            self.by_hash[sha256] = {'path': path, 'size': size}
+            return path
+        if self.mode == 'reference':
+            remove(path)
+            new_path = existing['path']
+        else:
+            new_path = self.link_file(existing['path'], path)
+        self.stats['hash_duplicates'] += 1
+        self.stats['bytes_not_stored'] += size
+        return new_path
+
+    def get_stats_message(self) -> str:
+        '''
+        Возвращает описание количества найденных повторяющихся файлов и сэкономленного места
+        '''
+        mib = 1024 * 1024
+        return (
+            f'повторов по ссылке: {self.stats["url_duplicates"]} '
+            f'(не скачано {self.stats["bytes_not_downloaded"] / mib:.2f} МиБ), '
+            f'повторов по содержимому: {self.stats["hash_duplicates"]} '
+            f'(не сохранено {self.stats["bytes_not_stored"] / mib:.2f} МиБ)'
+        )
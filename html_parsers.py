@@ -0,0 +1,617 @@
+import re
+from configparser import ConfigParser
+from html import unescape
+from html.parser import HTMLParser as BaseHTMLParser
+from typing import List, TextIO, Tuple
+
+from bs4 import BeautifulSoup
+
+from archive_reader import ArchiveFile
+from logger import create_logger
+
+try:
+    import lxml.html
+except ImportError:
+    lxml = None
+
+try:
+    from selectolax.lexbor import LexborHTMLParser as HTMLParser
+except ImportError:
+    HTMLParser = None
+
+config = ConfigParser()
+config_read = config.read('config.ini', encoding='utf8')
+log_level = 'DEBUG'
+if config_read:
+    log_level = config['main_parameters'].get('log_level', 'DEBUG')
+logger = create_logger('logs/vk_parser.log', 'html_parsers', log_level)
+
+# Размер части файла, передаваемой потоковому обработчику за раз
+stream_chunk_size = 65536
+
+# Теги, которые нужны побайтовому обработчику: открывающие и закрывающие `div`, `a` и `img`.
+# Значения атрибутов в кавычках пропускаются целиком, поэтому `>` внутри них не закрывает тег
+bytes_tag_pattern = re.compile(rb'<(/?)(div|a|img)(?=[\s/>])((?:"[^"]*"|\'[^\']*\'|[^\'">])*)>', re.IGNORECASE)
+bytes_attr_pattern = re.compile(rb'([^\s=/>]+)(?:\s*=\s*(?:"([^"]*)"|\'([^\']*)\'|([^\s>]+)))?')
+bytes_class_pattern = re.compile(rb'(?:^|\s)class\s*=\s*(?:"([^"]*)"|\'([^\']*)\'|([^\s>]+))', re.IGNORECASE)
+bytes_markup_pattern = re.compile(rb'<(?:"[^"]*"|\'[^\']*\'|[^\'">])*>')
+
+
+def read_html(html_content: str | TextIO) -> str:
+    '''
+    Возвращает содержимое `.html` файла
+    `html_content`: прочитанный `.html` файл или открытый файловый объект
+    '''
+    if isinstance(html_content, str):
+        return html_content
+    return html_content.read()
+
+
+def read_html_bytes(html_content: str | TextIO | ArchiveFile) -> ArchiveFile:
+    '''
+    Возвращает `.html` файл в виде байтов для побайтового обработчика.
+    Файл, открытый через `ArchiveFile`, не читается и не декодируется целиком
+    `html_content`: прочитанный `.html` файл, открытый файловый объект или `ArchiveFile`
+    '''
+    if isinstance(html_content, ArchiveFile):
+        return html_content
+    return ArchiveFile(read_html(html_content).encode('utf8'), 'utf8')
+
+
+def xpath_class(class_name: str) -> str:
+    '''
+    Возвращает условие XPath, проверяющее наличие класса `class_name` у элемента (как `class_` в `BeautifulSoup`)
+    `class_name`: имя класса
+    '''
+    return f'contains(concat(" ", normalize-space(@class), " "), " {class_name} ")'
+
+
+class BS4Parser():
+    '''
+    Обработчик `.html` файлов архива VK на основе `BeautifulSoup` и `html.parser`.
+    Медленный, но не требует сторонних C-библиотек
+
+    Все обработчики возвращают сырые данные: текст даты (или `None`, если дата не найдена) и ссылку.
+    Обработчики сообщений и фото также возвращают текст блока `ui_crumb` (имя диалога или название альбома)
+    из того же разбора файла: весь текст блока, включая вложенные теги, без пробелов по краям
+    '''
+    @classmethod
+    def get_messages(self, html_content: str | TextIO) -> Tuple[str | None, List[Tuple[str | None, str]]]:
+        soup = BeautifulSoup(read_html(html_content), 'html.parser')
+        result = []
+        for mes in soup.find_all('div', class_='item__main'):
+            link = mes.find('a', class_='attachment__link')
+            if link:
+                date = mes.find('div', class_='message__header')
+                result.append((None if date is None else date.text, link['href']))
+        return self.get_crumb(soup), result
+
+    @classmethod
+    def get_photos(self, html_content: str | TextIO) -> Tuple[str | None, List[Tuple[str | None, str]]]:
+        soup = BeautifulSoup(read_html(html_content), 'html.parser')
+        items = soup.find_all('div', class_='item')
+        if not items:
+            return None, []
+        result = []
+        for item in items:
+            date = item.find('div', class_='clear_fix')
+            result.append((None if date is None else date.text, item.find('img')['src']))
+        return self.get_crumb(soup), result
+
+    @classmethod
+    def get_docs(self, html_content: str | TextIO) -> List[Tuple[str | None, str]]:
+        soup = BeautifulSoup(read_html(html_content), 'html.parser')
+        result = []
+        for el in soup.find_all('div', class_='item'):
+            link = el.find('a', href=str)
+            if link:
+                date = el.find('div', class_='item__tertiary')
+                result.append((None if date is None else date.text, link['href']))
+        return result
+
+    @classmethod
+    def get_likes(self, html_content: str | TextIO) -> List[str]:
+        soup = BeautifulSoup(read_html(html_content), 'html.parser')
+        return [link['href'] for link in soup.find_all('a', href=str)]
+
+    @classmethod
+    def get_crumb(self, html_content: str | TextIO | BeautifulSoup) -> str | None:
+        soup = html_content
+        if not isinstance(html_content, BeautifulSoup):
+            soup = BeautifulSoup(read_html(html_content), 'html.parser')
+        name = soup.find('div', class_='ui_crumb')
+        # `string` вложенного блока - `None`, поэтому берется весь текст блока, как у остальных обработчиков
+        return None if name is None else name.get_text().strip()
+
+
+class LxmlParser():
+    '''
+    Обработчик `.html` файлов архива VK на основе `lxml` и XPath
+    '''
+    messages_xpath = f'//div[{xpath_class("item__main")}]'
+    attachment_xpath = f'.//a[{xpath_class("attachment__link")}]'
+    message_date_xpath = f'.//div[{xpath_class("message__header")}]'
+    item_xpath = f'//div[{xpath_class("item")}]'
+    photo_date_xpath = f'.//div[{xpath_class("clear_fix")}]'
+    doc_date_xpath = f'.//div[{xpath_class("item__tertiary")}]'
+    crumb_xpath = f'//div[{xpath_class("ui_crumb")}]'
+
+    @classmethod
+    def first_text(self, node, xpath: str) -> str | None:
+        found = node.xpath(xpath)
+        return found[0].text_content() if found else None
+
+    @classmethod
+    def get_messages(self, html_content: str | TextIO) -> Tuple[str | None, List[Tuple[str | None, str]]]:
+        tree = lxml.html.document_fromstring(read_html(html_content))
+        result = []
+        for mes in tree.xpath(self.messages_xpath):
+            link = mes.xpath(self.attachment_xpath)
+            if link:
+                result.append((self.first_text(mes, self.message_date_xpath), link[0].attrib['href']))
+        return self.get_crumb(tree), result
+
+    @classmethod
+    def get_photos(self, html_content: str | TextIO) -> Tuple[str | None, List[Tuple[str | None, str]]]:
+        tree = lxml.html.document_fromstring(read_html(html_content))
+        items = tree.xpath(self.item_xpath)
+        if not items:
+            return None, []
+        result = []
+        for item in items:
+            result.append((self.first_text(item, self.photo_date_xpath), item.xpath('.//img')[0].attrib['src']))
+        return self.get_crumb(tree), result
+
+    @classmethod
+    def get_docs(self, html_content: str | TextIO) -> List[Tuple[str | None, str]]:
+        tree = lxml.html.document_fromstring(read_html(html_content))
+        result = []
+        for el in tree.xpath(self.item_xpath):
+            link = el.xpath('.//a[@href]')
+            if link:
+                result.append((self.first_text(el, self.doc_date_xpath), link[0].attrib['href']))
+        return result
+
+    @classmethod
+    def get_likes(self, html_content: str | TextIO) -> List[str]:
+        tree = lxml.html.document_fromstring(read_html(html_content))
+        return [str(href) for href in tree.xpath('//a/@href')]
+
+    @classmethod
+    def get_crumb(self, html_content: str | TextIO) -> str | None:
+        tree = html_content
+        if not isinstance(html_content, lxml.html.HtmlElement):
+            tree = lxml.html.document_fromstring(read_html(html_content))
+        crumb = self.first_text(tree, self.crumb_xpath)
+        return None if crumb is None else crumb.strip()
+
+
+class SelectolaxParser():
+    '''
+    Обработчик `.html` файлов архива VK на основе `selectolax` и CSS селекторов
+    '''
+    @classmethod
+    def first_text(self, node, selector: str) -> str | None:
+        found = node.css_first(selector)
+        return None if found is None else found.text()
+
+    @classmethod
+    def get_messages(self, html_content: str | TextIO) -> Tuple[str | None, List[Tuple[str | None, str]]]:
+        tree = HTMLParser(read_html(html_content))
+        result = []
+        for mes in tree.css('div.item__main'):
+            link = mes.css_first('a.attachment__link')
+            if link is not None:
+                result.append((self.first_text(mes, 'div.message__header'), link.attributes['href']))
+        return self.get_crumb(tree), result
+
+    @classmethod
+    def get_photos(self, html_content: str | TextIO) -> Tuple[str | None, List[Tuple[str | None, str]]]:
+        tree = HTMLParser(read_html(html_content))
+        items = tree.css('div.item')
+        if not items:
+            return None, []
+        result = []
+        for item in items:
+            result.append((self.first_text(item, 'div.clear_fix'), item.css_first('img').attributes['src']))
+        return self.get_crumb(tree), result
+
+    @classmethod
+    def get_docs(self, html_content: str | TextIO) -> List[Tuple[str | None, str]]:
+        tree = HTMLParser(read_html(html_content))
+        result = []
+        for el in tree.css('div.item'):
+            link = el.css_first('a[href]')
+            if link is not None:
+                result.append((self.first_text(el, 'div.item__tertiary'), link.attributes['href']))
+        return result
+
+    @classmethod
+    def get_likes(self, html_content: str | TextIO) -> List[str]:
+        tree = HTMLParser(read_html(html_content))
+        return [link.attributes['href'] for link in tree.css('a[href]')]
+
+    @classmethod
+    def get_crumb(self, html_content: str | TextIO) -> str | None:
+        tree = html_content
+        if not isinstance(html_content, HTMLParser):
+            tree = HTMLParser(read_html(html_content))
+        crumb = self.first_text(tree, 'div.ui_crumb')
+        return None if crumb is None else crumb.strip()
+
+
+class ArchiveScanner(BaseHTMLParser):
+    '''
+    Потоковый разборщик `.html` файлов архива VK без построения дерева документа.
+    Отслеживает вложенность `div`, внутри блоков с классом `item_class` запоминает первую подходящую ссылку
+    и текст первого блока с классом `date_class`, отдавая пары (текст даты, ссылка) по закрытию блока.
+    Также запоминает текст первого блока `ui_crumb`
+
+    `item_class`: класс блока-записи. Если `None`, отдаются все подходящие ссылки документа без дат
+    `link_tag`: тег ссылки, например, `a` или `img`
+    `link_attr`: атрибут ссылки, например, `href` или `src`
+    `link_class`: класс, который должен быть у тега ссылки. Если `None` - любой
+    `date_class`: класс блока с датой
+    `link_required`: нужно ли прерывать разбор, если в записи нет ссылки
+    '''
+    def __init__(
+        self,
+        item_class: str | None = None,
+        link_tag: str = 'a',
+        link_attr: str = 'href',
+        link_class: str | None = None,
+        date_class: str | None = None,
+        link_required: bool = False
+    ) -> None:
+        super().__init__(convert_charrefs=True)
+        self.item_class = item_class
+        self.link_tag = link_tag
+        self.link_attr = link_attr
+        self.link_class = link_class
+        self.date_class = date_class
+        self.link_required = link_required
+
+        self.result = []
+        self.items_count = 0
+        self.crumb = None
+        self.crumb_done = False
+        self.div_depth = 0
+        self.item_depth = None
+        self.date_depth = None
+        self.crumb_depth = None
+        self.item_link = None
+        self.item_date = None
+        self.date_parts = []
+        self.crumb_parts = []
+
+    @staticmethod
+    def has_class(attrs: List[Tuple[str, str | None]], class_name: str) -> bool:
+        for name, value in attrs:
+            if name == 'class' and value is not None:
+                return class_name in value.split()
+        return False
+
+    def handle_starttag(self, tag: str, attrs: List[Tuple[str, str | None]]) -> None:
+        if tag == 'div':
+            self.div_depth += 1
+            if not self.crumb_done and self.crumb_depth is None and self.has_class(attrs, 'ui_crumb'):
+                self.crumb_depth = self.div_depth
+            if self.item_class is None:
+                return
+            if self.item_depth is None:
+                if self.has_class(attrs, self.item_class):
+                    self.item_depth = self.div_depth
+                    self.item_link = None
+                    self.item_date = None
+            elif self.item_date is None and self.date_depth is None and self.has_class(attrs, self.date_class):
+                self.date_depth = self.div_depth
+                self.date_parts = []
+            return
+
+        if tag != self.link_tag or (self.item_class is not None and (self.item_depth is None or self.item_link is not None)):
+            return
+        if self.link_class is not None and not self.has_class(attrs, self.link_class):
+            return
+        for name, value in attrs:
+            if name == self.link_attr and value is not None:
+                if self.item_class is None:
+                    self.result.append(value)
+                else:
+                    self.item_link = value
+                return
+        if self.link_tag == 'img' and self.item_class is not None:
+            raise KeyError(self.link_attr)
+
+    def handle_startendtag(self, tag: str, attrs: List[Tuple[str, str | None]]) -> None:
+        if tag != 'div':
+            self.handle_starttag(tag, attrs)
+
+    def handle_endtag(self, tag: str) -> None:
+        if tag != 'div' or self.div_depth == 0:
+            return
+        if self.crumb_depth == self.div_depth:
+            self.crumb = ''.join(self.crumb_parts).strip()
+            self.crumb_depth = None
+            self.crumb_done = True
+        if self.date_depth == self.div_depth:
+            self.item_date = ''.join(self.date_parts)
+            self.date_depth = None
+        if self.item_depth == self.div_depth:
+            self.items_count += 1
+            if self.item_link is not None:
+                self.result.append((self.item_date, self.item_link))
+            elif self.link_required:
+                raise ValueError(f'В записи нет тега {self.link_tag}')
+            self.item_depth = None
+            self.date_depth = None
+        self.div_depth -= 1
+
+    def handle_data(self, data: str) -> None:
+        if self.date_depth is not None:
+            self.date_parts.append(data)
+        if self.crumb_depth is not None:
+            self.crumb_parts.append(data)
+
+    def scan(self, html_content: str | TextIO, stop_on_crumb: bool = False) -> 'ArchiveScanner':
+        '''
+        Разбирает `.html` файл по частям, не читая его целиком в память
+        `html_content`: прочитанный `.html` файл или открытый файловый объект
+        `stop_on_crumb`: прекратить разбор, как только найден блок `ui_crumb`
+        '''
+        if isinstance(html_content, str):
+            self.feed(html_content)
+        else:
+            while True:
+                chunk = html_content.read(stream_chunk_size)
+                if not chunk:
+                    break
+                self.feed(chunk)
+                if stop_on_crumb and self.crumb_done:
+                    return self
+        self.close()
+        return self
+
+
+class StreamParser():
+    '''
+    Потоковый обработчик `.html` файлов архива VK на основе `html.parser.HTMLParser`.
+    Не строит дерево документа, поэтому потребление памяти не зависит от размера файла
+    '''
+    @classmethod
+    def get_messages(self, html_content: str | TextIO) -> Tuple[str | None, List[Tuple[str | None, str]]]:
+        scanner = ArchiveScanner(
+            item_class='item__main',
+            link_class='attachment__link',
+            date_class='message__header'
+        ).scan(html_content)
+        return scanner.crumb, scanner.result
+
+    @classmethod
+    def get_photos(self, html_content: str | TextIO) -> Tuple[str | None, List[Tuple[str | None, str]]]:
+        scanner = ArchiveScanner(
+            item_class='item',
+            link_tag='img',
+            link_attr='src',
+            date_class='clear_fix',
+            link_required=True
+        ).scan(html_content)
+        if not scanner.items_count:
+            return None, []
+        return scanner.crumb, scanner.result
+
+    @classmethod
+    def get_docs(self, html_content: str | TextIO) -> List[Tuple[str | None, str]]:
+        return ArchiveScanner(item_class='item', date_class='item__tertiary').scan(html_content).result
+
+    @classmethod
+    def get_likes(self, html_content: str | TextIO) -> List[str]:
+        return ArchiveScanner().scan(html_content).result
+
+    @classmethod
+    def get_crumb(self, html_content: str | TextIO) -> str | None:
+        return ArchiveScanner().scan(html_content, stop_on_crumb=True).crumb
+
+
+class BytesScanner():
+    '''
+    Побайтовый разборщик `.html` файлов архива VK. Ищет в байтах файла только теги `div`, `a` и `img`,
+    отслеживает вложенность `div` так же, как `ArchiveScanner`, и декодирует в строки
+    только найденные ссылки, тексты дат и `ui_crumb`.
+    Параметры те же, что и у `ArchiveScanner`
+    '''
+    def __init__(
+        self,
+        item_class: str | None = None,
+        link_tag: str = 'a',
+        link_attr: str = 'href',
+        link_class: str | None = None,
+        date_class: str | None = None,
+        link_required: bool = False
+    ) -> None:
+        self.item_class = None if item_class is None else item_class.encode('ascii')
+        self.link_tag = link_tag.encode('ascii')
+        self.link_attr = link_attr.encode('ascii')
+        self.link_class = None if link_class is None else link_class.encode('ascii')
+        self.date_class = None if date_class is None else date_class.encode('ascii')
+        self.link_required = link_required
+
+        self.result = []
+        self.items_count = 0
+        self.crumb = None
+
+    @staticmethod
+    def has_class(raw_attrs: bytes, class_name: bytes) -> bool:
+        found = bytes_class_pattern.search(raw_attrs)
+        if found is None:
+            return False
+        return class_name in (found.group(1) or found.group(2) or found.group(3)).split()
+
+    @staticmethod
+    def get_attr(raw_attrs: bytes, attr_name: bytes) -> bytes | None:
+        for found in bytes_attr_pattern.finditer(raw_attrs):
+            if found.group(1).lower() == attr_name:
+                value = found.group(2)
+                if value is None:
+                    value = found.group(3) if found.group(3) is not None else found.group(4)
+                return value
+        return None
+
+    @staticmethod
+    def get_text(html_file: ArchiveFile, raw: bytes) -> str:
+        return unescape(html_file.decode(bytes_markup_pattern.sub(b'', raw)))
+
+    @staticmethod
+    def get_link(html_file: ArchiveFile, raw: bytes) -> str:
+        link = html_file.decode(raw)
+        return unescape(link) if '&' in link else link
+
+    def scan(self, html_file: ArchiveFile) -> 'BytesScanner':
+        '''
+        Разбирает `.html` файл
+        `html_file`: `.html` файл в виде байтов
+        '''
+        data = html_file.data
+        div_depth = 0
+        item_depth = None
+        date_depth = None
+        date_start = None
+        crumb_depth = None
+        crumb_start = None
+        item_link = None
+        item_date = None
+        for found in bytes_tag_pattern.finditer(data):
+            closing, tag, raw_attrs = found.groups()
+            tag = tag.lower()
+            if tag == b'div':
+                if not closing:
+                    if raw_attrs.endswith(b'/'):
+                        continue
+                    div_depth += 1
+                    if self.crumb is None and crumb_depth is None and self.has_class(raw_attrs, b'ui_crumb'):
+                        crumb_depth = div_depth
+                        crumb_start = found.end()
+                    if self.item_class is None:
+                        continue
+                    if item_depth is None:
+                        if self.has_class(raw_attrs, self.item_class):
+                            item_depth = div_depth
+                            item_link = None
+                            item_date = None
+                    elif item_date is None and date_depth is None and self.has_class(raw_attrs, self.date_class):
+                        date_depth = div_depth
+                        date_start = found.end()
+                    continue
+                if div_depth == 0:
+                    continue
+                if crumb_depth == div_depth:
+                    self.crumb = self.get_text(html_file, data[crumb_start:found.start()]).strip()
+                    crumb_depth = None
+                if date_depth == div_depth:
+                    item_date = self.get_text(html_file, data[date_start:found.start()])
+                    date_depth = None
+                if item_depth == div_depth:
+                    self.items_count += 1
+                    if item_link is not None:
+                        self.result.append((item_date, item_link))
+                    elif self.link_required:
+                        raise ValueError(f'В записи нет тега {self.link_tag.decode()}')
+                    item_depth = None
+                    date_depth = None
+                div_depth -= 1
+                continue
+
+            if closing or tag != self.link_tag:
+                continue
+            if self.item_class is not None and (item_depth is None or item_link is not None):
+                continue
+            if self.link_class is not None and not self.has_class(raw_attrs, self.link_class):
+                continue
+            value = self.get_attr(raw_attrs, self.link_attr)
+            if value is not None:
+                if self.item_class is None:
+                    self.result.append(self.get_link(html_file, value))
+                else:
+                    item_link = self.get_link(html_file, value)
+            elif self.link_tag == b'img' and self.item_class is not None:
+                raise KeyError(self.link_attr.decode())
+        return self
+
+
+class BytesParser():
+    '''
+    Побайтовый обработчик `.html` файлов архива VK на основе регулярных выражений по байтам файла.
+    Файл, открытый через `ArchiveFile`, не декодируется в строку целиком: декодируются только ссылки и даты,
+    поэтому потребление памяти не растет вдвое на больших беседах
+    '''
+    @classmethod
+    def get_messages(self, html_content: str | TextIO | ArchiveFile) -> Tuple[str | None, List[Tuple[str | None, str]]]:
+        scanner = BytesScanner(
+            item_class='item__main',
+            link_class='attachment__link',
+            date_class='message__header'
+        ).scan(read_html_bytes(html_content))
+        return scanner.crumb, scanner.result
+
+    @classmethod
+    def get_photos(self, html_content: str | TextIO | ArchiveFile) -> Tuple[str | None, List[Tuple[str | None, str]]]:
+        scanner = BytesScanner(
+            item_class='item',
+            link_tag='img',
+            link_attr='src',
+            date_class='clear_fix',
+            link_required=True
+        ).scan(read_html_bytes(html_content))
+        if not scanner.items_count:
+            return None, []
+        return scanner.crumb, scanner.result
+
+    @classmethod
+    def get_docs(self, html_content: str | TextIO | ArchiveFile) -> List[Tuple[str | None, str]]:
+        return BytesScanner(item_class='item', date_class='item__tertiary').scan(read_html_bytes(html_content)).result
+
+    @classmethod
+    def get_likes(self, html_content: str | TextIO | ArchiveFile) -> List[str]:
+        return BytesScanner().scan(read_html_bytes(html_content)).result
+
+    @classmethod
+    def get_crumb(self, html_content: str | TextIO | ArchiveFile) -> str | None:
+        return BytesScanner().scan(read_html_bytes(html_content)).crumb
+
+
+html_parsers = {
+    'bs4': BS4Parser,
+    'lxml': LxmlParser,
+    'selectolax': SelectolaxParser,
+    'stream': StreamParser,
+    'bytes': BytesParser
+}
+
+html_parsers_available = {
+    'bs4': True,
+    'lxml': lxml is not None,
+    'selectolax': HTMLParser is not None,
+    'stream': True,
+    'bytes': True
+}
+
+
+def get_html_parser(name: str = 'bs4') -> type:
+    '''
+    Возвращает обработчик `.html` файлов по его имени.
+    Если обработчик не найден или его библиотека не установлена, будет возвращен `BS4Parser`
+    `name`: имя обработчика: `bs4`, `lxml`, `selectolax`, `stream` или `bytes`
+    '''
+    if not html_parsers_available.get(name, False):
+        name = 'bs4'
+    return html_parsers[name]
+
+
+def check_html_parser(name: str) -> str:
+    '''
+    Возвращает имя обработчика `.html` файлов, который будет фактически использован
+    `name`: имя запрошенного обработчика
+    '''
+    if html_parsers_available.get(name, False):
+        return name
+    logger.warning(f'Обработчик .html файлов {name} недоступен, будет использован bs4')
+    return 'bs4'
@@ -0,0 +1,136 @@
+import re
+from configparser import ConfigParser
+from itertools import chain
+from os.path import isfile
+from typing import Dict, Iterable, List, Tuple
+
+from logger import create_logger
+
+config = ConfigParser()
+config_read = config.read('config.ini', encoding='utf8')
+log_level = 'DEBUG'
+if config_read:
+    log_level = config['main_parameters'].get('log_level', 'DEBUG')
+logger = create_logger('logs/vk_parser.log', 'link_classifier', log_level)
+
+# Значение `file_info` в правилах, означающее, что ссылку нужно пропустить, не сохраняя в результатах
+skip_file_info = '-'
+
+
+def split_url(url: str) -> Tuple[str, str]:
+    '''
+    Возвращает хост ссылки в нижнем регистре (без данных пользователя и порта) и путь ссылки
+    `url`: ссылка
+    '''
+    _, scheme_sep, rest = url.partition('://')
+    if not scheme_sep:
+        rest = url
+    host, path_sep, path = rest.partition('/')
+    path = path_sep + path
+    if '?' in host or '#' in host:
+        end = min(pos for pos in (host.find('?'), host.find('#')) if pos != -1)
+        host = host[:end]
+        path = '/'
+    if '@' in host:
+        host = host.rpartition('@')[2]
+    if ':' in host:
+        host = host.partition(':')[0]
+    return host.lower(), path or '/'
+
+
+class LinkClassifier():
+    def __init__(self, rules: Iterable[Tuple[str, str | None, str]] = ()) -> None:
+        '''
+        Классификатор ссылок, которые не нужно скачивать (контакты, видео, внешние сайты).
+        Правила заранее собираются в таблицу хостов и одно регулярное выражение путей для каждого хоста,
+        поэтому ссылка классифицируется за один разбор: ссылки на домены без правил сразу пропускаются,
+        а для остальных хост ссылки и его родительские домены ищутся в таблицах от самого длинного к самому короткому
+        `rules`: правила из хоста, регулярного выражения начала пути (или `None`) и `file_info`
+        '''
+        self.hosts: Dict[str, str] = {}
+        path_rules: Dict[str, List[Tuple[str, str]]] = {}
+        for host, path, file_info in rules:
+            host = host.lower()
+            if path is None:
+                self.hosts.setdefault(host, file_info)
+            else:
+                path_rules.setdefault(host, []).append((path, file_info))
+        self.paths: Dict[str, Tuple[re.Pattern, List[str]]] = {}
+        for host, host_rules in path_rules.items():
+            pattern = '|'.join(f'(?P<r{i}>{path})' for i, (path, _) in enumerate(host_rules))
+            self.paths[host] = (re.compile(pattern), [file_info for _, file_info in host_rules])
+        # Домены второго уровня всех правил: ссылки на другие домены сразу пропускаются без поиска по таблицам
+        self.domains = {host[host.rfind('.', 0, host.rfind('.')) + 1:] for host in chain(self.hosts, self.paths)}
+
+    @classmethod
+    def from_file(self, path: str) -> 'LinkClassifier':
+        '''
+        Создает классификатор по файлу правил. Если файл не найден, все ссылки будут скачиваться
+        `path`: путь до файла правил
+        '''
+        if not isfile(path):
+            logger.error(f'Файл правил классификации ссылок {path} не найден, все ссылки будут скачиваться')
+            return LinkClassifier()
+        rules = []
+        with open(path, encoding='utf8') as f:
+            for line_number, line in enumerate(f, 1):
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+                parts = line.split()
+                if len(parts) != 2:
+                    logger.warning(f'{path}:{line_number}: ожидается "<хост>[<путь>] <file_info>", строка пропущена')
+                    continue
+                target, file_info = parts
+                host, slash, path_pattern = target.partition('/')
+                try:
+                    if slash:
+                        re.compile(slash + path_pattern)
+                except re.error as e:
+                    logger.warning(f'{path}:{line_number}: ошибка в регулярном выражении пути: {e}, строка пропущена')
+                    continue
+                rules.append((host, slash + path_pattern if slash else None, file_info))
+        logger.debug(f'Загружено правил классификации ссылок: {len(rules)}')
+        return LinkClassifier(rules)
+
+    def get_file_info(self, url: str) -> str | None:
+        '''
+        Возвращает `file_info` ссылки по правилам или `None`, если ссылку нужно скачивать
+        `url`: ссылка
+        '''
+        host, path = split_url(url)
+        if host[host.rfind('.', 0, host.rfind('.')) + 1:] not in self.domains:
+            return None
+        while host:
+            path_rules = self.paths.get(host)
+            if path_rules is not None:
+                match = path_rules[0].match(path)
+                if match is not None:
+                    return path_rules[1][int(match.lastgroup[1:])]
+            file_info = self.hosts.get(host)
+            if file_info is not None:
+                return file_info
+            host = host.partition('.')[2]
+        return None
+
+    def classify(self, url: str) -> Dict[str, str] | None:
+        '''
+        Возвращает результат обработки ссылки, которую не нужно скачивать:
+        `{'url': ссылка, 'file_info': тип ссылки}` или `{}`, если ссылку нужно пропустить.
+        Если ссылку нужно скачивать, возвращает `None`
+        `url`: ссылка
+        '''
+        file_info = self.get_file_info(url)
+        if file_info is None:
+            return None
+        if file_info == skip_file_info:
+            return {}
+        return {'url': url, 'file_info': file_info}
+
+    def classify_many(self, urls: Iterable[str]) -> List[Dict[str, str] | None]:
+        '''
+        Классифицирует список ссылок, например, все ссылки диалога, до создания задач на скачивание
+        `urls`: ссылки
+        '''
+        classify = self.classify
+        return [classify(url) for url in urls]
@@ -1,14 +1,18 @@
-from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import Executor, ProcessPoolExecutor
 from configparser import ConfigParser
+from datetime import datetime
 from itertools import chain
-from os import cpu_count, listdir
-from os.path import isdir, isfile, join, split, splitext
-from typing import Callable, Dict, Iterator, List, Tuple
-
-from bs4 import BeautifulSoup
+from os import cpu_count
+from os.path import join, split, splitext
+from time import perf_counter
+from typing import Any, Callable, Dict, Iterator, List, Tuple
 
+import metrics
 import tools
+from archive_reader import DirectorySource, ZipSource, directory_source, get_archive_source
+from html_parsers import check_html_parser, get_html_parser
 from logger import create_logger
+from parse_cache import ParseCache
 
 config = ConfigParser()
 config_read = config.read('config.ini', encoding='utf8')
@@ -17,6 +21,58 @@ if config_read:
     log_level = config['main_parameters'].get('log_level', 'DEBUG')
 logger = create_logger('logs/vk_parser.log', 'links_finder', log_level)
 
+# Количество обработанных файлов, после которого их результаты сохраняются в `parse_cache`
+parse_cache_batch_size = 256
+
+
+def parse_archive_file(task: Tuple[Any, ...]) -> Any:
+    '''
+    Обрабатывает один файл архива в процессе-обработчике
+    `task`: кортеж из функции-обработчика и ее аргументов (путь до файла, кодировка, обработчик `.html` файлов, источник файлов архива)
+    '''
+    func_handler, *args = task
+    return func_handler(*args)
+
+
+def parse_archive_file_timed(task: Tuple[Any, ...]) -> Tuple[Any, float]:
+    '''
+    Обрабатывает один файл архива в процессе-обработчике и возвращает результат вместе со временем обработки в секундах
+    `task`: кортеж из функции-обработчика и ее аргументов (путь до файла, кодировка, обработчик `.html` файлов, источник файлов архива)
+    '''
+    start = perf_counter()
+    result = parse_archive_file(task)
+    return result, perf_counter() - start
+
+
+def parse_archive_file_with_hash(task: Tuple[Any, ...]) -> Tuple[Any, float, str]:
+    '''
+    Обрабатывает один файл архива в процессе-обработчике и возвращает результат, время обработки в секундах
+    и хэш `sha256` файла
+    `task`: кортеж из функции-обработчика и ее аргументов (путь до файла, кодировка, обработчик `.html` файлов, источник файлов архива)
+    '''
+    return *parse_archive_file_timed(task), task[4].get_hash(task[1])
+
+
+def get_cache_handler(task: Tuple[Any, ...]) -> str:
+    '''
+    Возвращает имя, под которым результат обработки файла хранится в `parse_cache`.
+    Кроме функции-обработчика в имя входят обработчик `.html` файлов и кодировка, так как от них зависит результат
+    `task`: кортеж из функции-обработчика и ее аргументов (путь до файла, кодировка, обработчик `.html` файлов, источник файлов архива)
+    '''
+    return f'{task[0].__name__}:{task[3]}:{task[2]}'
+
+
+def get_chunk_size(tasks_count: int, core_count: int, chunks_per_core: int = 4) -> int:
+    '''
+    Возвращает размер пачки файлов, отправляемой в один процесс за раз.
+    Маленькие диалоги объединяются в пачки, чтобы не тратить время на передачу каждого файла отдельно
+    `tasks_count`: общее количество файлов
+    `core_count`: количество используемых процессов
+    `chunks_per_core`: количество пачек на один процесс. Чем больше пачек, тем раньше становятся доступны первые результаты
+    '''
+    chunk_size, extra = divmod(tasks_count, core_count * chunks_per_core)
+    return chunk_size + 1 if extra else max(chunk_size, 1)
+
 
 class VKLinkFinder():
     def __init__(
@@ -25,15 +81,27 @@ class VKLinkFinder():
         folder_names: Dict[str, str],
         vk_url: str = 'https://vk.com/',
         vk_encoding: str = 'cp1251',
-        core_count: int = 0
+        core_count: int = 0,
+        executor: Executor | None = None,
+        html_parser: str = 'bs4',
+        parse_cache: ParseCache | None = None,
+        pipelined: bool = False,
+        archive_source: DirectorySource | ZipSource | None = None
     ) -> None:
         '''
         Парсер архива VKontakte.
-        `archive_path`: Путь до архива
+        `archive_path`: Путь до папки архива или до `.zip` архива
         `folder_names` словарь папок
         `vk_url`: ссылка на VK. Обычно, `https://vk.com/`
-        `vk_encoding`: Кодировка `.html` файлов VK. Обычно, `cp1251`
+        `vk_encoding`: Кодировка `.html` файлов VK, если она не указана в самом файле. Обычно, `cp1251`
         `core_count`: число потоков для многопоточной работы
+        `executor`: пул процессов для обработки файлов. Если не указан, будет создан один пул на все время поиска
+        `html_parser`: обработчик `.html` файлов: `bs4`, `lxml`, `selectolax`, `stream` или `bytes`
+        `parse_cache`: хранилище результатов обработки файлов. Если указано, неизмененные с прошлого запуска
+        файлы не будут обработаны повторно
+        `pipelined`: если `True`, архив не обрабатывается при создании объекта. Ссылки нужно получать
+        по частям через `iter_link_batches`, а `link_info` будет заполнен после получения всех частей
+        `archive_source`: источник файлов архива. Если не указан, определяется по `archive_path` через `get_archive_source`
 
         Возвращает информацию обо всех найденных ссылках в архиве
         ```
@@ -52,6 +120,10 @@ class VKLinkFinder():
         self.vk_url = vk_url
         self.vk_encoding = vk_encoding
         self.folder_names = folder_names
+        self.html_parser = check_html_parser(html_parser)
+        self.parse_cache = parse_cache
+        self.archive_source = archive_source if archive_source is not None else get_archive_source(archive_path)
+        logger.info(f'Обработчик .html файлов: {self.html_parser}')
         if core_count <= 0:
             self.core_count = cpu_count()
             if self.core_count is None:
@@ -63,59 +135,73 @@ class VKLinkFinder():
             self.core_count = core_count
             logger.info(f'Количество потоков, используемых для получение 🔗: {self.core_count}')
 
-        self.link_info = self.__get_vk_attachments()
+        self.pipelined = pipelined
+        self.link_info = {}
+        if pipelined:
+            return
+        if executor is None:
+            with ProcessPoolExecutor(self.core_count) as executor:
+                self.link_info = self.__get_vk_attachments(executor)
+        else:
+            self.link_info = self.__get_vk_attachments(executor)
 
     @classmethod
-    def get_messages_attachment(self, file_path: str, vk_encoding: str = 'cp1251') -> Dict[str, List[str]] | None:
+    def get_messages_attachment(
+        self,
+        file_path: str,
+        vk_encoding: str = 'cp1251',
+        html_parser: str = 'bs4',
+        archive_source: DirectorySource | ZipSource = directory_source
+    ) -> Dict[str, Any] | None:
         '''
-        Возвращает все ссылки на вложения из `html` файла сообщений
+        Возвращает информацию о `html` файле сообщений, полученную за один его разбор:
+        имя диалога (`name`, `None`, если не найдено), номер страницы диалога (`page`) и все ссылки на вложения (`links`)
         `file_path`: путь до файла для чтения
-        `vk_encoding`: Кодировка `.html` файлов VK. Обычно, `cp1251`
+        `vk_encoding`: Кодировка `.html` файлов VK, если она не указана в самом файле. Обычно, `cp1251`
+        `html_parser`: обработчик `.html` файлов: `bs4`, `lxml`, `selectolax`, `stream` или `bytes`
+        `archive_source`: источник файлов архива: распакованная папка или `.zip` архив
         '''
-        with open(file_path, encoding=vk_encoding) as f:
+        with archive_source.open(file_path, vk_encoding) as f:
             try:
                 messages_info = {}
-                soup = BeautifulSoup(f.read(), 'html.parser')
-                messages = soup.find_all('div', class_='item__main')
-                if messages:
-                    for mes in messages:
-                        link = mes.find('a', class_='attachment__link')
-                        if link:
-                            date = mes.find('div', class_='message__header')
-                            if date:
-                                date = date.text.strip()
-                                date = '_'.join(date[date.rfind(', ') + 1:].split(' ')[1:4])
-                            else:
-                                date = 'no_date'
-                            link_storage = messages_info.setdefault(date, [])
-                            link_storage.append(link['href'])
-                    return messages_info
-                return ''
+                dialog_name, items = get_html_parser(html_parser).get_messages(f)
+                for date, link in items:
+                    if date is not None:
+                        date = date.strip()
+                        date = '_'.join(date[date.rfind(', ') + 1:].split(' ')[1:4])
+                    else:
+                        date = 'no_date'
+                    link_storage = messages_info.setdefault(date, [])
+                    link_storage.append(link)
+                return {'name': dialog_name, 'page': self.get_page_index(file_path), 'links': messages_info}
             except Exception as e:
                 logger.error(f'Ошибка в файле {file_path}: {e}. Он будет пропущен.')
                 return ''
 
     @classmethod
-    def get_photos_attachment(self, file_path: str, vk_encoding: str = 'cp1251') -> Dict[str, list] | None:
+    def get_photos_attachment(
+        self,
+        file_path: str,
+        vk_encoding: str = 'cp1251',
+        html_parser: str = 'bs4',
+        archive_source: DirectorySource | ZipSource = directory_source
+    ) -> Dict[str, list] | None:
         '''
         Возвращает все ссылки на вложения из `html` файла фото профиля
         `file_path`: путь до файла для чтения
-        `vk_encoding`: Кодировка `.html` файлов VK. Обычно, `cp1251`
+        `vk_encoding`: Кодировка `.html` файлов VK, если она не указана в самом файле. Обычно, `cp1251`
+        `html_parser`: обработчик `.html` файлов: `bs4`, `lxml`, `selectolax`, `stream` или `bytes`
+        `archive_source`: источник файлов архива: распакованная папка или `.zip` архив
         '''
-        with open(file_path, encoding=vk_encoding) as f:
+        with archive_source.open(file_path, vk_encoding) as f:
             try:
-                html_content = f.read()
-                soup = BeautifulSoup(html_content, 'html.parser')
-                items = soup.find_all('div', class_='item')
+                albom_name, items = get_html_parser(html_parser).get_photos(f)
                 if items:
-                    albom_name = self.hook_albom_name(html_content)
                     result = {albom_name: {}}
-                    for item in items:
-                        find_link = item.find('img')['src']
+                    for date, find_link in items:
                         if 'http' in find_link:
-                            date = item.find('div', class_='clear_fix')
-                            if date:
-                                date = date.text.strip()
+                            if date is not None:
+                                date = date.strip()
                                 date = '_'.join(date.split(' ')[:-2])
                             else:
                                 date = 'no_date'
@@ -128,115 +214,137 @@ class VKLinkFinder():
                 return ''
 
     @classmethod
-    def get_doc_attachment(self, file_path: str, vk_encoding: str = 'cp1251') -> List[str] | None:
+    def get_doc_attachment(
+        self,
+        file_path: str,
+        vk_encoding: str = 'cp1251',
+        html_parser: str = 'bs4',
+        archive_source: DirectorySource | ZipSource = directory_source
+    ) -> List[str] | None:
         '''
         Возвращает все ссылки на вложения из `html` файла документов профиля
         `file_path`: путь до файла для чтения
-        `vk_encoding`: Кодировка `.html` файлов VK. Обычно, `cp1251`
+        `vk_encoding`: Кодировка `.html` файлов VK, если она не указана в самом файле. Обычно, `cp1251`
+        `html_parser`: обработчик `.html` файлов: `bs4`, `lxml`, `selectolax`, `stream` или `bytes`
+        `archive_source`: источник файлов архива: распакованная папка или `.zip` архив
         '''
-        with open(file_path, encoding=vk_encoding) as f:
+        with archive_source.open(file_path, vk_encoding) as f:
             try:
                 doc_info = {}
-                soup = BeautifulSoup(f.read(), 'html.parser')
-                items = soup.find_all('div', class_='item')
-                if items:
-                    for el in items:
-                        link = el.find('a', href=str)
-                        if link:
-                            date = el.find('div', class_='item__tertiary')
-                            if date:
-                                date = date.text.strip()
-                                date = '_'.join(date.replace('\n', ' ').split(' ')[0:3])
-                            else:
-                                date = 'no_date'
-                            link_storage = doc_info.setdefault(date, [])
-                            link_storage.append(link['href'])
-                    return doc_info
-                return ''
+                for date, link in get_html_parser(html_parser).get_docs(f):
+                    if date is not None:
+                        date = date.strip()
+                        date = '_'.join(date.replace('\n', ' ').split(' ')[0:3])
+                    else:
+                        date = 'no_date'
+                    link_storage = doc_info.setdefault(date, [])
+                    link_storage.append(link)
+                return doc_info
             except Exception as e:
                 logger.error(f'Ошибка в файле {file_path}: {e}. Он будет пропущен.')
                 return ''
 
     @classmethod
-    def get_likes_attachment(self, file_path: str, vk_encoding: str = 'cp1251') -> List[str] | None:
+    def get_likes_attachment(
+        self,
+        file_path: str,
+        vk_encoding: str = 'cp1251',
+        html_parser: str = 'bs4',
+        archive_source: DirectorySource | ZipSource = directory_source
+    ) -> List[str] | None:
         '''
         Возвращает все ссылки на вложения из `html` файла лайкнутых фото профиля
         `file_path`: путь до файла для чтения
-        `vk_encoding`: Кодировка `.html` файлов VK. Обычно, `cp1251`
+        `vk_encoding`: Кодировка `.html` файлов VK, если она не указана в самом файле. Обычно, `cp1251`
+        `html_parser`: обработчик `.html` файлов: `bs4`, `lxml`, `selectolax`, `stream` или `bytes`
+        `archive_source`: источник файлов архива: распакованная папка или `.zip` архив
         '''
-        with open(file_path, encoding=vk_encoding) as f:
+        with archive_source.open(file_path, vk_encoding) as f:
             try:
-                soup = BeautifulSoup(f.read(), 'html.parser')
-                link_tags = soup.find_all('a', href=str)
-                if link_tags:
-                    result = []
-                    for link in link_tags:
-                        find_link = link['href']
-                        if 'vk.com' in find_link:
-                            result.append(find_link)
-                    return result
-                return ''
+                return [link for link in get_html_parser(html_parser).get_likes(f) if 'vk.com' in link]
             except Exception as e:
                 logger.error(f'Ошибка в файле {file_path}: {e}. Он будет пропущен.')
                 return ''
 
     @classmethod
-    def get_all_files_from_directory(self, path: str, ext: list) -> List[str]:
+    def get_all_files_from_directory(
+        self,
+        path: str,
+        ext: list,
+        archive_source: DirectorySource | ZipSource = directory_source
+    ) -> List[str]:
         '''
         Возвращает пути до всех файлов, которые содержатся в папке
         `path`: путь до необходимой папки
         `ext`: какие типы файлов необходимы (расширения файлов)
+        `archive_source`: источник файлов архива: распакованная папка или `.zip` архив
         '''
-        return [join(path, f) for f in listdir(path) if isfile(join(path, f)) and splitext(join(path, f))[1] in ext]
+        return archive_source.list_files(path, ext)
 
     @classmethod
-    def walk_directory(self, dir_path: str, func_handler: Callable, core_count: int = 1) -> Iterator:
+    def get_html_files(self, dir_path: str, archive_source: DirectorySource | ZipSource = directory_source) -> List[str]:
+        '''
+        Возвращает пути до всех `.html` файлов из папки. Если указан путь до файла, вернет только его
+        `dir_path`: путь до папки или файла
+        `archive_source`: источник файлов архива: распакованная папка или `.zip` архив
+        '''
+        if archive_source.is_file(dir_path):
+            return [dir_path]
+        return self.get_all_files_from_directory(dir_path, ['.html'], archive_source)
+
+    @classmethod
+    def walk_directory(
+        self,
+        dir_path: str,
+        func_handler: Callable,
+        core_count: int = 1,
+        executor: Executor | None = None,
+        vk_encoding: str = 'cp1251',
+        html_parser: str = 'bs4',
+        archive_source: DirectorySource | ZipSource = directory_source
+    ) -> Iterator:
         '''
         Возвращает все вложения из папки. Если указан путь до файла, операция будет выполнена только с ним
         `dir_path`: путь до папки
         `func_handler`: функция-обработчки для файлов из `dir_path`
         `core_count`: Количество используемых потоков в `ProcessPoolExecutor`
+        `executor`: уже созданный пул процессов. Если не указан, будет создан временный пул
+        `vk_encoding`: Кодировка `.html` файлов VK, если она не указана в самом файле. Обычно, `cp1251`
+        `html_parser`: обработчик `.html` файлов: `bs4`, `lxml`, `selectolax`, `stream` или `bytes`
+        `archive_source`: источник файлов архива: распакованная папка или `.zip` архив
         '''
-        if isfile(dir_path):
-            files = [dir_path]
-        else:
-            files = self.get_all_files_from_directory(dir_path, ['.html'])
+        tasks = [
+            (func_handler, f, vk_encoding, html_parser, archive_source)
+            for f in self.get_html_files(dir_path, archive_source)
+        ]
+        if executor is not None:
+            return executor.map(parse_archive_file, tasks, chunksize=get_chunk_size(len(tasks), core_count))
         with ProcessPoolExecutor(core_count) as executor:
-            result = executor.map(func_handler, files)
+            result = executor.map(parse_archive_file, tasks, chunksize=get_chunk_size(len(tasks), core_count))
         return result
 
     @classmethod
-    def get_all_dirs_from_directory(self, path: str) -> List[str]:
+    def get_all_dirs_from_directory(
+        self,
+        path: str,
+        archive_source: DirectorySource | ZipSource = directory_source
+    ) -> List[str]:
         '''
         Возвращает путь до всех папок, находящиеся в нужной папке
         `path`: путь до нужной папки
+        `archive_source`: источник файлов архива: распакованная папка или `.zip` архив
         '''
-        return [join(path, f) for f in listdir(path) if isdir(join(path, f))]
+        return archive_source.list_dirs(path)
 
     @classmethod
-    def hook_dialog_name(self, path: str, vk_encoding: str = 'cp1251') -> str | None:
+    def get_page_index(self, file_path: str) -> int | None:
         '''
-        Находит имя человека, с которым велся диалог (или название диалога/беседы)
-        Если имя не будет найдено, вернет `None`
-        `path`: путь до папки диалога
-        `vk_encoding`: Кодировка `.html` файлов VK. Обычно, `cp1251`
+        Возвращает номер страницы диалога из имени файла сообщений `messages<номер>.html`
+        Если номер не будет найден, вернет `None`
+        `file_path`: путь до файла сообщений
         '''
-        with open(join(path, 'messages0.html'), 'r', encoding=vk_encoding) as f:
-            html = f.read()
-            soup = BeautifulSoup(html, 'html.parser')
-            name = soup.find('div', class_='ui_crumb')
-        return None if name is None else str(name.string)
-
-    @classmethod
-    def hook_albom_name(self, html_content: str) -> str | None:
-        '''
-        Находит название альбома с фото
-        Если название не будет найдено, вернет `None`
-        `html_content`: прочитанный `.html` файл
-        '''
-        soup = BeautifulSoup(html_content, 'html.parser')
-        name = soup.find('div', class_='ui_crumb')
-        return None if name is None else str(name.string)
+        index = splitext(split(file_path)[1])[0][len('messages'):]
+        return int(index) if index.isdigit() else None
 
     @classmethod
     def get_dialog_type(self, dialog_path: str) -> Tuple[str | int]:
@@ -251,95 +359,214 @@ class VKLinkFinder():
         dialog_id = folder_name.replace('-', '')
         return dialog_type, dialog_id
 
-    def __get_vk_attachments(self) -> Dict[str, dict]:
+    def parse_files(self, executor: Executor, tasks: List[Tuple[Any, ...]]) -> Iterator[Any]:
+        '''
+        Обрабатывает файлы архива в пуле процессов и возвращает результаты в порядке `tasks` по мере их готовности.
+        Если указан `parse_cache`, результаты неизмененных файлов берутся из него, а обрабатываются только новые и измененные.
+        Время обработки каждого файла учитывается в `metrics`
+        `executor`: пул процессов для обработки файлов
+        `tasks`: кортежи из функции-обработчика и ее аргументов (путь до файла, кодировка, обработчик `.html` файлов, источник файлов архива)
+        '''
+        chunks_per_core = 16 if self.pipelined else 4
+        if self.parse_cache is None:
+            parsed = executor.map(
+                parse_archive_file_timed,
+                tasks,
+                chunksize=get_chunk_size(len(tasks), self.core_count, chunks_per_core)
+            )
+            for task, (result, elapsed) in zip(tasks, parsed):
+                metrics.parsed_files.inc(handler=task[0].__name__, source='parsed')
+                metrics.parse_duration.observe(elapsed, handler=task[0].__name__)
+                yield result
+            return
+
+        cached = {}
+        missed = []
+        for i, task in enumerate(tasks):
+            found, result = self.parse_cache.get(task[1], get_cache_handler(task), self.archive_source)
+            if found:
+                cached[i] = result
+            else:
+                missed.append(i)
+        logger.info(f'Файлов архива без изменений: {len(cached)}, новых или измененных: {len(missed)}')
+
+        # Размер и время изменения берутся до обработки, чтобы изменение файла во время обработки не осталось незамеченным
+        fingerprints = [self.archive_source.get_fingerprint(tasks[i][1]) for i in missed]
+        parsed = executor.map(
+            parse_archive_file_with_hash,
+            [tasks[i] for i in missed],
+            chunksize=get_chunk_size(len(missed), self.core_count, chunks_per_core)
+        ) if missed else iter(())
+        # Результаты сохраняются частями по мере обработки, чтобы прерванный запуск не терял уже обработанные файлы
+        records = []
+        missed_fingerprints = iter(fingerprints)
+        try:
+            for i, task in enumerate(tasks):
+                if i in cached:
+                    metrics.parsed_files.inc(handler=task[0].__name__, source='cache')
+                    yield cached.pop(i)
+                    continue
+                result, elapsed, sha256 = next(parsed)
+                metrics.parsed_files.inc(handler=task[0].__name__, source='parsed')
+                metrics.parse_duration.observe(elapsed, handler=task[0].__name__)
+                size, mtime_ns = next(missed_fingerprints)
+                records.append((task[1], get_cache_handler(task), size, mtime_ns, sha256, result))
+                if len(records) >= parse_cache_batch_size:
+                    self.parse_cache.update_many(records)
+                    records = []
+                yield result
+        finally:
+            if records:
+                self.parse_cache.update_many(records)
+
+    def __get_vk_attachments(self, executor: Executor) -> Dict[str, dict]:
         '''
-        Возвращает информацию о всех вложения в VK архиве
-        `base_dir`: путь до папки VK архива
+        Возвращает информацию о всех вложения в VK архиве.
+        Все файлы архива собираются в одну общую очередь и обрабатываются одним пулом процессов
+        `executor`: пул процессов для обработки файлов
         '''
+        for _ in self.iter_link_batches(executor):
+            pass
+        return self.link_info
+
+    def iter_link_batches(self, executor: Executor | None = None) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        '''
+        Обрабатывает архив и возвращает найденные ссылки частями по мере обработки файлов:
+        сообщения - по диалогам, остальные типы данных - по файлам.
+        Каждая часть - кортеж из типа данных и информации о ссылках в том же виде, что и в `link_info`.
+        После получения всех частей `link_info` содержит информацию обо всех ссылках
+        `executor`: пул процессов для обработки файлов. Если не указан, будет создан один пул на все время поиска
+        '''
+        if executor is None:
+            with ProcessPoolExecutor(self.core_count) as executor:
+                yield from self.iter_link_batches(executor)
+            return
+
         result = {}
+        # Файлы каждого раздела: (раздел, ключ группы)
+        files_info = []
+        tasks = []
+
+        def add_files(section: str, key: str | None, func_handler: Callable, dir_path: str) -> None:
+            for file_path in self.get_html_files(dir_path, self.archive_source):
+                files_info.append((section, key))
+                tasks.append((func_handler, file_path, self.vk_encoding, self.html_parser, self.archive_source))
 
-        all_find_links = 0
+        phase_start = datetime.now()
 
-        mes_links = 0
+        dialogs_info = {}
         mes_folder = self.folder_names.get('messages', False)
         if mes_folder:
-            result['messages'] = {}
-            dirs = self.get_all_dirs_from_directory(join(self.archive_path, mes_folder))
+            result['messages'] = dialogs_info
+            dirs = self.get_all_dirs_from_directory(join(self.archive_path, mes_folder), self.archive_source)
             for path in dirs:
                 logger.info(f'📁: {path}')
                 dialog_type, dialog_id = self.get_dialog_type(path)
                 dialog_full_id = f'{dialog_type}{dialog_id}'
-                dialog_name = self.hook_dialog_name(path, self.vk_encoding)
-                find_links = list(self.walk_directory(path, self.get_messages_attachment, self.core_count))
-                logger.info(f'=> Имя диалога: {dialog_name}')
                 logger.info(f'=> 🆔 диалога: {dialog_full_id}')
-                all_links = {}
-                for el in find_links:
-                    if el:
-                        for date, links in el.items():
-                            if date != 'no_date':
-                                date = tools.get_numberic_date(date)
-                            links_storage = all_links.setdefault(date, [])
-                            links_storage.extend(links)
-                            mes_links += len(links)
-                result['messages'][dialog_id] = {
-                    'name': dialog_name,
+                # Имя диалога берется из первой страницы при ее обработке вместе с остальными файлами
+                dialogs_info[dialog_id] = {
+                    'name': None,
                     'dialog_link': f'{self.vk_url}{dialog_full_id}',
-                    'links': all_links
+                    'links': {}
                 }
-            logger.info(f'🔍 Количество найденных 🔗 в {mes_folder}: {mes_links}')
-            all_find_links += mes_links
+                add_files('messages', dialog_id, self.get_messages_attachment, path)
 
-        likes_photo_links = 0
         likes_photo_folder = self.folder_names.get('likes/photo', False)
         if likes_photo_folder:
             path = join(self.archive_path, likes_photo_folder)
             logger.info(f'📁: {path}')
-            find_links = list(set(chain(*self.walk_directory(path, self.get_likes_attachment, self.core_count))))
-            count_find_link = len(find_links)
-            likes_photo_links += count_find_link
-            result['likes/photo'] = {
-                'links': find_links
-            }
-            logger.info(f'🔍 Количество найденных 🔗 в {likes_photo_folder}: {likes_photo_links}')
-            all_find_links += likes_photo_links
-
-        profile_photos_links = 0
+            result['likes/photo'] = {'links': []}
+            add_files('likes/photo', None, self.get_likes_attachment, path)
+
         profile_photo_folder = self.folder_names.get('photos', False)
         if profile_photo_folder:
-            result['photos'] = {}
             path = join(self.archive_path, profile_photo_folder)
             logger.info(f'📁: {path}')
-            find_links = list(self.walk_directory(path, self.get_photos_attachment, self.core_count))
-            for el in find_links:
-                if el:
-                    for albom, date_info in el.items():
-                        date_info = {tools.get_numberic_date(date): links for date, links in date_info.items()}
-                        date_storage = result['photos'].setdefault(albom, {})
-                        date_storage.update(date_info)
-                        profile_photos_links += sum(len(items) for items in date_info.values())
-            logger.info(f'🔍 Количество найденных 🔗 в {profile_photo_folder}: {profile_photos_links}')
-            all_find_links += profile_photos_links
+            result['photos'] = {}
+            add_files('photos', None, self.get_photos_attachment, path)
 
-        documents_links = 0
         documents_folder = self.folder_names.get('profile', False)
         if documents_folder:
-            result['profile'] = {}
-            dirs = self.get_all_dirs_from_directory(join(self.archive_path, documents_folder))
             path = join(self.archive_path, documents_folder, 'documents.html')
             logger.info(f'📁: {path}')
-            find_links = list(self.walk_directory(path, self.get_doc_attachment, self.core_count))
-            for el in find_links:
+            result['profile'] = {}
+            add_files('profile', None, self.get_doc_attachment, path)
+
+        logger.info(f'⌛ поиска файлов архива: {datetime.now() - phase_start}, найдено файлов: {len(tasks)}')
+
+        phase_start = datetime.now()
+        # Количество еще не обработанных файлов каждого диалога
+        dialog_files_left = {}
+        for section, key in files_info:
+            if section == 'messages':
+                dialog_files_left[key] = dialog_files_left.get(key, 0) + 1
+        # Диалоги без `.html` файлов передаются сразу, как и в `link_info`, - с пустыми ссылками
+        for key, dialog_info in dialogs_info.items():
+            if key not in dialog_files_left:
+                logger.info(f'=> В диалоге {dialog_info["dialog_link"]} нет .html файлов')
+                yield 'messages', {key: dialog_info}
+        # Номер страницы, из которой взято имя каждого диалога
+        dialog_name_pages = {}
+        seen_likes = set()
+        links_count = {section: 0 for section in result}
+
+        # Результаты идут первыми, чтобы `parse_files` был пройден до конца и сохранил их в `parse_cache`
+        for el, (section, key) in zip(self.parse_files(executor, tasks), files_info):
+            if section == 'messages':
+                dialog_info = dialogs_info[key]
                 if el:
-                    for date, links in el.items():
+                    page = el['page'] if el['page'] is not None else float('inf')
+                    if el['name'] is not None and (key not in dialog_name_pages or page < dialog_name_pages[key]):
+                        dialog_info['name'] = el['name']
+                        dialog_name_pages[key] = page
+                    for date, links in el['links'].items():
                         if date != 'no_date':
                             date = tools.get_numberic_date(date)
-                        links_storage = result['profile'].setdefault(date, [])
+                        links_storage = dialog_info['links'].setdefault(date, [])
                         links_storage.extend(links)
-                        documents_links += len(links)
-            logger.info(f'🔍 Количество найденных 🔗 в {documents_folder}: {documents_links}')
-            all_find_links += documents_links
+                        links_count[section] += len(links)
+                dialog_files_left[key] -= 1
+                if dialog_files_left[key] == 0:
+                    logger.info(f'=> Имя диалога {dialog_info["dialog_link"]}: {dialog_info["name"]}')
+                    yield section, {key: dialog_info}
+            elif section == 'likes/photo':
+                new_links = [link for link in dict.fromkeys(el or []) if link not in seen_likes]
+                seen_likes.update(new_links)
+                result[section]['links'].extend(new_links)
+                links_count[section] += len(new_links)
+                if new_links:
+                    yield section, {'links': new_links}
+            elif section == 'photos':
+                if el:
+                    batch = {}
+                    for albom, date_info in el.items():
+                        date_info = {tools.get_numberic_date(date): links for date, links in date_info.items()}
+                        date_storage = result[section].setdefault(albom, {})
+                        date_storage.update(date_info)
+                        batch[albom] = date_info
+                        links_count[section] += sum(len(items) for items in date_info.values())
+                    yield section, batch
+            elif section == 'profile':
+                if el:
+                    batch = {}
+                    for date, links in el.items():
+                        if date != 'no_date':
+                            date = tools.get_numberic_date(date)
+                        batch.setdefault(date, []).extend(links)
+                        result[section].setdefault(date, []).extend(links)
+                        links_count[section] += len(links)
+                    yield section, batch
+        logger.info(f'⌛ обработки файлов архива: {datetime.now() - phase_start}')
 
-        logger.info(f'🔍 Количество всех найденных 🔗: {all_find_links}')
+        section_folders = {
+            'messages': mes_folder,
+            'likes/photo': likes_photo_folder,
+            'photos': profile_photo_folder,
+            'profile': documents_folder
+        }
+        for section, count in links_count.items():
+            logger.info(f'🔍 Количество найденных 🔗 в {section_folders[section]}: {count}')
+        logger.info(f'🔍 Количество всех найденных 🔗: {sum(links_count.values())}')
 
-        return result
+        self.link_info = result
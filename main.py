@@ -1,24 +1,33 @@
+import argparse
 import asyncio
 import os
-import ssl
 from configparser import ConfigParser
 from datetime import datetime
-from json import dumps
+from itertools import chain
+from json import dump
 from multiprocessing import freeze_support
-from os.path import isdir, join
+from os.path import join
 from traceback import format_exc
-from typing import Any, Dict, Tuple
+from typing import Any, AsyncIterator, Callable, Dict, List, Tuple
 
 import aiohttp
 import browser_cookie3
 import urllib3
-from latest_user_agents import get_random_user_agent
 from requests.utils import dict_from_cookiejar
 
 import data_downloader
+import metrics
 import tools
+from archive_reader import DirectorySource, ZipSource, directory_source, get_archive_source
 from links_finder import VKLinkFinder
+from dedup import FileDeduplicator, dedup_modes
 from logger import create_logger
+from manifest import DownloadManifest
+from output_writer import LinksWriter, write_links_info
+from parse_cache import ParseCache
+from retry import RetryPolicy
+from scheduler import AdaptiveLimiter, DownloadScheduler
+from shards import get_shard_folder, in_shard, merge_shards, parse_shard
 
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
@@ -32,263 +41,439 @@ logger = create_logger('logs/vk_parser.log', 'main', log_level)
 output_folder = 'output'
 
 
-def get_ssl_context_tcp_connector(disable_ssl: bool = False) -> aiohttp.TCPConnector:
-    ssl_context = ssl.create_default_context()
-    if disable_ssl:
-        ssl_context.check_hostname = False
-        ssl_context.verify_mode = ssl.CERT_NONE
-    else:
-        ssl_context.check_hostname = True
-        ssl_context.verify_mode = ssl.CERT_REQUIRED
-    return aiohttp.TCPConnector(ssl=ssl_context)
+def result_writer(
+    writer: LinksWriter,
+    data_type: str,
+    group: str | None = None,
+    date: str | None = None
+) -> Callable[[Dict[str, str]], None]:
+    '''
+    Возвращает функцию, которая записывает результат обработки ссылки в `writer` сразу после ее завершения
+    и учитывает его в `metrics`
+    `writer`: запись результатов обработки ссылок
+    `data_type`: тип данных
+    `group`: ID диалога или название альбома
+    `date`: дата
+    '''
+    def write(res: Dict[str, str]) -> None:
+        writer.write_link(data_type, group, date, res)
+        metrics.links_total.inc(type=data_type, file_info=res['file_info'])
+    return write
+
+
+def submit_links(
+    scheduler: DownloadScheduler,
+    pool: str,
+    on_result: Callable[[Dict[str, str]], None],
+    links: List[str],
+    save_path: str,
+    name_counters: Dict[str, int],
+    shard: Tuple[int, int] | None = None,
+    **job_kwargs
+) -> List[asyncio.Future]:
+    '''
+    Создает задачи на обработку ссылок `links` и возвращает их `asyncio.Future`.
+    Каждой ссылке выдается номер, который используется как имя файла, если его не удастся получить из ссылки.
+    Номера идут подряд в пределах папки сохранения, поэтому не повторяются даже для одинаковых ссылок
+    и ссылок разных дат, сохраняемых в одну папку
+    `scheduler`: общий планировщик скачиваний
+    `pool`: класс скачиваний в `scheduler`
+    `on_result`: функция, в которую будет передан результат обработки каждой ссылки
+    `links`: ссылки
+    `save_path`: путь до папки сохранения
+    `name_counters`: количество уже выданных номеров для каждой папки сохранения
+    `shard`: номер части и количество частей при скачивании на нескольких машинах.
+    Ссылки других частей пропускаются, но номера им выдаются, поэтому имена файлов совпадают с обычным запуском
+    `job_kwargs`: остальные аргументы для `data_downloader.get_info`
+    '''
+    start = name_counters.get(save_path, 0)
+    name_counters[save_path] = start + len(links)
+    loop = asyncio.get_running_loop()
+    futures = []
+    # Ссылки, которые не нужно скачивать, классифицируются сразу и не занимают место в очереди планировщика
+    for i, (url, classified) in enumerate(zip(links, data_downloader.links_classifier.classify_many(links))):
+        if not in_shard(url, shard):
+            continue
+        if classified is None:
+            futures.append(scheduler.submit(
+                pool, on_result, url=url, save_path=save_path, file_name=start + i, **job_kwargs
+            ))
+            continue
+        if classified and on_result is not None:
+            on_result(classified)
+        future = loop.create_future()
+        future.set_result(classified)
+        futures.append(future)
+    return futures
 
 
 async def messages_handler(
     info: Dict[str, Any],
     folder: str,
+    data_type: str,
+    writer: LinksWriter,
     cookies: None,
-    sema: asyncio.BoundedSemaphore,
-    disable_ssl: bool = False,
-    save_by_date: bool = False
-) -> Tuple[Any]:
+    scheduler: DownloadScheduler,
+    pool: str,
+    session: aiohttp.ClientSession,
+    save_by_date: bool = False,
+    manifest: DownloadManifest | None = None,
+    dedup: FileDeduplicator | None = None,
+    name_counters: Dict[str, int] | None = None,
+    shard: Tuple[int, int] | None = None
+) -> int:
     '''
     Обработчик данных о сообщениях
     `info` сырые данные для обработчика о сообщениях из `VKLinkFinder`
     `folder`: имя папки для хранения файлов
-    `sema`: семафор для асинхронного скачивания
-    `tcp_connector`: TCP коннектор, если будут изменения в работе TCP
+    `data_type`: тип данных для записи результатов
+    `writer`: запись результатов обработки ссылок
+    `scheduler`: общий планировщик скачиваний
+    `pool`: класс скачиваний в `scheduler`
+    `session`: общая для всех обработчиков сессия ClientSession
     `cookies` cookies файлы авторизации VK
+    `manifest`: хранилище информации о скачиваниях
+    `dedup`: поиск повторяющихся файлов
+    `name_counters`: количество уже выданных номеров файлов для каждой папки сохранения.
+    Нужно, если ссылки одного типа данных обрабатываются по частям
+    `shard`: номер части и количество частей при скачивании на нескольких машинах
 
-    Возвращает структурированные данные и количество обработанных ссылок
+    Возвращает количество обработанных ссылок
     '''
-    result = {}
-    full_count = 0
-    headers = {
-        'Accept-Language': 'ru',
-        'User-Agent': get_random_user_agent()
-    }
-
-    conn = get_ssl_context_tcp_connector(disable_ssl)
-
-    async with aiohttp.ClientSession(headers=headers, connector=conn) as session:
-        for id, id_info in info.items():
-            count_by_id = 0
-            logger.info(f'Начата обработка 🔗 для {id}, {id_info["name"]}')
-            result[id] = {'name': id_info["name"], 'dialog_link': id_info['dialog_link']}
-            dialog_name_id = f'{id_info["name"]}_{id}'
-            path_for_id = tools.clear_charters_by_pattern(join(output_folder, folder, dialog_name_id))
-            for date, links in id_info['links'].items():
-                if save_by_date:
-                    storage = result[id].setdefault(date, {})
-                    path_for_create = tools.clear_charters_by_pattern(join(path_for_id, date))
-                else:
-                    storage = result[id]
-                    path_for_create = path_for_id
-                tasks = [asyncio.ensure_future(
-                    data_downloader.get_info(
-                        url=v,
-                        save_path=path_for_create,
-                        file_name=links.index(v),
-                        session=session,
-                        semaphore=sema,
-                        cookies=cookies
-                    )
-                ) for v in links]
-                full_count += len(tasks)
-                tasks_result = list(filter(lambda link: link, await asyncio.gather(*tasks)))
-                count_by_id += len(tasks_result)
-                for res in tasks_result:
-                    file_info = storage.setdefault(res['file_info'], [])
-                    file_info.append(res['url'])
-            logger.info(f'Количество валидных данных, полученных из 🔗: {count_by_id}')
-    return result, full_count
+    futures_by_id = {}
+    name_counters = {} if name_counters is None else name_counters
+    for id, id_info in info.items():
+        logger.info(f'Начата обработка 🔗 для {id}, {id_info["name"]}')
+        writer.write_group(data_type, id, {'name': id_info['name'], 'dialog_link': id_info['dialog_link']})
+        futures = futures_by_id.setdefault(id, [])
+        dialog_name_id = f'{id_info["name"]}_{id}'
+        path_for_id = tools.clear_charters_by_pattern(join(output_folder, folder, dialog_name_id))
+        for date, links in id_info['links'].items():
+            if save_by_date:
+                path_for_create = tools.clear_charters_by_pattern(join(path_for_id, date))
+            else:
+                path_for_create = path_for_id
+            futures.extend(submit_links(
+                scheduler,
+                pool,
+                result_writer(writer, data_type, id, date),
+                links,
+                path_for_create,
+                name_counters,
+                shard=shard,
+                session=session,
+                cookies=cookies,
+                manifest=manifest,
+                dedup=dedup
+            ))
+    await asyncio.gather(*chain(*futures_by_id.values()))
+    for id, futures in futures_by_id.items():
+        count_by_id = sum(1 for future in futures if future.result())
+        logger.info(f'Количество валидных данных, полученных из 🔗 для {id}: {count_by_id}')
+    return sum(len(futures) for futures in futures_by_id.values())
 
 
 async def likes_photo_handler(
     info: Dict[str, Any],
     folder: str,
+    data_type: str,
+    writer: LinksWriter,
     cookies: None,
-    sema: asyncio.BoundedSemaphore,
-    disable_ssl: bool = False,
-    save_by_date: bool = False
-) -> Tuple[Any]:
+    scheduler: DownloadScheduler,
+    pool: str,
+    session: aiohttp.ClientSession,
+    save_by_date: bool = False,
+    manifest: DownloadManifest | None = None,
+    dedup: FileDeduplicator | None = None,
+    name_counters: Dict[str, int] | None = None,
+    shard: Tuple[int, int] | None = None
+) -> int:
     '''
     Обработчик данных о лайкнутых фото
     `info` сырые данные для обработчика о лайкнутых фото из `VKLinkFinder`
     `folder`: имя папки для хранения файлов
-    `sema`: семафор для асинхронного скачивания
-    `tcp_connector`: TCP коннектор, если будут изменения в работе TCP
+    `data_type`: тип данных для записи результатов
+    `writer`: запись результатов обработки ссылок
+    `scheduler`: общий планировщик скачиваний
+    `pool`: класс скачиваний в `scheduler`
+    `session`: общая для всех обработчиков сессия ClientSession
     `cookies` cookies файлы авторизации VK
+    `manifest`: хранилище информации о скачиваниях
+    `dedup`: поиск повторяющихся файлов
+    `name_counters`: количество уже выданных номеров файлов для каждой папки сохранения.
+    Нужно, если ссылки одного типа данных обрабатываются по частям
+    `shard`: номер части и количество частей при скачивании на нескольких машинах
 
-    Возвращает структурированные данные и количество обработанных ссылок
+    Возвращает количество обработанных ссылок
     '''
-    result = {}
-    full_count = 0
     path_for_create = join(output_folder, folder)
 
-    headers = {
-        'Accept-Language': 'ru',
-        'User-Agent': get_random_user_agent()
-    }
-
-    conn = get_ssl_context_tcp_connector(disable_ssl)
-
-    async with aiohttp.ClientSession(headers=headers, connector=conn) as session:
-        tasks = [asyncio.ensure_future(
-            data_downloader.get_info(
-                url=v,
-                save_path=path_for_create,
-                file_name=info['links'].index(v),
-                session=session,
-                semaphore=sema,
-                cookies=cookies
-            )
-        ) for v in info['links']]
-        count = len(tasks)
-        full_count += count
-        logger.info(f'Задачи на обработку 🔗 созданы, их количество: {count}')
-        tasks_result = list(filter(lambda link: link, await asyncio.gather(*tasks)))
-    for res in tasks_result:
-        file_info = result.setdefault(res['file_info'], [])
-        file_info.append(res['url'])
-    return result, full_count
+    futures = submit_links(
+        scheduler,
+        pool,
+        result_writer(writer, data_type),
+        info['links'],
+        path_for_create,
+        {} if name_counters is None else name_counters,
+        shard=shard,
+        session=session,
+        cookies=cookies,
+        manifest=manifest,
+        dedup=dedup
+    )
+    count = len(futures)
+    logger.info(f'Задачи на обработку 🔗 созданы, их количество: {count}')
+    await asyncio.gather(*futures)
+    return count
 
 
 async def profile_photos_handler(
     info: Dict[str, Any],
     folder: str,
+    data_type: str,
+    writer: LinksWriter,
     cookies: None,
-    sema: asyncio.BoundedSemaphore,
-    disable_ssl: bool = False,
-    save_by_date: bool = False
-) -> Tuple[Any]:
+    scheduler: DownloadScheduler,
+    pool: str,
+    session: aiohttp.ClientSession,
+    save_by_date: bool = False,
+    manifest: DownloadManifest | None = None,
+    dedup: FileDeduplicator | None = None,
+    name_counters: Dict[str, int] | None = None,
+    shard: Tuple[int, int] | None = None
+) -> int:
     '''
     Обработчик данных о фото профиля
     `info` сырые данные для обработчика о фото профиля из `VKLinkFinder`
     `folder`: имя папки для хранения файлов
-    `sema`: семафор для асинхронного скачивания
-    `tcp_connector`: TCP коннектор, если будут изменения в работе TCP
+    `data_type`: тип данных для записи результатов
+    `writer`: запись результатов обработки ссылок
+    `scheduler`: общий планировщик скачиваний
+    `pool`: класс скачиваний в `scheduler`
+    `session`: общая для всех обработчиков сессия ClientSession
     `cookies` cookies файлы авторизации VK
     `save_by_date`: сохранять ли файлы в подпапки на основе даты
+    `manifest`: хранилище информации о скачиваниях
+    `dedup`: поиск повторяющихся файлов
+    `name_counters`: количество уже выданных номеров файлов для каждой папки сохранения.
+    Нужно, если ссылки одного типа данных обрабатываются по частям
+    `shard`: номер части и количество частей при скачивании на нескольких машинах
 
-    Возвращает структурированные данные и количество обработанных ссылок
+    Возвращает количество обработанных ссылок
     '''
-    result = {}
-    full_count = 0
-    headers = {
-        'Accept-Language': 'ru',
-        'User-Agent': get_random_user_agent()
-    }
-
-    conn = get_ssl_context_tcp_connector(disable_ssl)
-
-    async with aiohttp.ClientSession(headers=headers, connector=conn) as session:
-        for albom, albom_info in info.items():
-            logger.info(f'Начата обработка 🔗 для {albom}')
-            result[albom] = {}
-            count_by_albom = 0
-            path_for_albom = tools.clear_charters_by_pattern(join(output_folder, folder, albom))
-            for date, links in albom_info.items():
-                if save_by_date:
-                    storage = result[albom].setdefault(date, {})
-                    path_for_create = tools.clear_charters_by_pattern(join(path_for_albom, date))
-                else:
-                    storage = result[albom]
-                    path_for_create = path_for_albom
-                tasks = [asyncio.ensure_future(
-                    data_downloader.get_info(
-                        url=v,
-                        save_path=path_for_create,
-                        file_name=links.index(v),
-                        session=session,
-                        semaphore=sema,
-                        cookies=cookies
-                    )
-                ) for v in links]
-                full_count += len(tasks)
-                tasks_result = list(filter(lambda link: link, await asyncio.gather(*tasks)))
-                count_by_albom += len(tasks_result)
-                for res in tasks_result:
-                    file_info = storage.setdefault(res['file_info'], [])
-                    file_info.append(res['url'])
-            logger.info(f'Количество валидных данных, полученных из 🔗: {count_by_albom}')
-    return result, full_count
+    futures_by_albom = {}
+    name_counters = {} if name_counters is None else name_counters
+    for albom, albom_info in info.items():
+        logger.info(f'Начата обработка 🔗 для {albom}')
+        writer.write_group(data_type, albom)
+        futures = futures_by_albom.setdefault(albom, [])
+        path_for_albom = tools.clear_charters_by_pattern(join(output_folder, folder, albom))
+        for date, links in albom_info.items():
+            if save_by_date:
+                path_for_create = tools.clear_charters_by_pattern(join(path_for_albom, date))
+            else:
+                path_for_create = path_for_albom
+            futures.extend(submit_links(
+                scheduler,
+                pool,
+                result_writer(writer, data_type, albom, date),
+                links,
+                path_for_create,
+                name_counters,
+                shard=shard,
+                session=session,
+                cookies=cookies,
+                manifest=manifest,
+                dedup=dedup
+            ))
+    await asyncio.gather(*chain(*futures_by_albom.values()))
+    for albom, futures in futures_by_albom.items():
+        count_by_albom = sum(1 for future in futures if future.result())
+        logger.info(f'Количество валидных данных, полученных из 🔗 для {albom}: {count_by_albom}')
+    return sum(len(futures) for futures in futures_by_albom.values())
 
 
 async def profile_handler(
     info: Dict[str, Any],
     folder: str,
+    data_type: str,
+    writer: LinksWriter,
     cookies: None,
-    sema: asyncio.BoundedSemaphore,
-    disable_ssl: bool = False,
-    save_by_date: bool = False
-) -> Tuple[Any]:
+    scheduler: DownloadScheduler,
+    pool: str,
+    session: aiohttp.ClientSession,
+    save_by_date: bool = False,
+    manifest: DownloadManifest | None = None,
+    dedup: FileDeduplicator | None = None,
+    name_counters: Dict[str, int] | None = None,
+    shard: Tuple[int, int] | None = None
+) -> int:
     '''
     Обработчик данных о профиле (скорее, о документах профиля)
     `info` сырые данные для обработчика о профиле `VKLinkFinder`
     `folder`: имя папки для хранения файлов
-    `sema`: семафор для асинхронного скачивания
-    `tcp_connector`: TCP коннектор, если будут изменения в работе TCP
+    `data_type`: тип данных для записи результатов
+    `writer`: запись результатов обработки ссылок
+    `scheduler`: общий планировщик скачиваний
+    `pool`: класс скачиваний в `scheduler`
+    `session`: общая для всех обработчиков сессия ClientSession
     `cookies` cookies файлы авторизации VK
+    `manifest`: хранилище информации о скачиваниях
+    `dedup`: поиск повторяющихся файлов
+    `name_counters`: количество уже выданных номеров файлов для каждой папки сохранения.
+    Нужно, если ссылки одного типа данных обрабатываются по частям
+    `shard`: номер части и количество частей при скачивании на нескольких машинах
 
-    Возвращает структурированные данные и количество обработанных ссылок
+    Возвращает количество обработанных ссылок
     '''
-    result = {}
-    full_count = 0
-    count_by_doc = 0
+    futures = []
+    name_counters = {} if name_counters is None else name_counters
     info_type = 'documents'
     path_for_doc = tools.clear_charters_by_pattern(join(output_folder, folder, info_type))
 
-    headers = {
-        'Accept-Language': 'ru',
-        'User-Agent': get_random_user_agent()
+    for date, links in info.items():
+        if save_by_date:
+            path_for_create = tools.clear_charters_by_pattern(join(path_for_doc, date))
+        else:
+            path_for_create = path_for_doc
+        futures.extend(submit_links(
+            scheduler,
+            pool,
+            result_writer(writer, data_type, None, date),
+            links,
+            path_for_create,
+            name_counters,
+            shard=shard,
+            session=session,
+            cookies=cookies,
+            manifest=manifest,
+            dedup=dedup
+        ))
+    await asyncio.gather(*futures)
+    count_by_doc = sum(1 for future in futures if future.result())
+    logger.info(f'Количество валидных данных, полученных из 🔗: {count_by_doc}')
+    return len(futures)
+
+
+async def iter_link_batches(finder: VKLinkFinder) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+    '''
+    Возвращает части найденных ссылок из `VKLinkFinder.iter_link_batches` по мере обработки архива.
+    Архив обрабатывается в отдельном потоке, чтобы скачивание не останавливалось
+    `finder`: парсер архива, созданный с `pipelined=True`
+    '''
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+
+    def produce() -> None:
+        try:
+            for batch in finder.iter_link_batches():
+                loop.call_soon_threadsafe(queue.put_nowait, batch)
+        finally:
+            loop.call_soon_threadsafe(queue.put_nowait, None)
+
+    producer = loop.run_in_executor(None, produce)
+    while (batch := await queue.get()) is not None:
+        yield batch
+    await producer
+
+
+async def pipeline_handler(
+    finder: VKLinkFinder,
+    folder_info: Dict[str, Dict[str, Any]],
+    writer: LinksWriter,
+    **handler_options
+) -> int:
+    '''
+    Запускает обработчики типов данных для каждой части найденных ссылок сразу после ее получения,
+    поэтому обработка архива и скачивание выполняются одновременно
+    `finder`: парсер архива, созданный с `pipelined=True`
+    `folder_info`: папка, обработчик и класс скачиваний для каждого типа данных
+    `writer`: запись результатов обработки ссылок
+    `handler_options`: остальные аргументы обработчиков
+
+    Возвращает количество обработанных ссылок
+    '''
+    handlers = []
+    name_counters = {}
+    async for data_type, info in iter_link_batches(finder):
+        if data_type not in name_counters:
+            logger.info(f'⚙️ Начат процесс обработки {data_type} ⚙️')
+            writer.write_section(data_type)
+            tools.create_folder(join(output_folder, data_type))
+            name_counters[data_type] = {}
+        handlers.append(asyncio.create_task(folder_info[data_type]['handler'](
+            info=info,
+            folder=folder_info[data_type]['folder'],
+            data_type=data_type,
+            writer=writer,
+            pool=folder_info[data_type]['pool'],
+            name_counters=name_counters[data_type],
+            **handler_options
+        )))
+    for data_type in finder.link_info:
+        if data_type not in name_counters:
+            writer.write_section(data_type)
+    return sum(await asyncio.gather(*handlers))
+
+
+def write_dirty_links(link_info: Dict[str, Any], folder: str, delete_output_folder: bool) -> None:
+    '''
+    Сохраняет все найденные в архиве ссылки в `dirty_links.json`, если включен уровень логирования `DEBUG`
+    `link_info`: информация о ссылках из `VKLinkFinder`
+    `folder`: папка для сохранения
+    `delete_output_folder`: была ли отчищена папка результата. Если нет, прошлый файл сохраняется как резервная копия
+    '''
+    if 'DEBUG' not in log_level:
+        return
+    dirty_links_path = join(folder, 'dirty_links.json')
+    if not delete_output_folder:
+        tools.backup_file(dirty_links_path)
+    with open(dirty_links_path, 'w', encoding='utf8') as f:
+        dump(link_info, f, indent=4, ensure_ascii=False)
+
+
+def get_connector_options() -> Dict[str, Any]:
+    '''
+    Возвращает параметры пула соединений из секции `connection_parameters` конфигурационного файла
+    '''
+    section = config['connection_parameters'] if config.has_section('connection_parameters') else {}
+    ttl_dns_cache = int(section.get('dns_cache_ttl', 300))
+    return {
+        'limit': int(section.get('connection_limit', 100)),
+        'limit_per_host': int(section.get('connection_limit_per_host', 0)),
+        'ttl_dns_cache': ttl_dns_cache if ttl_dns_cache >= 0 else None,
+        'keepalive_timeout': float(section.get('keepalive_timeout', 30))
     }
 
-    conn = get_ssl_context_tcp_connector(disable_ssl)
 
-    async with aiohttp.ClientSession(headers=headers, connector=conn) as session:
-        for date, links in info.items():
-            if save_by_date:
-                storage = result.setdefault(date, {})
-                path_for_create = tools.clear_charters_by_pattern(join(path_for_doc, date))
-            else:
-                storage = result
-                path_for_create = path_for_doc
-            tasks = [asyncio.ensure_future(
-                data_downloader.get_info(
-                    url=v,
-                    save_path=path_for_create,
-                    file_name=links.index(v),
-                    session=session,
-                    semaphore=sema,
-                    cookies=cookies
-                )
-            ) for v in links]
-            full_count += len(tasks)
-            tasks_result = list(filter(lambda link: link, await asyncio.gather(*tasks)))
-            count_by_doc += len(tasks_result)
-            for res in tasks_result:
-                file_info = storage.setdefault(res['file_info'], [])
-                file_info.append(res['url'])
-    logger.info(f'Количество валидных данных, полученных из 🔗: {count_by_doc}')
-    return result, full_count
+def get_retry_policy() -> RetryPolicy | None:
+    '''
+    Возвращает политику повторов из секции `retry_parameters` конфигурационного файла
+    или `None`, если повторы отключены
+    '''
+    if not config.getboolean('retry_parameters', 'retry_downloads', fallback=True):
+        return None
+    section = config['retry_parameters'] if config.has_section('retry_parameters') else {}
+    return RetryPolicy.from_config(section)
 
 
 def folder_check(
     folder_name: str,
     human_folder_name: str,
-    archive_path: str
+    archive_path: str,
+    archive_source: DirectorySource | ZipSource = directory_source
 ) -> str | None:
     '''
     Проверка папки с данными из архива на указание парсинга и существование, отправляя логи о результате
     `folder_name`: имя папки для проверки
     `human_folder_name`: описательное имя папки в винительном падеже (кого? что?)
-    `archive_path`: путь до папки архива
+    `archive_path`: путь до папки архива или до `.zip` архива
+    `archive_source`: источник файлов архива: распакованная папка или `.zip` архив
     '''
     folder = config['folder_parameters'].get(folder_name)
     if folder is None:
         logger.info(f'Парсинг {human_folder_name} будет пропущен')
-    elif isdir(join(archive_path, folder)):
+    elif archive_source.is_dir(join(archive_path, folder)):
         logger.info(f'Парсинг {human_folder_name} будет выполнен из 📁: {folder}')
     else:
         logger.warning(f'📁 для парсинга {human_folder_name} указана, но не найдена: {folder}')
@@ -296,7 +481,11 @@ def folder_check(
     return folder
 
 
-async def main():
+async def main(shard: Tuple[int, int] | None = None):
+    '''
+    `shard`: номер части и количество частей при скачивании на нескольких машинах.
+    Скачиваются только ссылки этой части, служебные файлы сохраняются в `shards.get_shard_folder`
+    '''
     if config_read:
         logger.debug('Конфигурационный файл успешно загружен')
     else:
@@ -323,58 +512,87 @@ async def main():
     else:
         logger.info('Используемое количество потоков будет определено автоматически 🚀')
 
+    html_parser = config['main_parameters'].get('html_parser', 'bs4')
+
     semaphore_small = int(config['main_parameters'].get('semaphore_small', 75))
     logger.info(f'Количество одновременных скачиваний файлов малого размера: {semaphore_small} 🚦')
-    sema_small = asyncio.BoundedSemaphore(semaphore_small)
 
     semaphore_big = int(config['main_parameters'].get('semaphore_big', 10))
     logger.info(f'Количество одновременных скачиваний файлов большого размера: {semaphore_big} 🚦')
-    sema_big = asyncio.BoundedSemaphore(semaphore_big)
+
+    adaptive_concurrency = config['main_parameters'].getboolean('adaptive_concurrency', False)
+    if adaptive_concurrency:
+        semaphore_small_max = int(config['main_parameters'].get('semaphore_small_max', semaphore_small))
+        semaphore_big_max = int(config['main_parameters'].get('semaphore_big_max', semaphore_big))
+        logger.info(
+            'Количество одновременных скачиваний будет подстраиваться автоматически, максимум: '
+            f'{semaphore_small_max} для малых и {semaphore_big_max} для больших файлов 🚦'
+        )
+    else:
+        semaphore_small_max = semaphore_small
+        semaphore_big_max = semaphore_big
+    concurrency_stats_interval = float(config['main_parameters'].get('concurrency_stats_interval', 30))
+    metrics_port = int(config['main_parameters'].get('metrics_port', 0))
+    metrics_snapshot_interval = float(config['main_parameters'].get('metrics_snapshot_interval', 60))
+    loop_lag_threshold = float(config['main_parameters'].get('loop_lag_threshold', 0.1))
+
+    retry_policy = get_retry_policy()
+    if retry_policy is not None:
+        logger.info('Неудачные скачивания будут повторены 🔁')
+    else:
+        logger.info('Неудачные скачивания НЕ будут повторены')
 
     archive_path = config['folder_parameters'].get('vk_archive_folder', 'Archive')
     logger.info(f'📁 архива VK: {archive_path}')
+    archive_source = get_archive_source(archive_path)
+    if isinstance(archive_source, ZipSource):
+        logger.info('Файлы архива будут прочитаны из .zip архива без распаковки 🗜️')
 
     messages_folder = folder_check(
         folder_name='messages_folder',
         human_folder_name='сообщений',
-        archive_path=archive_path
+        archive_path=archive_path,
+        archive_source=archive_source
     )
     likes_folder = folder_check(
         folder_name='likes_folder',
         human_folder_name='лайкнутых фото',
-        archive_path=archive_path
+        archive_path=archive_path,
+        archive_source=archive_source
     )
     photos_folder = folder_check(
         folder_name='photos_folder',
         human_folder_name='фото профиля',
-        archive_path=archive_path
+        archive_path=archive_path,
+        archive_source=archive_source
     )
     profile_folder = folder_check(
         folder_name='profile_folder',
         human_folder_name='документов профиля',
-        archive_path=archive_path
+        archive_path=archive_path,
+        archive_source=archive_source
     )
 
     folder_info = {
         'messages': {
             'folder': messages_folder,
             'handler': messages_handler,
-            'semaphore': sema_small
+            'pool': 'small'
         },
         'likes/photo': {
             'folder': likes_folder,
             'handler': likes_photo_handler,
-            'semaphore': sema_big
+            'pool': 'big'
         },
         'photos': {
             'folder': photos_folder,
             'handler': profile_photos_handler,
-            'semaphore': sema_small
+            'pool': 'small'
         },
         'profile': {
             'folder': profile_folder,
             'handler': profile_handler,
-            'semaphore': sema_big
+            'pool': 'big'
         }
     }
     folder_keys = {}
@@ -382,73 +600,234 @@ async def main():
         if folder_info[key]['folder'] is not None:
             folder_keys.update({key: value['folder']})
 
+    # Служебные файлы: информация о скачиваниях, результаты обработки ссылок, метрики
+    state_folder = output_folder
+    if shard is not None:
+        state_folder = get_shard_folder(output_folder, shard)
+        tools.create_folder(state_folder)
+        logger.info(f'Будет скачана часть {shard[0]} из {shard[1]}, служебные файлы части сохраняются в {state_folder}')
+
     delete_output_folder = config['main_parameters'].getboolean('delete_output_folder', False)
-    if delete_output_folder:
+    if delete_output_folder and shard is not None:
+        # Папка результата может быть общей для всех частей, поэтому отчищаются только служебные файлы части
+        logger.info(f'📁 {state_folder} будет отчищена перед началом работы 🗑️')
+        tools.clear_jsons(state_folder)
+    elif delete_output_folder:
         logger.info(f'📁 {output_folder} будет отчищена перед началом работы 🗑️')
         tools.clear_folder(output_folder)
         tools.clear_jsons(output_folder)
     else:
         logger.info(f'📁 {output_folder} останется нетронутой')
 
+    manifest = None
+    if config['main_parameters'].getboolean('resume_downloads', True):
+        manifest = DownloadManifest(join(state_folder, 'manifest.sqlite'))
+        if delete_output_folder:
+            manifest.clear()
+        logger.info(f'Информация о скачиваниях будет сохраняться в {manifest.path}, уже скачанные файлы будут пропущены')
+        manifest_stats = manifest.get_stats()
+        if manifest_stats:
+            logger.info(f'Информация о прошлых скачиваниях: {manifest_stats}')
+    else:
+        logger.info('Информация о скачиваниях не будет сохраняться, все файлы будут скачаны заново')
+
+    dedup = None
+    dedup_mode = config['main_parameters'].get('dedup_mode', 'hardlink')
+    if dedup_mode in dedup_modes:
+        dedup = FileDeduplicator(dedup_mode, manifest)
+        logger.info(f'Повторяющиеся файлы не будут скачиваться и храниться повторно, способ сохранения повторов: {dedup_mode}')
+    else:
+        logger.info('Поиск повторяющихся файлов отключен')
+
     save_by_date = config['main_parameters'].getboolean('save_by_date', False)
     if save_by_date:
         logger.info('Файлы будут сохранены в подпапки, на основе информации о дате')
     else:
         logger.info('Сохранение файлов в подпапки на основе информации о дате не будет использоваться')
 
+    metrics_server = None
+    if metrics_port > 0:
+        metrics_server = await metrics.start_metrics_server(metrics_port)
+    metrics_path = join(state_folder, 'metrics.json')
+    metrics_writer = None
+    if metrics_snapshot_interval > 0:
+        tools.create_folder(state_folder)
+        metrics_writer = asyncio.create_task(metrics.snapshot_writer(metrics_path, metrics_snapshot_interval))
+        logger.info(f'Метрики работы будут сохраняться в {metrics_path} каждые {metrics_snapshot_interval:g} с 📈')
+    loop_lag_monitor = None
+    loop_lag_task = None
+    if loop_lag_threshold > 0:
+        loop_lag_monitor = metrics.LoopLagMonitor(threshold=loop_lag_threshold)
+        loop_lag_task = asyncio.create_task(loop_lag_monitor.run())
+        logger.info(f'Задержки цикла событий от {loop_lag_threshold * 1000:g} мс будут записываться в лог ⏱️')
+    if data_downloader.offload_blocking:
+        logger.info('Блокирующие операции скачивания будут выполняться в отдельных потоках')
+    else:
+        logger.info('Блокирующие операции скачивания будут выполняться в основном потоке')
+
     logger.info('🔥 Начат процесс получения данных из архива VK... 🔥')
     first_start = datetime.now()
-    obj = VKLinkFinder(archive_path, folder_names=folder_keys, core_count=core_count)
-    logger.info(f'⌛ создания файла JSON с информацией о ссылках: {datetime.now() - first_start}')
-    for folder in obj.link_info.keys():
-        tools.create_folder(join(output_folder, folder))
-
-    if 'DEBUG' in log_level:
-        dirty_links_path = join(output_folder, 'dirty_links.json')
-        if not delete_output_folder:
-            tools.backup_file(dirty_links_path)
-        with open(dirty_links_path, 'w', encoding='utf8') as f:
-            f.write(dumps(obj.link_info, indent=4, ensure_ascii=False))
+    parse_cache = None
+    if config['main_parameters'].getboolean('parse_cache', True):
+        tools.create_folder(state_folder)
+        parse_cache = ParseCache(join(state_folder, 'parse_cache.sqlite'))
+        logger.info(f'Результаты обработки файлов архива будут сохраняться в {parse_cache.path}')
+    pipeline_mode = config['main_parameters'].getboolean('pipeline_mode', False)
+    obj = VKLinkFinder(
+        archive_path,
+        folder_names=folder_keys,
+        core_count=core_count,
+        html_parser=html_parser,
+        parse_cache=parse_cache,
+        pipelined=pipeline_mode,
+        archive_source=archive_source
+    )
+    if pipeline_mode:
+        logger.info('Скачивание начнется сразу, одновременно с обработкой архива 🔀')
+    else:
+        if parse_cache is not None:
+            logger.info(f'Использование сохраненных результатов обработки файлов архива: {parse_cache.get_stats()}')
+            parse_cache.close()
+        archive_source.close()
+        logger.info(f'⌛ создания файла JSON с информацией о ссылках: {datetime.now() - first_start}')
+        for folder in obj.link_info.keys():
+            tools.create_folder(join(output_folder, folder))
+        write_dirty_links(obj.link_info, state_folder, delete_output_folder)
 
     disable_ssl = config['main_parameters'].getboolean('disable_ssl', False)
     if disable_ssl:
         logger.warning('!!! ВНИМАНИЕ: проверка SSL сертификатов отключена !!!')
 
-    result = {}
+    connector_options = get_connector_options()
+    logger.info(f'Параметры пула соединений: {connector_options}')
+    logger.info(f'Ограничение частоты запросов (запросов в секунду, подряд): {data_downloader.rate_limiter.limits}')
+
+    scheduler = DownloadScheduler(
+        data_downloader.get_info,
+        {
+            'small': AdaptiveLimiter(
+                'small',
+                semaphore_small,
+                min_limit=1 if adaptive_concurrency else semaphore_small,
+                max_limit=semaphore_small_max
+            ),
+            'big': AdaptiveLimiter(
+                'big',
+                semaphore_big,
+                min_limit=1 if adaptive_concurrency else semaphore_big,
+                max_limit=semaphore_big_max
+            )
+        },
+        stats_interval=concurrency_stats_interval,
+        retry_policy=retry_policy
+    )
+    scheduler.start()
+    metrics.registry.add_collector(metrics.update_pool_metrics(scheduler.get_stats))
+
+    links_info_ndjson_path = join(state_folder, 'links_info.ndjson')
+    if not delete_output_folder:
+        tools.backup_file(links_info_ndjson_path)
+    writer = LinksWriter(links_info_ndjson_path, save_by_date)
+    logger.info(f'Результаты обработки 🔗 будут записываться в {links_info_ndjson_path} по мере получения')
+
     full_count = 0
     start = datetime.now()
-    for data_type, info in obj.link_info.items():
-        logger.info(f'⚙️ Начат процесс обработки {data_type} ⚙️')
-        coroutine_handler = folder_info[data_type]['handler']
-        res_handler, count = await asyncio.create_task(
-            coroutine_handler(
-                info=info,
-                folder=folder_info[data_type]['folder'],
-                sema=folder_info[data_type]['semaphore'],
-                cookies=cookies,
-                disable_ssl=disable_ssl,
-                save_by_date=save_by_date
-            )
-        )
-        result[data_type] = res_handler
-        full_count += count
+    async with data_downloader.create_session(disable_ssl, **connector_options) as session:
+        handler_options = {
+            'shard': shard,
+            'scheduler': scheduler,
+            'cookies': cookies,
+            'session': session,
+            'save_by_date': save_by_date,
+            'manifest': manifest,
+            'dedup': dedup
+        }
+        try:
+            if pipeline_mode:
+                full_count = await pipeline_handler(obj, folder_info, writer, **handler_options)
+            else:
+                handlers = []
+                for data_type, info in obj.link_info.items():
+                    logger.info(f'⚙️ Начат процесс обработки {data_type} ⚙️')
+                    writer.write_section(data_type)
+                    coroutine_handler = folder_info[data_type]['handler']
+                    handlers.append(coroutine_handler(
+                        info=info,
+                        folder=folder_info[data_type]['folder'],
+                        data_type=data_type,
+                        writer=writer,
+                        pool=folder_info[data_type]['pool'],
+                        **handler_options
+                    ))
+                full_count = sum(await asyncio.gather(*handlers))
+            await scheduler.stop()
+        finally:
+            writer.close()
     full_end = datetime.now()
+    if pipeline_mode:
+        if parse_cache is not None:
+            logger.info(f'Использование сохраненных результатов обработки файлов архива: {parse_cache.get_stats()}')
+            parse_cache.close()
+        archive_source.close()
+        write_dirty_links(obj.link_info, state_folder, delete_output_folder)
 
     logger.info(f'Количество обработанных 🔗: {full_count}')
+    for pool, stats in scheduler.get_stats().items():
+        logger.info(
+            f'Класс скачиваний {pool}: итоговое количество одновременных скачиваний {stats["limit"]}, '
+            f'{stats["throughput"]:.2f} ссылок/с, ошибок перегрузки {stats["error_rate"]:.1%}, '
+            f'повторов {stats["retries"]}, отложено задач {stats["deferred"]}'
+        )
+    if dedup is not None:
+        logger.info(f'Повторяющиеся файлы: {dedup.get_stats_message()}')
+    if manifest is not None:
+        logger.info(f'Информация о скачиваниях: {manifest.get_stats()}')
+        manifest.close()
     logger.info(f'⌛ обработки 🔗 и скачивания возможных: {full_end - start}')
-    links_info_path = join(output_folder, 'links_info.json')
-    if not delete_output_folder:
-        tools.backup_file(links_info_path)
-    with open(links_info_path, 'w', encoding='utf8') as f:
-        f.write(dumps(result, indent=4, ensure_ascii=False))
+    if shard is not None:
+        logger.info('Когда все части будут скачаны, объедините их результаты: python main.py --merge-shards')
+    elif config['main_parameters'].getboolean('links_info_json', True):
+        links_info_path = join(output_folder, 'links_info.json')
+        if not delete_output_folder:
+            tools.backup_file(links_info_path)
+        write_links_info(links_info_ndjson_path, links_info_path)
+        logger.info(f'{links_info_path} восстановлен из {links_info_ndjson_path}')
+    if loop_lag_task is not None:
+        loop_lag_task.cancel()
+        stats = loop_lag_monitor.get_stats()
+        logger.info(
+            f'Максимальная задержка цикла событий: {stats["max_lag"] * 1000:.0f} мс, '
+            f'задержек от {loop_lag_threshold * 1000:g} мс: {stats["stalls"]}'
+        )
+    if metrics_writer is not None:
+        metrics_writer.cancel()
+        metrics.registry.write_snapshot(metrics_path)
+    if metrics_server is not None:
+        await metrics_server.cleanup()
     logger.info(f'Общее ⌛ обработки архива VK: {full_end - first_start}')
 
 
 if __name__ == '__main__':
     freeze_support()
+    parser = argparse.ArgumentParser(description='Скачивание данных по ссылкам из архива VK')
+    parser.add_argument(
+        '--shard',
+        type=parse_shard,
+        default=None,
+        help='скачать только часть i из N ссылок (например, 2/4), чтобы разделить архив между несколькими машинами'
+    )
+    parser.add_argument(
+        '--merge-shards',
+        action='store_true',
+        help=f'объединить служебные файлы скачанных частей из {output_folder}/shards и завершить работу'
+    )
+    args = parser.parse_args()
     try:
-        if 'nt' in os.name:
-            asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
-        asyncio.run(main())
+        if args.merge_shards:
+            merge_shards(output_folder, config['main_parameters'].getboolean('links_info_json', True))
+        else:
+            if 'nt' in os.name:
+                asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+            asyncio.run(main(args.shard))
     except Exception:
         logger.critical(format_exc())
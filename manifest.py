@@ -0,0 +1,237 @@
+import sqlite3
+from configparser import ConfigParser
+from datetime import datetime
+from os.path import getsize, isfile
+from typing import Any, Dict, List
+
+import tools
+from logger import create_logger
+
+config = ConfigParser()
+config_read = config.read('config.ini', encoding='utf8')
+log_level = 'DEBUG'
+if config_read:
+    log_level = config['main_parameters'].get('log_level', 'DEBUG')
+logger = create_logger('logs/vk_parser.log', 'manifest', log_level)
+
+# Статусы записей, которые не нужно обрабатывать повторно
+complete_statuses = ('done', 'not_parse')
+# Статусы записей, скачивание которых можно продолжить
+resume_statuses = ('partial', 'error', 'timeout_error')
+
+manifest_fields = ('final_url', 'path', 'size', 'content_type', 'sha256', 'status')
+
+
+class DownloadManifest():
+    def __init__(self, path: str) -> None:
+        '''
+        Хранилище информации о скачиваниях на основе SQLite.
+        Позволяет пропускать уже скачанные файлы и продолжать прерванные скачивания при следующем запуске.
+        Во время скачивания к хранилищу обращается только поток `data_downloader.state_executor`,
+        поэтому соединение создается без проверки потока
+        `path`: путь до файла базы данных
+
+        Каждая запись определяется ссылкой и папкой сохранения и содержит:
+        ```
+        {
+            'url': 'Исходная ссылка из архива',
+            'save_path': 'Папка, переданная для сохранения',
+            'final_url': 'Итоговая ссылка на файл (после редиректов и поиска ссылки на странице VK)',
+            'path': 'Путь до сохраненного файла',
+            'size': 'Ожидаемый размер файла в байтах (Content-Length), если известен',
+            'content_type': 'Тип контента, например, image/jpeg',
+            'sha256': 'Хэш содержимого файла, если известен',
+            'status': 'done, not_parse, partial, error или timeout_error',
+            'updated_at': 'Время последнего изменения записи'
+        }
+        ```
+
+        Также хранит ссылки на файлы, найденные на страницах документов VK, чтобы не загружать эти страницы повторно
+        '''
+        self.path = path
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute(
+            '''
+            CREATE TABLE IF NOT EXISTS downloads (
+                url TEXT NOT NULL,
+                save_path TEXT NOT NULL,
+                final_url TEXT,
+                path TEXT,
+                size INTEGER,
+                content_type TEXT,
+                sha256 TEXT,
+                status TEXT,
+                updated_at TEXT,
+                PRIMARY KEY (url, save_path)
+            )
+            '''
+        )
+        self.connection.execute(
+            '''
+            CREATE TABLE IF NOT EXISTS resolved_urls (
+                url TEXT PRIMARY KEY,
+                resolved_url TEXT NOT NULL,
+                updated_at TEXT
+            )
+            '''
+        )
+        columns = [row['name'] for row in self.connection.execute('PRAGMA table_info(downloads)')]
+        if 'sha256' not in columns:
+            self.connection.execute('ALTER TABLE downloads ADD COLUMN sha256 TEXT')
+        self.connection.commit()
+
+    def get(self, url: str, save_path: str) -> Dict[str, Any] | None:
+        '''
+        Возвращает запись о скачивании или `None`, если ее нет
+        `url`: исходная ссылка
+        `save_path`: папка сохранения
+        '''
+        row = self.connection.execute(
+            'SELECT * FROM downloads WHERE url = ? AND save_path = ?',
+            (url, save_path)
+        ).fetchone()
+        return None if row is None else dict(row)
+
+    def update(self, url: str, save_path: str, **fields) -> None:
+        '''
+        Создает или обновляет запись о скачивании. Не переданные поля остаются прежними
+        `url`: исходная ссылка
+        `save_path`: папка сохранения
+        `fields`: поля записи из `manifest_fields`
+        '''
+        fields = {k: v for k, v in fields.items() if k in manifest_fields}
+        fields['updated_at'] = datetime.now().isoformat(timespec='seconds')
+        names = ', '.join(fields)
+        placeholders = ', '.join('?' for _ in fields)
+        updates = ', '.join(f'{name} = excluded.{name}' for name in fields)
+        self.connection.execute(
+            f'''
+            INSERT INTO downloads (url, save_path, {names}) VALUES (?, ?, {placeholders})
+            ON CONFLICT (url, save_path) DO UPDATE SET {updates}
+            ''',
+            (url, save_path, *fields.values())
+        )
+        self.connection.commit()
+
+    def get_resolved_url(self, url: str) -> str | None:
+        '''
+        Возвращает найденную ранее ссылку на файл для страницы VK или `None`
+        `url`: ссылка на страницу VK
+        '''
+        row = self.connection.execute('SELECT resolved_url FROM resolved_urls WHERE url = ?', (url,)).fetchone()
+        return None if row is None else row['resolved_url']
+
+    def set_resolved_url(self, url: str, resolved_url: str | None) -> None:
+        '''
+        Запоминает ссылку на файл для страницы VK. Если `resolved_url` равен `None`, удаляет запись
+        `url`: ссылка на страницу VK
+        `resolved_url`: ссылка на файл
+        '''
+        if resolved_url is None:
+            self.connection.execute('DELETE FROM resolved_urls WHERE url = ?', (url,))
+        else:
+            self.connection.execute(
+                '''
+                INSERT INTO resolved_urls (url, resolved_url, updated_at) VALUES (?, ?, ?)
+                ON CONFLICT (url) DO UPDATE SET resolved_url = excluded.resolved_url, updated_at = excluded.updated_at
+                ''',
+                (url, resolved_url, datetime.now().isoformat(timespec='seconds'))
+            )
+        self.connection.commit()
+
+    @classmethod
+    def get_complete_result(self, record: Dict[str, Any] | None) -> Dict[str, str] | None:
+        '''
+        Возвращает результат обработки ссылки, если по записи скачивание уже завершено, иначе `None`.
+        Завершенным считается скачивание, файл которого все еще существует
+        `record`: запись о скачивании
+        '''
+        if record is None or record['status'] not in complete_statuses:
+            return None
+        if record['status'] == 'not_parse':
+            return {'url': record['final_url'], 'file_info': 'not_parse'}
+        if record['path'] is None or not isfile(record['path']):
+            return None
+        return {'url': record['final_url'], 'file_info': record['content_type'], 'path': record['path']}
+
+    @classmethod
+    def get_resume_offset(self, record: Dict[str, Any] | None) -> int | None:
+        '''
+        Возвращает количество уже скачанных байт, если скачивание по записи можно продолжить, иначе `None`.
+        Уже скачанная часть файла хранится во временном файле `tools.get_part_path`
+        `record`: запись о скачивании
+        '''
+        if record is None or record['status'] not in resume_statuses:
+            return None
+        if not record['final_url'] or not record['path']:
+            return None
+        part_path = tools.get_part_path(record['path'])
+        if not isfile(part_path):
+            return None
+        downloaded = getsize(part_path)
+        if downloaded == 0:
+            return None
+        if record['size'] is not None and downloaded > record['size']:
+            return None
+        return downloaded
+
+    def merge(self, path: str) -> None:
+        '''
+        Добавляет записи о скачиваниях и найденные ссылки на файлы из другого файла базы данных,
+        например, из файла одной из частей при скачивании на нескольких машинах.
+        Если запись уже есть, остается более новая
+        `path`: путь до файла базы данных
+        '''
+        columns = ('url', 'save_path', *manifest_fields, 'updated_at')
+        names = ', '.join(columns)
+        updates = ', '.join(f'{name} = excluded.{name}' for name in columns[2:])
+        self.connection.execute('ATTACH DATABASE ? AS other', (path,))
+        try:
+            # `WHERE true` нужен SQLite, чтобы отличить `ON CONFLICT` от условия соединения в `INSERT ... SELECT`
+            self.connection.execute(
+                f'''
+                INSERT INTO downloads ({names}) SELECT {names} FROM other.downloads WHERE true
+                ON CONFLICT (url, save_path) DO UPDATE SET {updates}
+                WHERE downloads.updated_at IS NULL OR excluded.updated_at > downloads.updated_at
+                '''
+            )
+            self.connection.execute(
+                '''
+                INSERT INTO resolved_urls (url, resolved_url, updated_at)
+                SELECT url, resolved_url, updated_at FROM other.resolved_urls WHERE true
+                ON CONFLICT (url) DO UPDATE SET resolved_url = excluded.resolved_url, updated_at = excluded.updated_at
+                WHERE resolved_urls.updated_at IS NULL OR excluded.updated_at > resolved_urls.updated_at
+                '''
+            )
+            self.connection.commit()
+        finally:
+            self.connection.execute('DETACH DATABASE other')
+
+    def get_done_files(self) -> List[Dict[str, Any]]:
+        '''
+        Возвращает записи обо всех скачанных файлах
+        '''
+        rows = self.connection.execute(
+            "SELECT * FROM downloads WHERE status = 'done' AND path IS NOT NULL"
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def get_stats(self) -> Dict[str, int]:
+        '''
+        Возвращает количество записей по каждому статусу
+        '''
+        rows = self.connection.execute('SELECT status, COUNT(*) FROM downloads GROUP BY status').fetchall()
+        return {status: count for status, count in rows}
+
+    def clear(self) -> None:
+        '''
+        Удаляет все записи о скачиваниях
+        '''
+        self.connection.execute('DELETE FROM downloads')
+        self.connection.commit()
+
+    def close(self) -> None:
+        self.connection.close()
@@ -0,0 +1,386 @@
+import asyncio
+import threading
+from bisect import bisect_left
+from configparser import ConfigParser
+from datetime import datetime
+from json import dump
+from os import replace
+from time import monotonic
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, List, Tuple
+
+import aiohttp
+from aiohttp import web
+
+from logger import create_logger
+
+config = ConfigParser()
+config_read = config.read('config.ini', encoding='utf8')
+log_level = 'DEBUG'
+if config_read:
+    log_level = config['main_parameters'].get('log_level', 'DEBUG')
+logger = create_logger('logs/vk_parser.log', 'metrics', log_level)
+
+# Границы интервалов гистограмм времени сетевых запросов и ожидания в секундах
+latency_buckets = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+# Границы интервалов гистограммы времени обработки одного файла архива в секундах
+parse_buckets = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# Границы интервалов гистограммы задержки цикла событий в секундах
+loop_lag_buckets = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+
+def format_labels(label_names: Tuple[str, ...], label_values: Tuple[str, ...], extra: str = '') -> str:
+    '''
+    Возвращает метки в формате Prometheus, например, `{pool="small",le="0.5"}`
+    '''
+    pairs = [
+        '{}="{}"'.format(name, value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in zip(label_names, label_values)
+    ]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric():
+    kind = 'untyped'
+
+    def __init__(self, name: str, description: str, label_names: Tuple[str, ...] = ()) -> None:
+        '''
+        Метрика с набором значений для разных значений меток
+        `name`: имя метрики
+        `description`: описание метрики
+        `label_names`: имена меток
+        '''
+        self.name = name
+        self.description = description
+        self.label_names = label_names
+        self.values: Dict[Tuple[str, ...], Any] = {}
+        # Метрики обработки архива обновляются из потока обработки архива
+        self.lock = threading.Lock()
+
+    def get_key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, '')) for name in self.label_names)
+
+    def get_samples(self) -> List[Tuple[Tuple[str, ...], Any]]:
+        with self.lock:
+            return list(self.values.items())
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} {self.kind}']
+        for key, value in self.get_samples():
+            lines.append(f'{self.name}{format_labels(self.label_names, key)} {format_value(value)}')
+        return lines
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        return [{'labels': dict(zip(self.label_names, key)), 'value': value} for key, value in self.get_samples()]
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self.get_key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value: float, **labels) -> None:
+        key = self.get_key(labels)
+        with self.lock:
+            self.values[key] = value
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self.get_key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, description: str, label_names: Tuple[str, ...] = (), buckets: Tuple[float, ...] = latency_buckets) -> None:
+        '''
+        Гистограмма: количество наблюдений по интервалам значений, их сумма и общее количество
+        `name`: имя метрики
+        `description`: описание метрики
+        `label_names`: имена меток
+        `buckets`: верхние границы интервалов по возрастанию
+        '''
+        super().__init__(name, description, label_names)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels) -> None:
+        key = self.get_key(labels)
+        with self.lock:
+            state = self.values.get(key)
+            if state is None:
+                state = self.values[key] = {'counts': [0] * (len(self.buckets) + 1), 'sum': 0.0, 'count': 0}
+            state['counts'][bisect_left(self.buckets, value)] += 1
+            state['sum'] += value
+            state['count'] += 1
+
+    def get_samples(self) -> List[Tuple[Tuple[str, ...], Any]]:
+        with self.lock:
+            return [(key, {**state, 'counts': list(state['counts'])}) for key, state in self.values.items()]
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} {self.kind}']
+        for key, state in self.get_samples():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), state['counts']):
+                cumulative += count
+                le = format_labels(self.label_names, key, f'le="{format_value(float(bound))}"')
+                lines.append(f'{self.name}_bucket{le} {cumulative}')
+            labels = format_labels(self.label_names, key)
+            lines.append(f'{self.name}_sum{labels} {format_value(state["sum"])}')
+            lines.append(f'{self.name}_count{labels} {state["count"]}')
+        return lines
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        return [
+            {
+                'labels': dict(zip(self.label_names, key)),
+                'count': state['count'],
+                'sum': state['sum'],
+                'buckets': dict(zip([format_value(float(b)) for b in self.buckets + (float('inf'),)], state['counts']))
+            }
+            for key, state in self.get_samples()
+        ]
+
+
+class MetricsRegistry():
+    def __init__(self) -> None:
+        '''
+        Набор метрик работы утилиты. Значения, которые не обновляются по ходу работы (например, состояние планировщика),
+        обновляются функциями-сборщиками перед каждым чтением
+        '''
+        self.metrics: Dict[str, Metric] = {}
+        self.collectors: List[Callable[[], None]] = []
+        self.started_at = datetime.now()
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics[metric.name] = metric
+        return metric
+
+    def add_collector(self, collector: Callable[[], None]) -> None:
+        '''
+        Добавляет функцию, вызываемую перед каждым чтением метрик
+        `collector`: функция без аргументов
+        '''
+        self.collectors.append(collector)
+
+    def collect(self) -> None:
+        for collector in self.collectors:
+            try:
+                collector()
+            except Exception as e:
+                logger.warning(f'Ошибка сбора метрик: {e}')
+
+    def render_prometheus(self) -> str:
+        '''
+        Возвращает все метрики в текстовом формате Prometheus
+        '''
+        self.collect()
+        lines = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    def snapshot(self) -> Dict[str, Any]:
+        '''
+        Возвращает все метрики в виде словаря для сохранения в JSON
+        '''
+        self.collect()
+        return {
+            'started_at': self.started_at.isoformat(timespec='seconds'),
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'metrics': {
+                name: {'type': metric.kind, 'description': metric.description, 'values': metric.snapshot()}
+                for name, metric in self.metrics.items()
+            }
+        }
+
+    def write_snapshot(self, path: str) -> None:
+        '''
+        Сохраняет метрики в файл JSON. Файл заменяется целиком, поэтому при чтении он никогда не бывает записан частично
+        `path`: путь до файла
+        '''
+        temp_path = f'{path}.tmp'
+        with open(temp_path, 'w', encoding='utf8') as f:
+            dump(self.snapshot(), f, indent=4, ensure_ascii=False)
+        replace(temp_path, path)
+
+
+registry = MetricsRegistry()
+
+downloaded_bytes = registry.register(Counter(
+    'vk_downloaded_bytes_total', 'Количество скачанных байт'
+))
+links_total = registry.register(Counter(
+    'vk_links_total', 'Количество обработанных ссылок по типу данных и результату (file_info)', ('type', 'file_info')
+))
+http_request_duration = registry.register(Histogram(
+    'vk_http_request_duration_seconds', 'Время от отправки запроса до получения заголовков ответа', ('status',)
+))
+http_requests_in_flight = registry.register(Gauge(
+    'vk_http_requests_in_flight', 'Количество запросов, ожидающих заголовков ответа'
+))
+pool_wait_duration = registry.register(Histogram(
+    'vk_pool_wait_seconds', 'Время ожидания свободного места в классе скачиваний', ('pool',)
+))
+link_duration = registry.register(Histogram(
+    'vk_link_duration_seconds', 'Время обработки одной ссылки', ('pool',)
+))
+downloads_in_flight = registry.register(Gauge(
+    'vk_downloads_in_flight', 'Количество ссылок, обрабатываемых в данный момент', ('pool',)
+))
+rate_limit_wait_duration = registry.register(Histogram(
+    'vk_rate_limit_wait_seconds', 'Время ожидания допустимой частоты запросов к хосту', ('host_class',)
+))
+pool_limit = registry.register(Gauge(
+    'vk_pool_limit', 'Текущее допустимое количество одновременных скачиваний', ('pool',)
+))
+pool_queued = registry.register(Gauge(
+    'vk_pool_queued', 'Количество ссылок в очереди класса скачиваний', ('pool',)
+))
+pool_retries = registry.register(Gauge(
+    'vk_pool_retries', 'Количество запланированных повторов', ('pool',)
+))
+pool_deferred = registry.register(Gauge(
+    'vk_pool_deferred', 'Количество задач, отложенных без занятия места, например, из-за ограничения частоты запросов', ('pool',)
+))
+parsed_files = registry.register(Counter(
+    'vk_parsed_files_total', 'Количество обработанных файлов архива (source: parsed - обработан, cache - взят из parse_cache)', ('handler', 'source')
+))
+parse_duration = registry.register(Histogram(
+    'vk_parse_file_duration_seconds', 'Время обработки одного файла архива', ('handler',), parse_buckets
+))
+loop_lag_duration = registry.register(Histogram(
+    'vk_event_loop_lag_seconds', 'Задержка цикла событий: на сколько позже срабатывает таймер', (), loop_lag_buckets
+))
+
+
+def update_pool_metrics(get_stats: Callable[[], Dict[str, Dict[str, Any]]]) -> Callable[[], None]:
+    '''
+    Возвращает функцию-сборщик состояния классов скачиваний
+    `get_stats`: функция, возвращающая состояние классов скачиваний, например, `DownloadScheduler.get_stats`
+    '''
+    def collect() -> None:
+        for pool, stats in get_stats().items():
+            pool_limit.set(stats['limit'], pool=pool)
+            pool_queued.set(stats['queued'], pool=pool)
+            pool_retries.set(stats['retries'], pool=pool)
+            pool_deferred.set(stats['deferred'], pool=pool)
+    return collect
+
+
+def create_trace_config() -> aiohttp.TraceConfig:
+    '''
+    Возвращает `aiohttp.TraceConfig`, который учитывает время и количество выполняемых запросов сессии
+    '''
+    async def on_request_start(session, context: SimpleNamespace, params) -> None:
+        context.start = monotonic()
+        http_requests_in_flight.inc()
+
+    async def on_request_end(session, context: SimpleNamespace, params) -> None:
+        http_requests_in_flight.dec()
+        http_request_duration.observe(monotonic() - context.start, status=params.response.status)
+
+    async def on_request_exception(session, context: SimpleNamespace, params) -> None:
+        http_requests_in_flight.dec()
+        http_request_duration.observe(monotonic() - context.start, status='exception')
+
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_request_start.append(on_request_start)
+    trace_config.on_request_end.append(on_request_end)
+    trace_config.on_request_exception.append(on_request_exception)
+    return trace_config
+
+
+async def start_metrics_server(port: int, host: str = '127.0.0.1') -> web.AppRunner:
+    '''
+    Запускает HTTP сервер с метриками: `/metrics` в текстовом формате Prometheus и `/metrics.json` в JSON.
+    Возвращает `AppRunner`, через который сервер останавливается (`cleanup`)
+    `port`: порт сервера
+    `host`: адрес сервера. По умолчанию сервер доступен только с этого компьютера
+    '''
+    async def prometheus(request: web.Request) -> web.Response:
+        return web.Response(
+            body=registry.render_prometheus().encode('utf8'),
+            headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+        )
+
+    async def json_snapshot(request: web.Request) -> web.Response:
+        return web.json_response(registry.snapshot())
+
+    app = web.Application()
+    app.router.add_get('/metrics', prometheus)
+    app.router.add_get('/metrics.json', json_snapshot)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f'Метрики доступны по адресу http://{host}:{port}/metrics 📈')
+    return runner
+
+
+async def snapshot_writer(path: str, interval: float) -> None:
+    '''
+    Периодически сохраняет метрики в файл JSON
+    `path`: путь до файла
+    `interval`: период сохранения в секундах
+    '''
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            # Сбор метрик и запись файла выполняются в потоке, чтобы не останавливать цикл событий
+            await asyncio.to_thread(registry.write_snapshot, path)
+        except OSError as e:
+            logger.warning(f'Не удалось сохранить метрики в {path}: {e}')
+
+
+class LoopLagMonitor():
+    def __init__(self, interval: float = 0.1, threshold: float = 0.1) -> None:
+        '''
+        Измеряет задержку цикла событий: каждые `interval` секунд засыпает и проверяет, на сколько позже проснулся.
+        Задержка означает, что цикл событий был занят синхронной работой и не обслуживал скачивания.
+        Все задержки учитываются в `loop_lag_duration`, задержки не меньше `threshold` записываются в лог
+        `interval`: период измерения в секундах
+        `threshold`: задержка в секундах, начиная с которой она записывается в лог
+        '''
+        self.interval = interval
+        self.threshold = threshold
+        self.max_lag = 0.0
+        self.stalls = 0
+
+    async def run(self) -> None:
+        '''
+        Измеряет задержку, пока задача не будет отменена
+        '''
+        while True:
+            start = monotonic()
+            await asyncio.sleep(self.interval)
+            lag = max(monotonic() - start - self.interval, 0.0)
+            loop_lag_duration.observe(lag)
+            self.max_lag = max(self.max_lag, lag)
+            if lag >= self.threshold:
+                self.stalls += 1
+                logger.warning(f'Цикл событий был занят {lag * 1000:.0f} мс, скачивания в это время не обслуживались')
+
+    def get_stats(self) -> Dict[str, float]:
+        '''
+        Возвращает максимальную задержку в секундах и количество задержек не меньше `threshold`
+        '''
+        return {'max_lag': self.max_lag, 'stalls': self.stalls}
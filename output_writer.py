@@ -0,0 +1,159 @@
+import argparse
+from configparser import ConfigParser
+from datetime import datetime
+from json import dump, dumps, loads
+from typing import Any, Dict, Iterator
+
+from logger import create_logger
+
+config = ConfigParser()
+config_read = config.read('config.ini', encoding='utf8')
+log_level = 'DEBUG'
+if config_read:
+    log_level = config['main_parameters'].get('log_level', 'DEBUG')
+logger = create_logger('logs/vk_parser.log', 'output_writer', log_level)
+
+
+class LinksWriter():
+    def __init__(self, path: str, save_by_date: bool = False, flush_every: int = 1000) -> None:
+        '''
+        Запись результатов обработки ссылок в файл NDJSON (одна JSON запись на строку) по мере их получения.
+        Результаты не накапливаются в памяти, а при аварийном завершении теряются только последние незаписанные строки
+
+        Виды записей (`kind`):
+        ```
+        {'kind': 'header', 'save_by_date': 'Разделялись ли файлы по датам', 'created_at': 'Время начала записи'}
+        {'kind': 'section', 'type': 'Тип данных: messages, likes/photo, photos или profile'}
+        {'kind': 'group', 'type': 'Тип данных', 'group': 'ID диалога или название альбома', 'info': {'Данные группы'}}
+        {
+            'kind': 'link',
+            'type': 'Тип данных',
+            'group': 'ID диалога, название альбома или null',
+            'date': 'Дата или null',
+            'file_info': 'Информация о типе файла',
+            'url': 'Ссылка',
+            'path': 'Путь до сохраненного файла или null'
+        }
+        ```
+
+        `path`: путь до файла NDJSON
+        `save_by_date`: разделяются ли файлы по подпапкам на основе даты. Нужно для восстановления `links_info.json`
+        `flush_every`: через сколько записей сбрасывать буфер на диск
+        '''
+        self.path = path
+        self.flush_every = flush_every
+        self.not_flushed = 0
+        self.count = 0
+        self.file = open(path, 'w', encoding='utf8')
+        self.write({'kind': 'header', 'save_by_date': save_by_date, 'created_at': datetime.now().isoformat(timespec='seconds')})
+
+    def write(self, record: Dict[str, Any]) -> None:
+        '''
+        Записывает одну запись
+        `record`: запись
+        '''
+        self.file.write(dumps(record, ensure_ascii=False))
+        self.file.write('\n')
+        self.not_flushed += 1
+        if self.not_flushed >= self.flush_every:
+            self.flush()
+
+    def write_section(self, data_type: str) -> None:
+        '''
+        Записывает начало обработки типа данных
+        `data_type`: тип данных
+        '''
+        self.write({'kind': 'section', 'type': data_type})
+
+    def write_group(self, data_type: str, group: str, info: Dict[str, Any] | None = None) -> None:
+        '''
+        Записывает начало обработки группы ссылок (диалога или альбома)
+        `data_type`: тип данных
+        `group`: ID диалога или название альбома
+        `info`: данные группы, например, имя диалога и ссылка на него
+        '''
+        self.write({'kind': 'group', 'type': data_type, 'group': group, 'info': info or {}})
+
+    def write_link(self, data_type: str, group: str | None, date: str | None, res: Dict[str, str]) -> None:
+        '''
+        Записывает результат обработки ссылки
+        `data_type`: тип данных
+        `group`: ID диалога, название альбома или `None`
+        `date`: дата или `None`
+        `res`: результат `data_downloader.get_info`
+        '''
+        self.count += 1
+        self.write({
+            'kind': 'link',
+            'type': data_type,
+            'group': group,
+            'date': date,
+            'file_info': res['file_info'],
+            'url': res['url'],
+            'path': res.get('path')
+        })
+
+    def flush(self) -> None:
+        self.file.flush()
+        self.not_flushed = 0
+
+    def close(self) -> None:
+        self.file.close()
+
+
+def read_records(path: str) -> Iterator[Dict[str, Any]]:
+    '''
+    Возвращает записи из файла NDJSON. Оборванная последняя строка (после аварийного завершения) пропускается
+    `path`: путь до файла NDJSON
+    '''
+    with open(path, encoding='utf8') as f:
+        for line in f:
+            if not line.endswith('\n'):
+                logger.warning(f'Последняя строка {path} оборвана и будет пропущена')
+                break
+            yield loads(line)
+
+
+def rebuild_links_info(path: str) -> Dict[str, Any]:
+    '''
+    Восстанавливает из файла NDJSON структуру `links_info.json`:
+    результаты сгруппированы по типу данных, диалогу или альбому, дате (если файлы разделялись по датам)
+    и информации о типе файла
+    `path`: путь до файла NDJSON
+    '''
+    result = {}
+    save_by_date = False
+    for record in read_records(path):
+        kind = record['kind']
+        if kind == 'header':
+            save_by_date = record['save_by_date']
+        elif kind == 'section':
+            result.setdefault(record['type'], {})
+        elif kind == 'group':
+            result.setdefault(record['type'], {}).setdefault(record['group'], {}).update(record['info'])
+        elif kind == 'link':
+            storage = result.setdefault(record['type'], {})
+            if record['group'] is not None:
+                storage = storage.setdefault(record['group'], {})
+            if save_by_date and record['date'] is not None:
+                storage = storage.setdefault(record['date'], {})
+            storage.setdefault(record['file_info'], []).append(record['url'])
+    return result
+
+
+def write_links_info(ndjson_path: str, json_path: str) -> None:
+    '''
+    Записывает `links_info.json`, восстановленный из файла NDJSON
+    `ndjson_path`: путь до файла NDJSON
+    `json_path`: путь до файла JSON
+    '''
+    with open(json_path, 'w', encoding='utf8') as f:
+        dump(rebuild_links_info(ndjson_path), f, indent=4, ensure_ascii=False)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Восстановление links_info.json из links_info.ndjson')
+    parser.add_argument('ndjson_path', nargs='?', default='output/links_info.ndjson', help='путь до файла NDJSON')
+    parser.add_argument('json_path', nargs='?', default='output/links_info.json', help='путь до файла JSON')
+    args = parser.parse_args()
+    write_links_info(args.ndjson_path, args.json_path)
@@ -0,0 +1,150 @@
+import hashlib
+import sqlite3
+from configparser import ConfigParser
+from json import dumps, loads
+from os import stat
+from typing import Any, Dict, List, Tuple
+
+from logger import create_logger
+
+config = ConfigParser()
+config_read = config.read('config.ini', encoding='utf8')
+log_level = 'DEBUG'
+if config_read:
+    log_level = config['main_parameters'].get('log_level', 'DEBUG')
+logger = create_logger('logs/vk_parser.log', 'parse_cache', log_level)
+
+# Версия формата результатов обработки файлов. При изменении формата все записи считаются устаревшими
+parse_cache_version = 3
+
+
+def get_file_hash(file_path: str, block_size: int = 1024 * 1024) -> str:
+    '''
+    Возвращает хэш `sha256` содержимого файла
+    `file_path`: путь до файла
+    `block_size`: размер блока чтения в байтах
+    '''
+    file_hash = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        while block := f.read(block_size):
+            file_hash.update(block)
+    return file_hash.hexdigest()
+
+
+def get_file_fingerprint(file_path: str) -> Tuple[int, int]:
+    '''
+    Возвращает размер файла в байтах и время его изменения в наносекундах
+    `file_path`: путь до файла
+    '''
+    file_stat = stat(file_path)
+    return file_stat.st_size, file_stat.st_mtime_ns
+
+
+class ParseCache():
+    def __init__(self, path: str) -> None:
+        '''
+        Хранилище результатов обработки `.html` файлов архива на основе SQLite.
+        Позволяет не обрабатывать повторно файлы, которые не изменились с прошлого запуска
+        `path`: путь до файла базы данных
+
+        Запись определяется путем до файла и именем обработчика, в которое входят все влияющие на результат настройки. Файл считается неизменным,
+        если совпадают размер и время изменения. Если совпадает только размер (например, архив был распакован заново),
+        сравнивается хэш содержимого.
+        Одновременное использование из нескольких потоков не поддерживается
+        '''
+        self.path = path
+        # При конвейерной обработке архива хранилище используется из потока обработки архива
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute(
+            '''
+            CREATE TABLE IF NOT EXISTS parsed_files (
+                file_path TEXT NOT NULL,
+                handler TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                sha256 TEXT NOT NULL,
+                version INTEGER NOT NULL,
+                result TEXT NOT NULL,
+                PRIMARY KEY (file_path, handler)
+            )
+            '''
+        )
+        self.connection.commit()
+        self.stats = {'hits': 0, 'misses': 0}
+
+    def get(self, file_path: str, handler: str, archive_source: Any = None) -> Tuple[bool, Any]:
+        '''
+        Возвращает `(True, результат)`, если файл не изменился с момента сохранения результата, иначе `(False, None)`
+        `file_path`: путь до файла
+        `handler`: имя обработчика вместе с настройками, от которых зависит результат
+        `archive_source`: источник файлов архива (`archive_reader`), через который берутся размер, время изменения
+        и хэш файла. Если не указан, файл читается с диска
+        '''
+        row = self.connection.execute(
+            'SELECT * FROM parsed_files WHERE file_path = ? AND handler = ?',
+            (file_path, handler)
+        ).fetchone()
+        if row is None or row['version'] != parse_cache_version:
+            self.stats['misses'] += 1
+            return False, None
+        if archive_source is None:
+            size, mtime_ns = get_file_fingerprint(file_path)
+        else:
+            size, mtime_ns = archive_source.get_fingerprint(file_path)
+        if size != row['size']:
+            self.stats['misses'] += 1
+            return False, None
+        if mtime_ns != row['mtime_ns']:
+            file_hash = get_file_hash(file_path) if archive_source is None else archive_source.get_hash(file_path)
+            if file_hash != row['sha256']:
+                self.stats['misses'] += 1
+                return False, None
+            self.connection.execute(
+                'UPDATE parsed_files SET mtime_ns = ? WHERE file_path = ? AND handler = ?',
+                (mtime_ns, file_path, handler)
+            )
+        self.stats['hits'] += 1
+        return True, loads(row['result'])
+
+    def update_many(self, records: List[Tuple[str, str, int, int, str, Any]]) -> None:
+        '''
+        Сохраняет результаты обработки файлов
+        `records`: список из пути до файла, имени обработчика, размера, времени изменения, хэша и результата
+        '''
+        self.connection.executemany(
+            '''
+            INSERT INTO parsed_files (file_path, handler, size, mtime_ns, sha256, version, result)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (file_path, handler) DO UPDATE SET
+                size = excluded.size,
+                mtime_ns = excluded.mtime_ns,
+                sha256 = excluded.sha256,
+                version = excluded.version,
+                result = excluded.result
+            ''',
+            [
+                (file_path, handler, size, mtime_ns, sha256, parse_cache_version, dumps(result, ensure_ascii=False))
+                for file_path, handler, size, mtime_ns, sha256, result in records
+            ]
+        )
+        self.connection.commit()
+
+    def get_stats(self) -> Dict[str, int]:
+        '''
+        Возвращает количество файлов, результаты которых взяты из хранилища (`hits`) и которые обработаны заново (`misses`)
+        '''
+        return dict(self.stats)
+
+    def clear(self) -> None:
+        '''
+        Удаляет все сохраненные результаты
+        '''
+        self.connection.execute('DELETE FROM parsed_files')
+        self.connection.commit()
+
+    def close(self) -> None:
+        self.connection.commit()
+        self.connection.close()
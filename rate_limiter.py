@@ -0,0 +1,188 @@
+import asyncio
+from configparser import ConfigParser
+from time import monotonic
+from typing import Dict, List, Tuple
+
+import metrics
+from link_classifier import split_url
+from logger import create_logger
+
+config = ConfigParser()
+config_read = config.read('config.ini', encoding='utf8')
+log_level = 'DEBUG'
+if config_read:
+    log_level = config['main_parameters'].get('log_level', 'DEBUG')
+logger = create_logger('logs/vk_parser.log', 'rate_limiter', log_level)
+
+# Домены страниц VK: слишком частые запросы к ним приводят к страницам ошибок VK
+vk_domains = ('vk.com', 'vk.ru')
+# Домены серверов файлов VK
+cdn_domains = ('userapi.com', 'vk-cdn.net', 'vkuseraudio.net', 'vkuservideo.net', 'vkuserphoto.ru', 'vk.me')
+# Лимиты по умолчанию для классов хостов: запросов в секунду (`0` - без ограничений) и запросов подряд
+default_host_limits = {
+    'vk': (5.0, 10),
+    'cdn': (0.0, 50),
+    'other': (0.0, 10)
+}
+# Классы хостов, для которых лимит общий для всех хостов класса, а не свой для каждого хоста
+shared_host_classes = ('vk',)
+# Пауза в запросах к хосту после ответа `429` без заголовка `Retry-After` в секундах
+default_throttle_pause = 5.0
+
+
+def get_host_class(host: str) -> str:
+    '''
+    Возвращает класс хоста: `vk` - страницы VK, `cdn` - серверы файлов VK, `other` - остальные сайты
+    `host`: хост
+    '''
+    for host_class, domains in (('vk', vk_domains), ('cdn', cdn_domains)):
+        for domain in domains:
+            if host == domain or host.endswith('.' + domain):
+                return host_class
+    return 'other'
+
+
+class TokenBucket():
+    def __init__(self, rate: float, burst: int) -> None:
+        '''
+        Ограничитель частоты запросов по алгоритму Token Bucket: запас запросов пополняется со скоростью `rate`
+        в секунду и накапливается не больше чем до `burst`. Запрос при пустом запасе занимает следующий запрос
+        из будущего пополнения, поэтому ожидающие запросы выполняются равномерно, а не все сразу после пополнения.
+        Если `rate` равен `0`, частота запросов не ограничивается, но запросы можно приостановить через `pause`
+        `rate`: количество запросов в секунду, `0` - без ограничений
+        `burst`: количество запросов, которое можно выполнить подряд без ожидания
+        '''
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.tokens = float(self.burst)
+        self.updated = monotonic()
+        self.paused_until = 0.0
+
+    def reserve(self) -> float:
+        '''
+        Занимает один запрос и возвращает время в секундах, через которое его можно выполнить
+        '''
+        now = monotonic()
+        if self.rate <= 0:
+            return max(self.paused_until - now, 0.0)
+        self.tokens = min(self.tokens + (now - self.updated) * self.rate, self.burst)
+        self.updated = now
+        self.tokens -= 1
+        delay = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        return max(delay, self.paused_until - now)
+
+    def cancel(self) -> None:
+        '''
+        Возвращает занятый через `reserve` запрос, если он так и не был выполнен
+        '''
+        if self.rate > 0:
+            self.tokens = min(self.tokens + 1, self.burst)
+
+    def pause(self, seconds: float) -> None:
+        '''
+        Приостанавливает запросы на `seconds` секунд
+        `seconds`: длительность паузы
+        '''
+        self.paused_until = max(self.paused_until, monotonic() + seconds)
+
+
+class HostRateLimiter():
+    def __init__(self, limits: Dict[str, Tuple[float, int]] | None = None) -> None:
+        '''
+        Ограничитель частоты запросов к хостам. Для каждого класса хостов из `get_host_class` задается свой лимит:
+        для страниц VK он общий для всех запросов к VK, для серверов файлов и остальных сайтов - свой для каждого хоста,
+        поэтому файлы можно скачивать быстро, не превышая допустимую частоту запросов к страницам VK
+        `limits`: количество запросов в секунду (`0` - без ограничений) и количество запросов подряд
+        для каждого класса хостов. Если не указаны, используются `default_host_limits`
+        '''
+        self.limits = limits if limits is not None else default_host_limits
+        self.buckets: Dict[str, TokenBucket] = {}
+        # Занятые, но еще не выполненные запросы отложенных задач: `ссылка: [время, когда запрос можно выполнить]`
+        self.reservations: Dict[str, List[float]] = {}
+
+    @classmethod
+    def from_config(self, section) -> 'HostRateLimiter':
+        '''
+        Создает ограничитель по секции `connection_parameters` файла конфигурации.
+        Для каждого класса хостов могут быть заданы `<класс>_requests_per_second` и `<класс>_requests_burst`
+        `section`: секция конфигурации
+        '''
+        limits = {}
+        for host_class, (rate, burst) in default_host_limits.items():
+            limits[host_class] = (
+                float(section.get(f'{host_class}_requests_per_second', rate)),
+                int(section.get(f'{host_class}_requests_burst', burst))
+            )
+        return HostRateLimiter(limits)
+
+    def get_bucket(self, url: str) -> Tuple[str, TokenBucket]:
+        '''
+        Возвращает класс хоста ссылки и его `TokenBucket`.
+        Если частота запросов к хосту не ограничена, `TokenBucket` только хранит паузу после ответа `429`
+        `url`: ссылка
+        '''
+        host = split_url(url)[0]
+        host_class = get_host_class(host)
+        rate, burst = self.limits.get(host_class, (0.0, 1))
+        key = host_class if host_class in shared_host_classes else host
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = TokenBucket(rate, burst)
+        return host_class, bucket
+
+    async def acquire(self, url: str) -> None:
+        '''
+        Дожидается, пока запрос по ссылке `url` можно будет выполнить
+        `url`: ссылка
+        '''
+        host_class, bucket = self.get_bucket(url)
+        delay = bucket.reserve()
+        metrics.rate_limit_wait_duration.observe(delay, host_class=host_class)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def try_acquire(self, url: str) -> float:
+        '''
+        Занимает запрос по ссылке `url` и возвращает время в секундах, через которое его можно выполнить.
+        Если время больше `0`, запрос остается занятым за ссылкой: задача, отложенная на это время
+        без занятия места в `DownloadScheduler`, при следующем вызове с той же ссылкой получит `0`.
+        Поэтому каждая задача ждет своей очереди один раз, а не опрашивает ограничитель
+        `url`: ссылка
+        '''
+        now = monotonic()
+        host_class, bucket = self.get_bucket(url)
+        reserved = self.reservations.get(url)
+        if reserved:
+            # Пауза после ответа `429` откладывает и уже занятые запросы
+            ready = max(reserved[0], bucket.paused_until)
+            if ready > now:
+                return ready - now
+            reserved.pop(0)
+            if not reserved:
+                del self.reservations[url]
+            return 0.0
+        delay = bucket.reserve()
+        metrics.rate_limit_wait_duration.observe(delay, host_class=host_class)
+        if delay > 0:
+            self.reservations.setdefault(url, []).append(now + delay)
+        return delay
+
+    def cancel(self, url: str) -> None:
+        '''
+        Возвращает запрос, занятый через `try_acquire`, если он так и не был выполнен,
+        например, когда файл уже скачан при прошлом запуске
+        `url`: ссылка
+        '''
+        self.get_bucket(url)[1].cancel()
+
+    def pause(self, url: str, seconds: float | None) -> None:
+        '''
+        Приостанавливает запросы к хосту ссылки, например, после ответа `429`
+        `url`: ссылка
+        `seconds`: длительность паузы. Если не указана, используется `default_throttle_pause`
+        '''
+        host_class, bucket = self.get_bucket(url)
+        seconds = default_throttle_pause if seconds is None else seconds
+        bucket.pause(seconds)
+        logger.info(f'Запросы к хосту класса {host_class} ({split_url(url)[0]}) приостановлены на {seconds:.1f} с')
+
@@ -0,0 +1,97 @@
+import random
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Dict
+
+
+class RetryRule():
+    def __init__(self, attempts: int, base_delay: float, max_delay: float, use_retry_after: bool = False) -> None:
+        '''
+        Правило повторов для одного класса ошибок
+        `attempts`: количество повторных попыток, `0` - не повторять
+        `base_delay`: задержка перед первым повтором в секундах, далее удваивается с каждой попыткой
+        `max_delay`: максимальная задержка в секундах
+        `use_retry_after`: учитывать ли заголовок `Retry-After` ответа сервера
+        '''
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.use_retry_after = use_retry_after
+
+
+# Правила повторов по умолчанию для классов ошибок из `data_downloader.get_error_class`
+default_retry_rules = {
+    'timeout': RetryRule(3, 2, 60),
+    'throttled': RetryRule(5, 5, 120, use_retry_after=True),
+    'server_error': RetryRule(4, 1, 60, use_retry_after=True),
+    'connection_error': RetryRule(4, 0.5, 30),
+    'vk_error_page': RetryRule(1, 10, 60),
+    'error': RetryRule(0, 0, 0)
+}
+
+
+def parse_retry_after(value: str | None) -> float | None:
+    '''
+    Возвращает задержку в секундах из заголовка `Retry-After` (число секунд или HTTP дата) или `None`
+    `value`: значение заголовка
+    '''
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        date = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    return max((date - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+
+class RetryPolicy():
+    def __init__(self, rules: Dict[str, RetryRule] | None = None) -> None:
+        '''
+        Политика повторов неудачных скачиваний.
+        Задержка перед повтором растет экспоненциально и случайно уменьшается до двух раз,
+        чтобы повторы одновременно упавших скачиваний не приходили на сервер одной волной.
+        Если сервер передал `Retry-After`, задержка будет не меньше указанной, но не больше `max_delay`
+        `rules`: правила повторов для классов ошибок. Если не указаны, используются `default_retry_rules`.
+        Ошибки неизвестных классов не повторяются
+        '''
+        self.rules = rules if rules is not None else default_retry_rules
+
+    def get_delay(self, error_class: str | None, attempt: int, retry_after: str | None = None) -> float | None:
+        '''
+        Возвращает задержку перед повтором в секундах или `None`, если повторять не нужно
+        `error_class`: класс ошибки скачивания
+        `attempt`: количество уже выполненных повторов
+        `retry_after`: значение заголовка `Retry-After`, если есть
+        '''
+        rule = self.rules.get(error_class)
+        if rule is None or attempt >= rule.attempts:
+            return None
+        delay = min(rule.base_delay * 2 ** attempt, rule.max_delay)
+        delay = delay / 2 + random.uniform(0, delay / 2)
+        if rule.use_retry_after:
+            server_delay = parse_retry_after(retry_after)
+            if server_delay is not None:
+                delay = max(delay, min(server_delay, rule.max_delay))
+        return delay
+
+    @classmethod
+    def from_config(self, section) -> 'RetryPolicy':
+        '''
+        Создает политику повторов по секции `retry_parameters` файла конфигурации.
+        Для каждого класса ошибок могут быть заданы `<класс>_attempts`, `<класс>_base_delay` и `<класс>_max_delay`
+        `section`: секция конфигурации
+        '''
+        rules = {}
+        for error_class, rule in default_retry_rules.items():
+            rules[error_class] = RetryRule(
+                attempts=int(section.get(f'{error_class}_attempts', rule.attempts)),
+                base_delay=float(section.get(f'{error_class}_base_delay', rule.base_delay)),
+                max_delay=float(section.get(f'{error_class}_max_delay', rule.max_delay)),
+                use_retry_after=rule.use_retry_after
+            )
+        return RetryPolicy(rules)
@@ -0,0 +1,366 @@
+import asyncio
+from configparser import ConfigParser
+from time import monotonic
+from traceback import format_exc
+from typing import Any, Callable, Coroutine, Dict, List
+
+import metrics
+from logger import create_logger
+from retry import RetryPolicy
+
+config = ConfigParser()
+config_read = config.read('config.ini', encoding='utf8')
+log_level = 'DEBUG'
+if config_read:
+    log_level = config['main_parameters'].get('log_level', 'DEBUG')
+logger = create_logger('logs/vk_parser.log', 'scheduler', log_level)
+
+# Классы ошибок обработчика задач, при которых лимит одновременных скачиваний уменьшается
+congestion_error_classes = ('timeout', 'throttled', 'server_error', 'connection_error')
+
+
+class JobDeferred(Exception):
+    def __init__(self, wait: float | asyncio.Future) -> None:
+        '''
+        Исключение, которым обработчик задач откладывает задачу, если ее нельзя выполнить сейчас,
+        например, из-за ограничения частоты запросов. `DownloadScheduler` освобождает место задачи
+        и возвращает ее в очередь, когда ожидание закончится
+        `wait`: время ожидания в секундах или `asyncio.Future`, завершения которого нужно дождаться
+        '''
+        super().__init__(wait)
+        self.wait = wait
+
+
+class AdaptiveLimiter():
+    def __init__(
+        self,
+        name: str,
+        initial: int,
+        min_limit: int = 1,
+        max_limit: int | None = None,
+        decrease_factor: float = 0.7,
+        latency_tolerance: float = 2.0,
+        cooldown: float = 2.0
+    ) -> None:
+        '''
+        Ограничитель количества одновременных скачиваний по алгоритму AIMD.
+        Каждое успешное скачивание увеличивает лимит на `1 / limit` (примерно +1 за «поколение» скачиваний),
+        пока время ответа не превышает базовое больше чем в `latency_tolerance` раз.
+        Ошибки перегрузки (`429`, `5xx`, тайм-ауты, разрывы соединения) уменьшают лимит в `decrease_factor` раз,
+        но не чаще, чем раз в `cooldown` секунд
+
+        `name`: имя класса скачиваний для логов
+        `initial`: начальный лимит
+        `min_limit`: минимальный лимит
+        `max_limit`: максимальный лимит. Если не указан, равен `initial`
+        `decrease_factor`: множитель лимита при ошибках перегрузки
+        `latency_tolerance`: во сколько раз время ответа может превышать базовое, чтобы лимит продолжал расти
+        `cooldown`: минимальное время между уменьшениями лимита в секундах
+        '''
+        self.name = name
+        self.max_limit = max(max_limit if max_limit is not None else initial, 1)
+        self.min_limit = min(max(min_limit, 1), self.max_limit)
+        self.limit = float(min(max(initial, self.min_limit), self.max_limit))
+        self.decrease_factor = decrease_factor
+        self.latency_tolerance = latency_tolerance
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self.waiters: List[asyncio.Future] = []
+        self.latency_ewma: float | None = None
+        self.latency_base: float | None = None
+        self.last_decrease = 0.0
+        self.started = monotonic()
+        self.stats = {'completed': 0, 'congestion_errors': 0, 'other_errors': 0}
+
+    @property
+    def current_limit(self) -> int:
+        return int(self.limit)
+
+    async def acquire(self) -> None:
+        '''
+        Дожидается, пока количество одновременных скачиваний станет меньше текущего лимита, и занимает место
+        '''
+        while self.in_flight >= self.current_limit:
+            waiter = asyncio.get_running_loop().create_future()
+            self.waiters.append(waiter)
+            try:
+                await waiter
+            finally:
+                if waiter in self.waiters:
+                    self.waiters.remove(waiter)
+        self.in_flight += 1
+
+    def cancel(self) -> None:
+        '''
+        Освобождает место отложенной задачи, не учитывая ее в лимите и статистике
+        '''
+        self.in_flight -= 1
+        self.wake_up()
+
+    def wake_up(self) -> None:
+        '''
+        Пробуждает ожидающих, если есть свободные места
+        '''
+        free = self.current_limit - self.in_flight
+        for waiter in self.waiters[:max(free, 0)]:
+            if not waiter.done():
+                waiter.set_result(None)
+
+    def release(self, error_class: str | None, latency: float) -> None:
+        '''
+        Освобождает место и пересчитывает лимит по результату скачивания
+        `error_class`: класс ошибки скачивания или `None`, если скачивание прошло успешно
+        `latency`: время скачивания в секундах
+        '''
+        self.in_flight -= 1
+        self.stats['completed'] += 1
+        if error_class in congestion_error_classes:
+            self.stats['congestion_errors'] += 1
+            self.decrease(error_class)
+        elif error_class is None:
+            self.increase(latency)
+        else:
+            self.stats['other_errors'] += 1
+        self.wake_up()
+
+    def increase(self, latency: float) -> None:
+        '''
+        Аддитивно увеличивает лимит, если время ответа не выросло относительно базового
+        `latency`: время скачивания в секундах
+        '''
+        self.latency_ewma = latency if self.latency_ewma is None else self.latency_ewma * 0.9 + latency * 0.1
+        if self.latency_base is None or self.latency_ewma < self.latency_base:
+            self.latency_base = self.latency_ewma
+        if self.latency_ewma > self.latency_base * self.latency_tolerance or self.limit >= self.max_limit:
+            return
+        previous = self.current_limit
+        self.limit = min(self.limit + 1 / self.limit, self.max_limit)
+        if self.current_limit != previous:
+            logger.debug(f'Лимит класса {self.name} увеличен до {self.current_limit}')
+
+    def decrease(self, error_class: str) -> None:
+        '''
+        Мультипликативно уменьшает лимит
+        `error_class`: класс ошибки, из-за которой уменьшается лимит
+        '''
+        now = monotonic()
+        if now - self.last_decrease < self.cooldown or self.limit <= self.min_limit:
+            return
+        self.last_decrease = now
+        self.limit = max(self.limit * self.decrease_factor, self.min_limit)
+        # После перегрузки базовое время ответа определяется заново
+        self.latency_base = self.latency_ewma
+        logger.info(f'Лимит класса {self.name} уменьшен до {self.current_limit} из-за ошибки {error_class}')
+
+    def get_stats(self) -> Dict[str, Any]:
+        '''
+        Возвращает текущий лимит, количество выполняемых скачиваний, пропускную способность и долю ошибок перегрузки
+        '''
+        completed = self.stats['completed']
+        return {
+            'limit': self.current_limit,
+            'in_flight': self.in_flight,
+            'completed': completed,
+            'throughput': completed / max(monotonic() - self.started, 1e-9),
+            'error_rate': self.stats['congestion_errors'] / completed if completed else 0.0,
+            'latency': self.latency_ewma
+        }
+
+
+class DownloadJob():
+    def __init__(self, kwargs: Dict[str, Any], on_result: Callable[[Dict[str, str]], None] | None, future: asyncio.Future) -> None:
+        '''
+        Задача на обработку одной ссылки
+        `kwargs`: аргументы для обработчика задач
+        `on_result`: функция, в которую будет передан результат сразу после завершения задачи
+        `future`: `asyncio.Future`, в который будет записан результат задачи
+        '''
+        self.kwargs = kwargs
+        self.on_result = on_result
+        self.future = future
+        self.attempt = 0
+
+
+class DownloadScheduler():
+    def __init__(
+        self,
+        job_handler: Callable[..., Coroutine],
+        pools: Dict[str, AdaptiveLimiter],
+        stats_interval: float = 30,
+        retry_policy: RetryPolicy | None = None
+    ) -> None:
+        '''
+        Общий планировщик скачиваний.
+        Для каждого класса скачиваний (например, `small` для фото и `big` для документов) создается
+        своя очередь и обработчики, которые берут задачи из очереди по мере освобождения.
+        Количество одновременно выполняемых задач определяет `AdaptiveLimiter` класса скачиваний.
+        Задачи всех типов данных попадают в общие очереди, поэтому сеть загружена на протяжении всей работы
+
+        `job_handler`: корутина, обрабатывающая одну задачу, например, `data_downloader.get_info`.
+        Если в результате задачи есть ключ `error_class`, он учитывается при пересчете лимита
+        `pools`: ограничитель одновременных скачиваний для каждого класса скачиваний
+        `stats_interval`: период вывода состояния классов скачиваний в лог в секундах, `0` - не выводить
+        `retry_policy`: политика повторов задач, результат которых содержит `error_class`. Если не указана, задачи не повторяются.
+        Повторяемая задача не занимает место обработчика во время ожидания, а возвращается в конец очереди после задержки.
+        Так же возвращается в очередь задача, отложенная обработчиком задач через `JobDeferred`
+        '''
+        self.job_handler = job_handler
+        self.pools = pools
+        self.stats_interval = stats_interval
+        self.retry_policy = retry_policy
+        self.retries = {name: 0 for name in pools}
+        self.deferred = {name: 0 for name in pools}
+        self.queues = {name: asyncio.Queue() for name in pools}
+        self.workers: List[asyncio.Task] = []
+
+    def start(self) -> None:
+        '''
+        Запускает обработчики всех классов скачиваний
+        '''
+        for name, limiter in self.pools.items():
+            for _ in range(limiter.max_limit):
+                self.workers.append(asyncio.create_task(self.worker(name)))
+            logger.debug(
+                f'Запущено обработчиков класса {name}: {limiter.max_limit}, '
+                f'лимит: {limiter.current_limit} ({limiter.min_limit}-{limiter.max_limit})'
+            )
+        if self.stats_interval > 0:
+            self.workers.append(asyncio.create_task(self.stats_reporter()))
+
+    async def stats_reporter(self) -> None:
+        '''
+        Периодически выводит в лог состояние классов скачиваний
+        '''
+        while True:
+            await asyncio.sleep(self.stats_interval)
+            for name, stats in self.get_stats().items():
+                logger.info(
+                    f'Класс {name}: лимит {stats["limit"]}, выполняется {stats["in_flight"]}, '
+                    f'в очереди {stats["queued"]}, {stats["throughput"]:.2f} ссылок/с, '
+                    f'ошибок перегрузки {stats["error_rate"]:.1%}'
+                )
+
+    def get_stats(self) -> Dict[str, Dict[str, Any]]:
+        '''
+        Возвращает состояние каждого класса скачиваний: данные `AdaptiveLimiter.get_stats` и размер очереди
+        '''
+        return {
+            name: {
+                **limiter.get_stats(),
+                'queued': self.queues[name].qsize(),
+                'retries': self.retries[name],
+                'deferred': self.deferred[name]
+            }
+            for name, limiter in self.pools.items()
+        }
+
+    async def worker(self, pool: str) -> None:
+        '''
+        Обработчик задач из очереди класса скачиваний `pool`
+        `pool`: имя класса скачиваний
+        '''
+        queue = self.queues[pool]
+        limiter = self.pools[pool]
+        while True:
+            job = await queue.get()
+            wait_start = monotonic()
+            await limiter.acquire()
+            start = monotonic()
+            metrics.pool_wait_duration.observe(start - wait_start, pool=pool)
+            metrics.downloads_in_flight.inc(pool=pool)
+            error_class = 'error'
+            retry_scheduled = False
+            deferred = False
+            try:
+                result = await self.job_handler(**job.kwargs)
+                error_class = result.get('error_class') if result else None
+                retry_scheduled = self.schedule_retry(pool, job, result)
+                if not retry_scheduled:
+                    if result and job.on_result is not None:
+                        job.on_result(result)
+                    job.future.set_result(result)
+            except JobDeferred as e:
+                deferred = True
+                self.defer(pool, job, e.wait)
+            except Exception as e:
+                logger.error(f'Ошибка обработки задачи {job.kwargs.get("url")}: {e}')
+                logger.debug(format_exc())
+                job.future.set_result(None)
+            finally:
+                metrics.downloads_in_flight.dec(pool=pool)
+                if deferred:
+                    limiter.cancel()
+                else:
+                    latency = monotonic() - start
+                    limiter.release(error_class, latency)
+                    metrics.link_duration.observe(latency, pool=pool)
+                # Повторяемая и отложенная задачи остаются незавершенными в очереди до возвращения в нее
+                if not retry_scheduled and not deferred:
+                    queue.task_done()
+
+    def schedule_retry(self, pool: str, job: DownloadJob, result: Dict[str, str] | None) -> bool:
+        '''
+        Возвращает задачу в очередь после задержки, если этого требует политика повторов.
+        Возвращает `True`, если повтор запланирован
+        `pool`: имя класса скачиваний
+        `job`: выполненная задача
+        `result`: результат задачи
+        '''
+        if self.retry_policy is None or not result or not result.get('error_class'):
+            return False
+        delay = self.retry_policy.get_delay(result['error_class'], job.attempt, result.get('retry_after'))
+        if delay is None:
+            return False
+        job.attempt += 1
+        self.retries[pool] += 1
+        logger.debug(
+            f'Повтор {job.attempt} задачи {job.kwargs.get("url")} через {delay:.1f} с '
+            f'из-за ошибки {result["error_class"]}'
+        )
+        asyncio.get_running_loop().call_later(delay, self.requeue, pool, job)
+        return True
+
+    def defer(self, pool: str, job: DownloadJob, wait: float | asyncio.Future) -> None:
+        '''
+        Возвращает отложенную задачу в очередь после ожидания
+        `pool`: имя класса скачиваний
+        `job`: отложенная задача
+        `wait`: время ожидания в секундах или `asyncio.Future`, после завершения которого задача возвращается в очередь
+        '''
+        self.deferred[pool] += 1
+        if isinstance(wait, asyncio.Future):
+            wait.add_done_callback(lambda _: self.requeue(pool, job))
+        else:
+            asyncio.get_running_loop().call_later(wait, self.requeue, pool, job)
+
+    def requeue(self, pool: str, job: DownloadJob) -> None:
+        '''
+        Возвращает повторяемую задачу в очередь класса скачиваний `pool`
+        `pool`: имя класса скачиваний
+        `job`: повторяемая задача
+        '''
+        queue = self.queues[pool]
+        queue.put_nowait(job)
+        queue.task_done()
+
+    def submit(self, pool: str, on_result: Callable[[Dict[str, str]], None] | None = None, **kwargs) -> asyncio.Future:
+        '''
+        Добавляет задачу в очередь класса скачиваний `pool` и возвращает `asyncio.Future` с ее результатом
+        `pool`: имя класса скачиваний
+        `on_result`: функция, в которую будет передан результат сразу после завершения задачи
+        `kwargs`: аргументы для обработчика задач
+        '''
+        future = asyncio.get_running_loop().create_future()
+        self.queues[pool].put_nowait(DownloadJob(kwargs, on_result, future))
+        return future
+
+    async def stop(self) -> None:
+        '''
+        Дожидается выполнения всех задач и останавливает обработчики
+        '''
+        for queue in self.queues.values():
+            await queue.join()
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
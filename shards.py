@@ -0,0 +1,174 @@
+import argparse
+import hashlib
+import shutil
+from configparser import ConfigParser
+from os import listdir
+from os.path import basename, isdir, isfile, join
+from typing import Dict, List, Tuple
+
+import tools
+from dedup import normalize_url
+from logger import create_logger
+from manifest import DownloadManifest
+from output_writer import LinksWriter, read_records, write_links_info
+
+config = ConfigParser()
+config_read = config.read('config.ini', encoding='utf8')
+log_level = 'DEBUG'
+if config_read:
+    log_level = config['main_parameters'].get('log_level', 'DEBUG')
+logger = create_logger('logs/vk_parser.log', 'shards', log_level)
+
+# Папка внутри папки результата, в которой каждая часть хранит свои служебные файлы
+shards_folder_name = 'shards'
+
+
+def parse_shard(value: str) -> Tuple[int, int]:
+    '''
+    Возвращает номер части и количество частей из строки вида `i/N`, где `1 <= i <= N`
+    `value`: строка
+    '''
+    index, sep, count = value.partition('/')
+    if not sep or not index.strip().isdigit() or not count.strip().isdigit():
+        raise argparse.ArgumentTypeError(f'ожидается номер части и количество частей вида i/N, получено: {value}')
+    index, count = int(index), int(count)
+    if not 1 <= index <= count:
+        raise argparse.ArgumentTypeError(f'номер части должен быть от 1 до {count}, получено: {index}')
+    return index, count
+
+
+def get_shard_index(url: str, count: int) -> int:
+    '''
+    Возвращает номер части (от `1` до `count`), к которой относится ссылка.
+    Номер зависит только от нормализованной ссылки (`dedup.normalize_url`), поэтому одинаков на всех машинах,
+    а одинаковые файлы из разных диалогов попадают в одну часть и не скачиваются повторно
+    `url`: ссылка
+    `count`: количество частей
+    '''
+    digest = hashlib.blake2b(normalize_url(url).encode('utf8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') % count + 1
+
+
+def in_shard(url: str, shard: Tuple[int, int] | None) -> bool:
+    '''
+    Проверяет, относится ли ссылка к части `shard`
+    `url`: ссылка
+    `shard`: номер части и количество частей. Если `None`, к части относятся все ссылки
+    '''
+    return shard is None or get_shard_index(url, shard[1]) == shard[0]
+
+
+def get_shard_folder(output_folder: str, shard: Tuple[int, int]) -> str:
+    '''
+    Возвращает папку служебных файлов части: `<папка результата>/shards/<i>-of-<N>`
+    `output_folder`: папка результата
+    `shard`: номер части и количество частей
+    '''
+    return join(output_folder, shards_folder_name, f'{shard[0]}-of-{shard[1]}')
+
+
+def find_shard_folders(output_folder: str) -> List[Tuple[Tuple[int, int], str]]:
+    '''
+    Возвращает номера и папки служебных файлов всех частей из папки результата, упорядоченные по номеру
+    `output_folder`: папка результата
+    '''
+    root = join(output_folder, shards_folder_name)
+    if not isdir(root):
+        return []
+    folders = []
+    for name in listdir(root):
+        try:
+            shard = parse_shard(name.replace('-of-', '/'))
+        except argparse.ArgumentTypeError:
+            continue
+        folders.append((shard, join(root, name)))
+    return sorted(folders)
+
+
+def merge_links_info(ndjson_paths: List[str], path: str) -> int:
+    '''
+    Объединяет файлы `links_info.ndjson` частей в один и возвращает количество записей о ссылках.
+    Записи о типах данных и группах, повторяющиеся во всех частях, записываются один раз
+    `ndjson_paths`: пути до файлов NDJSON частей
+    `path`: путь до объединенного файла NDJSON
+    '''
+    save_by_date = False
+    for ndjson_path in ndjson_paths:
+        records = read_records(ndjson_path)
+        save_by_date = save_by_date or next(records, {}).get('save_by_date', False)
+        records.close()
+    writer = LinksWriter(path, save_by_date)
+    seen = set()
+    count = 0
+    try:
+        for ndjson_path in ndjson_paths:
+            for record in read_records(ndjson_path):
+                kind = record['kind']
+                if kind == 'header':
+                    continue
+                if kind == 'link':
+                    count += 1
+                else:
+                    key = (kind, record['type'], record.get('group'))
+                    if key in seen:
+                        continue
+                    seen.add(key)
+                writer.write(record)
+    finally:
+        writer.close()
+    return count
+
+
+def merge_shards(output_folder: str, links_info_json: bool = True) -> Dict[str, int]:
+    '''
+    Объединяет служебные файлы всех частей из `<папка результата>/shards` в файлы папки результата,
+    как после обычного запуска: `manifest.sqlite`, `links_info.ndjson`, `links_info.json` и `dirty_links.json`.
+    Скачанные файлы частей уже лежат по своим путям в папке результата, если она общая.
+    Иначе папки результата всех машин нужно предварительно скопировать в одну, пути файлов частей не пересекаются.
+    Возвращает количество частей, записей о скачиваниях и записей о ссылках
+    `output_folder`: папка результата
+    `links_info_json`: восстанавливать ли `links_info.json` из объединенного `links_info.ndjson`
+    '''
+    folders = find_shard_folders(output_folder)
+    if not folders:
+        raise FileNotFoundError(f'В {join(output_folder, shards_folder_name)} не найдено ни одной части')
+    counts = {shard[1] for shard, _ in folders}
+    if len(counts) > 1:
+        raise ValueError(f'Найдены части разных разбиений: {sorted(counts)}, оставьте части только одного из них')
+    count = counts.pop()
+    missing = sorted(set(range(1, count + 1)) - {shard[0] for shard, _ in folders})
+    if missing:
+        logger.warning(f'Не найдены части {missing} из {count}, результат будет неполным')
+
+    stats = {'shards': len(folders), 'downloads': 0, 'links': 0}
+    manifest_paths = [join(folder, 'manifest.sqlite') for _, folder in folders]
+    manifest_paths = [path for path in manifest_paths if isfile(path)]
+    if manifest_paths:
+        # Записи частей добавляются к уже существующим, при совпадении остается более новая
+        manifest = DownloadManifest(join(output_folder, 'manifest.sqlite'))
+        try:
+            for path in manifest_paths:
+                manifest.merge(path)
+            stats['downloads'] = sum(manifest.get_stats().values())
+        finally:
+            manifest.close()
+
+    ndjson_paths = [join(folder, 'links_info.ndjson') for _, folder in folders]
+    ndjson_paths = [path for path in ndjson_paths if isfile(path)]
+    if ndjson_paths:
+        ndjson_path = join(output_folder, 'links_info.ndjson')
+        tools.backup_file(ndjson_path)
+        stats['links'] = merge_links_info(ndjson_paths, ndjson_path)
+        if links_info_json:
+            json_path = join(output_folder, 'links_info.json')
+            tools.backup_file(json_path)
+            write_links_info(ndjson_path, json_path)
+
+    # Все ссылки архива одинаковы во всех частях, поэтому берется файл любой части
+    for _, folder in folders:
+        dirty_links_path = join(folder, 'dirty_links.json')
+        if isfile(dirty_links_path):
+            shutil.copyfile(dirty_links_path, join(output_folder, basename(dirty_links_path)))
+            break
+    logger.info(f'Части из {join(output_folder, shards_folder_name)} объединены: {stats}')
+    return stats
@@ -0,0 +1,54 @@
+'''
+Проверка чтения архива VK прямо из `.zip` через `archive_reader.ZipSource`
+'''
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from os import getpid
+from os.path import join
+
+import archive_reader
+from archive_reader import ZipSource, directory_source
+from benchmarks.archive_generator import generate_archive
+from links_finder import VKLinkFinder
+
+
+def test_zip_matches_directory(tmp_path) -> None:
+    root = join(tmp_path, 'Archive')
+    generate_archive(root, dialogs=2, pages=2, messages=20, albums=1, photos=10, likes=10, documents=5)
+    zip_path = shutil.make_archive(join(tmp_path, 'Archive'), 'zip', tmp_path, 'Archive')
+    source = ZipSource(zip_path)
+    zip_file = source.get_zip()[0]
+    try:
+        dialog = join('messages', '-2000000000')
+        assert source.is_dir(join(zip_path, dialog))
+        files = sorted(source.list_files(join(zip_path, dialog), ['.html']))
+        assert files == [join(zip_path, dialog, 'messages0.html'), join(zip_path, dialog, 'messages50.html')]
+        for file_path in files:
+            expected = VKLinkFinder.get_messages_attachment(file_path.replace(zip_path, root), 'cp1251', 'bytes')
+            assert VKLinkFinder.get_messages_attachment(file_path, 'cp1251', 'bytes', source) == expected
+        assert source.get_hash(files[0]).startswith('crc32:')
+        assert directory_source.get_hash(join(root, dialog, 'messages0.html')) != source.get_hash(files[0])
+    finally:
+        source.close()
+    assert (getpid(), zip_path) not in archive_reader.opened_zip_files
+    assert zip_file.fp is None
+
+
+def test_zip_in_process_pool_after_parent_use(tmp_path) -> None:
+    root = join(tmp_path, 'Archive')
+    generate_archive(root, dialogs=60, pages=3, messages=50, albums=2, photos=50, likes=50, documents=20)
+    zip_path = shutil.make_archive(join(tmp_path, 'Archive'), 'zip', tmp_path, 'Archive')
+    folder_names = {'messages': 'messages', 'photos': 'photos/photo-albums', 'likes/photo': 'likes/photo', 'profile': 'profile'}
+    source = ZipSource(zip_path)
+    try:
+        # Основной процесс открывает архив до создания пула процессов, как `main.folder_check`
+        assert source.is_dir(join(zip_path, 'messages'))
+        with ProcessPoolExecutor(4) as executor:
+            expected = VKLinkFinder(root, folder_names, executor=executor, html_parser='bytes').link_info
+            for _ in range(3):
+                found = VKLinkFinder(
+                    zip_path, folder_names, executor=executor, html_parser='bytes', archive_source=source
+                ).link_info
+                assert found == expected
+    finally:
+        source.close()
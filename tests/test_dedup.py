@@ -0,0 +1,59 @@
+'''
+Проверка поиска повторяющихся файлов `dedup.FileDeduplicator`
+'''
+import asyncio
+
+import pytest
+
+from dedup import FileDeduplicator
+from scheduler import JobDeferred
+
+
+def test_duplicate_url_is_deferred_until_download_ends(tmp_path) -> None:
+    path = tmp_path / 'a.jpg'
+    path.write_bytes(b'data')
+    info = {'path': str(path), 'final_url': 'https://sun9-1.userapi.com/a.jpg', 'content_type': 'image/jpeg', 'size': 4}
+
+    async def run() -> None:
+        dedup = FileDeduplicator()
+        assert dedup.acquire('https://sun9-1.userapi.com/a.jpg?size=1') is None
+        with pytest.raises(JobDeferred) as deferred:
+            dedup.acquire('https://sun9-1.userapi.com/a.jpg?size=2')
+        assert not deferred.value.wait.done()
+        dedup.complete('https://sun9-1.userapi.com/a.jpg?size=1', info)
+        assert deferred.value.wait.done()
+        assert dedup.acquire('https://sun9-1.userapi.com/a.jpg?size=2') == info
+
+    asyncio.run(run())
+
+
+def test_released_url_is_taken_by_next_job() -> None:
+    async def run() -> None:
+        dedup = FileDeduplicator()
+        assert dedup.acquire('https://sun9-1.userapi.com/b.jpg') is None
+        with pytest.raises(JobDeferred) as deferred:
+            dedup.acquire('https://sun9-1.userapi.com/b.jpg')
+        dedup.release('https://sun9-1.userapi.com/b.jpg')
+        assert deferred.value.wait.done()
+        assert dedup.acquire('https://sun9-1.userapi.com/b.jpg') is None
+
+    asyncio.run(run())
+
+
+def test_missing_file_is_downloaded_again(tmp_path) -> None:
+    path = tmp_path / 'c.jpg'
+    path.write_bytes(b'data')
+    info = {'path': str(path), 'final_url': 'https://sun9-1.userapi.com/c.jpg', 'content_type': 'image/jpeg', 'size': 4}
+
+    async def run() -> None:
+        dedup = FileDeduplicator()
+        assert dedup.acquire('https://sun9-1.userapi.com/c.jpg') is None
+        dedup.complete('https://sun9-1.userapi.com/c.jpg', info)
+        path.unlink()
+        # `acquire` не обращается к диску, пропавший файл находит `link_duplicate`
+        assert dedup.acquire('https://sun9-1.userapi.com/c.jpg') == info
+        assert dedup.link_duplicate(info, str(tmp_path / 'dialog')) is None
+        dedup.forget('https://sun9-1.userapi.com/c.jpg', info)
+        assert dedup.acquire('https://sun9-1.userapi.com/c.jpg') is None
+
+    asyncio.run(run())
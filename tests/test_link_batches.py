@@ -0,0 +1,35 @@
+'''
+Проверка того, что обработка архива по частям (`pipeline_mode`) находит то же, что и обработка целиком
+'''
+from concurrent.futures import ProcessPoolExecutor
+from os import makedirs
+from os.path import join
+
+from benchmarks.archive_generator import generate_archive
+from links_finder import VKLinkFinder
+
+folder_names = {
+    'messages': 'messages',
+    'likes/photo': 'likes/photo',
+    'photos': 'photos/photo-albums',
+    'profile': 'profile'
+}
+
+
+def test_batches_match_link_info(tmp_path) -> None:
+    root = str(tmp_path)
+    generate_archive(root, dialogs=3, pages=2, messages=20, albums=2, photos=10, likes=10, documents=5)
+    # Папка диалога без `.html` файлов
+    makedirs(join(root, 'messages', '100999'))
+
+    with ProcessPoolExecutor(2) as executor:
+        expected = VKLinkFinder(root, folder_names, executor=executor).link_info
+        finder = VKLinkFinder(root, folder_names, pipelined=True)
+        dialogs = {}
+        for section, batch in finder.iter_link_batches(executor):
+            if section == 'messages':
+                dialogs.update(batch)
+
+    assert '100999' in expected['messages']
+    assert dialogs == expected['messages']
+    assert finder.link_info == expected
@@ -0,0 +1,55 @@
+'''
+Проверка хранилища результатов обработки файлов архива `parse_cache.ParseCache`
+'''
+from concurrent.futures import ProcessPoolExecutor
+from os.path import join
+
+import links_finder
+from benchmarks.archive_generator import generate_archive
+from links_finder import VKLinkFinder
+from parse_cache import ParseCache
+
+folder_names = {
+    'messages': 'messages',
+    'likes/photo': 'likes/photo',
+    'photos': 'photos/photo-albums',
+    'profile': 'profile'
+}
+
+
+def test_cache_depends_on_parser_and_encoding(tmp_path) -> None:
+    root = str(tmp_path / 'archive')
+    generate_archive(root, dialogs=2, pages=2, messages=20, albums=1, photos=10, likes=10, documents=5)
+
+    with ProcessPoolExecutor(2) as executor:
+        parse_cache = ParseCache(join(str(tmp_path), 'parse_cache.sqlite'))
+        expected = VKLinkFinder(root, folder_names, executor=executor, parse_cache=parse_cache).link_info
+        files_count = parse_cache.get_stats()['misses']
+        assert files_count > 0
+
+        # Другой обработчик `.html` файлов или кодировка не используют чужие результаты
+        VKLinkFinder(root, folder_names, executor=executor, html_parser='stream', parse_cache=parse_cache)
+        VKLinkFinder(root, folder_names, vk_encoding='utf8', executor=executor, parse_cache=parse_cache)
+        assert parse_cache.get_stats() == {'hits': 0, 'misses': files_count * 3}
+
+        finder = VKLinkFinder(root, folder_names, executor=executor, html_parser='stream', parse_cache=parse_cache)
+        assert parse_cache.get_stats() == {'hits': files_count, 'misses': files_count * 3}
+        assert finder.link_info == expected
+        parse_cache.close()
+
+
+def test_results_are_saved_during_scan(tmp_path, monkeypatch) -> None:
+    root = str(tmp_path / 'archive')
+    generate_archive(root, dialogs=4, pages=3, messages=20, albums=1, photos=10, likes=10, documents=5)
+    monkeypatch.setattr(links_finder, 'parse_cache_batch_size', 2)
+
+    with ProcessPoolExecutor(2) as executor:
+        parse_cache = ParseCache(join(str(tmp_path), 'parse_cache.sqlite'))
+        finder = VKLinkFinder(root, folder_names, parse_cache=parse_cache, pipelined=True)
+        batches = finder.iter_link_batches(executor)
+        next(batches)
+        # Часть результатов сохранена до окончания обработки архива
+        saved = parse_cache.connection.execute('SELECT COUNT(*) FROM parsed_files').fetchone()[0]
+        assert saved >= 2
+        batches.close()
+        parse_cache.close()
@@ -0,0 +1,149 @@
+'''
+Проверка того, что все обработчики `.html` файлов из `html_parsers` дают одинаковый результат
+для всех функций поиска ссылок `VKLinkFinder`.
+
+Запуск из корня репозитория:
+```
+python -m pytest -q
+```
+'''
+from os.path import join
+
+import pytest
+
+from benchmarks.archive_generator import generate_archive
+from html_parsers import html_parsers, html_parsers_available
+from links_finder import VKLinkFinder
+
+# Обработчик, с результатом которого сравниваются остальные
+reference_parser = 'bs4'
+
+compared_parsers = [
+    pytest.param(
+        name,
+        marks=pytest.mark.skipif(not html_parsers_available[name], reason=f'обработчик {name} не установлен')
+    )
+    for name in html_parsers if name != reference_parser
+]
+
+page_head = (
+    '<!DOCTYPE html><html><head>'
+    '<meta http-equiv="Content-Type" content="text/html; charset=utf-8"><title>VK</title>'
+    '</head><body><div class="page_header">'
+    # Имя диалога и название альбома с вложенными тегами
+    '<div class="ui_crumb"> <a href="https://vk.com/im">Сообщения</a> » <span>Иван &amp; Ко</span> </div>'
+    '</div><div class="wrap_page_content">'
+)
+page_tail = '</div></body></html>'
+
+# Страницы с разметкой, на которой расходились обработчики:
+# вложенные `ui_crumb` и `message__header`, `>` внутри значений атрибутов, регистр тегов и атрибутов,
+# самозакрывающиеся `div`, атрибуты без кавычек и сообщения без вложений
+edge_pages = {
+    join('messages', '2000000001', 'messages0.html'): (
+        '<div class="item"><div class="item__main"><div class="message" data-id="1">'
+        '<div class="message__header"><a href="https://vk.com/id1" title="a > b">Иван</a>, 1 янв 2020 в 10:00:00 (ред.)</div>'
+        '<div>текст<div class="kludges" data-x="1>2"><div class="attachment">'
+        '<div class="attachment__description">Фото</div>'
+        '<a class=\'attachment__link\' data-t="<div>" href="https://sun9-1.userapi.com/a.jpg?size=1&amp;quality=96">x</a>'
+        '</div></div></div></div></div></div>\n'
+        '<div class="item"><div class="item__main"><div class="message">'
+        '<div class="message__header">Вы, 2 фев 2021 в 1:00:00</div><div>без вложения</div></div></div></div>\n'
+        '<div class="item"><div class="item__main"><div/>'
+        '<div class="message__header">Вы, 3 мар 2021 в 1:00:00</div>'
+        '<A CLASS="attachment__link" HREF=https://vk.com/doc1_2>d</A></div></div>\n'
+    ),
+    join('photos', 'photo-albums', 'album0.html'): (
+        '<div class="item"><div class="clear_fix" title="> 1">5 апр 2021 в 12:00</div>'
+        '<img alt="a > b" src="https://sun9-2.userapi.com/b.jpg?size=1&amp;type=album"></div>\n'
+        '<div class="item"><IMG SRC="https://sun9-3.userapi.com/c.jpg"></div>\n'
+    ),
+    join('likes', 'photo', 'photo0.html'): (
+        '<div class="item"><a title="1 > 0" href="https://vk.com/photo1_2">x</a></div>\n'
+        '<div class="item"><a href="https://github.com/user">x</a></div>\n'
+    ),
+    join('profile', 'documents.html'): (
+        '<div class="item"><div class="item__main" data-x=">">'
+        '<a href="https://vk.com/doc1_3?hash=a&amp;b=1">file.pdf</a></div>'
+        '<div class="item__tertiary">7 май 2019\nв 11:00</div></div>\n'
+    )
+}
+
+
+def get_extractor(file_path: str):
+    '''
+    Возвращает функцию поиска ссылок `VKLinkFinder` для файла архива по его папке
+    `file_path`: путь до файла внутри архива
+    '''
+    if file_path.startswith('messages'):
+        return VKLinkFinder.get_messages_attachment
+    if file_path.startswith('photos'):
+        return VKLinkFinder.get_photos_attachment
+    if file_path.startswith('likes'):
+        return VKLinkFinder.get_likes_attachment
+    return VKLinkFinder.get_doc_attachment
+
+
+@pytest.fixture(scope='module')
+def generated_archive(tmp_path_factory) -> str:
+    root = str(tmp_path_factory.mktemp('generated'))
+    generate_archive(root, dialogs=3, pages=2, messages=30, albums=2, photos=20, likes=20, documents=10)
+    return root
+
+
+@pytest.fixture(scope='module')
+def edge_archive(tmp_path_factory) -> str:
+    root = tmp_path_factory.mktemp('edge')
+    for file_path, content in edge_pages.items():
+        path = root / file_path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(page_head + content + page_tail, encoding='utf8')
+    return str(root)
+
+
+generated_files = [
+    join('messages', '-2000000000', 'messages0.html'),
+    join('messages', '-2000000000', 'messages50.html'),
+    join('messages', '100001', 'messages0.html'),
+    join('photos', 'photo-albums', 'album0.html'),
+    join('photos', 'photo-albums', 'album1.html'),
+    join('likes', 'photo', 'photo0.html'),
+    join('profile', 'documents.html')
+]
+
+
+@pytest.mark.parametrize('html_parser', compared_parsers)
+@pytest.mark.parametrize('file_path', generated_files)
+def test_generated_archive(generated_archive: str, file_path: str, html_parser: str) -> None:
+    extractor = get_extractor(file_path)
+    expected = extractor(join(generated_archive, file_path), 'cp1251', reference_parser)
+    assert expected
+    assert extractor(join(generated_archive, file_path), 'cp1251', html_parser) == expected
+
+
+@pytest.mark.parametrize('html_parser', compared_parsers)
+@pytest.mark.parametrize('file_path', list(edge_pages))
+def test_edge_pages(edge_archive: str, file_path: str, html_parser: str) -> None:
+    extractor = get_extractor(file_path)
+    expected = extractor(join(edge_archive, file_path), 'cp1251', reference_parser)
+    assert expected
+    assert extractor(join(edge_archive, file_path), 'cp1251', html_parser) == expected
+
+
+def test_edge_reference_result(edge_archive: str) -> None:
+    path = join(edge_archive, 'messages', '2000000001', 'messages0.html')
+    assert VKLinkFinder.get_messages_attachment(path, 'cp1251', reference_parser) == {
+        'name': 'Сообщения » Иван & Ко',
+        'page': 0,
+        'links': {
+            '1_янв_2020': ['https://sun9-1.userapi.com/a.jpg?size=1&quality=96'],
+            '3_мар_2021': ['https://vk.com/doc1_2']
+        }
+    }
+    path = join(edge_archive, 'photos', 'photo-albums', 'album0.html')
+    assert VKLinkFinder.get_photos_attachment(path, 'cp1251', reference_parser) == {
+        'Сообщения » Иван & Ко': {
+            '5_апр_2021': ['https://sun9-2.userapi.com/b.jpg?size=1&type=album'],
+            'no_date': ['https://sun9-3.userapi.com/c.jpg']
+        }
+    }
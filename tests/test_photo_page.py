@@ -0,0 +1,31 @@
+'''
+Проверка поиска ссылки на фото на странице фото VK `data_downloader.find_photo_url`
+'''
+import asyncio
+
+from aiohttp import ClientSession, web
+from aiohttp.test_utils import TestServer
+
+from data_downloader import find_photo_url
+
+photo_page = (
+    b'<html><head><meta property="og:image:secure_url" content="https://sun9-1.userapi.com/a.jpg?size=1&amp;type=album">'
+    b'</head><body>' + b'<div class="photo"></div>' * 100000 + b'</body></html>'
+)
+
+
+def test_photo_url_releases_response() -> None:
+    async def photo(request: web.Request) -> web.Response:
+        return web.Response(body=photo_page, content_type='text/html', charset='utf-8')
+
+    async def run() -> None:
+        app = web.Application()
+        app.router.add_get('/photo1_1', photo)
+        async with TestServer(app) as server, ClientSession() as session:
+            async with session.get(server.make_url('/photo1_1')) as response:
+                assert await find_photo_url(response) == 'https://sun9-1.userapi.com/a.jpg?size=1&type=album'
+                # Остаток страницы не читается, а соединение освобождено
+                assert response.connection is None
+                assert response.closed
+
+    asyncio.run(run())
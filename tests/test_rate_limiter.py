@@ -0,0 +1,53 @@
+'''
+Проверка ограничителя частоты запросов `rate_limiter.HostRateLimiter`
+'''
+from rate_limiter import HostRateLimiter
+
+limits = {'vk': (2.0, 1), 'cdn': (0.0, 50), 'other': (0.0, 10)}
+
+
+def test_unlimited_host_is_not_delayed() -> None:
+    limiter = HostRateLimiter(limits)
+    _, bucket = limiter.get_bucket('https://sun9-1.userapi.com/a.jpg')
+    assert all(bucket.reserve() == 0 for _ in range(100))
+
+
+def test_pause_unlimited_host() -> None:
+    limiter = HostRateLimiter(limits)
+    limiter.pause('https://sun9-1.userapi.com/a.jpg', 10)
+    _, bucket = limiter.get_bucket('https://sun9-1.userapi.com/b.jpg')
+    assert bucket.reserve() > 9
+    # Пауза действует только на хост, ответивший `429`
+    _, other = limiter.get_bucket('https://sun9-2.userapi.com/a.jpg')
+    assert other.reserve() == 0
+
+
+def test_vk_requests_are_spread() -> None:
+    limiter = HostRateLimiter(limits)
+    _, bucket = limiter.get_bucket('https://vk.com/photo1_1')
+    assert bucket.reserve() == 0
+    assert 0.4 < bucket.reserve() <= 0.5
+    # Лимит страниц VK общий для всех хостов VK
+    assert limiter.get_bucket('https://m.vk.com/doc1_1')[1] is bucket
+
+
+def test_try_acquire_keeps_delayed_request() -> None:
+    limiter = HostRateLimiter(limits)
+    assert limiter.try_acquire('https://vk.com/photo1_1') == 0
+    first = limiter.try_acquire('https://vk.com/photo1_2')
+    second = limiter.try_acquire('https://vk.com/photo1_3')
+    # Каждый отложенный запрос занимает свое место в очереди
+    assert 0.4 < first <= 0.5
+    assert 0.9 < second <= 1.0
+    # До своего времени занятый запрос не выполняется и не занимает новый
+    assert 0 < limiter.try_acquire('https://vk.com/photo1_2') <= first
+    limiter.reservations['https://vk.com/photo1_2'][0] -= first
+    assert limiter.try_acquire('https://vk.com/photo1_2') == 0
+    assert 'https://vk.com/photo1_2' not in limiter.reservations
+
+
+def test_cancel_returns_request() -> None:
+    limiter = HostRateLimiter(limits)
+    assert limiter.try_acquire('https://vk.com/photo1_1') == 0
+    limiter.cancel('https://vk.com/photo1_1')
+    assert limiter.try_acquire('https://vk.com/photo1_2') == 0
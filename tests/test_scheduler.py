@@ -0,0 +1,84 @@
+'''
+Проверка общего планировщика скачиваний `scheduler.DownloadScheduler`
+'''
+import asyncio
+
+from rate_limiter import HostRateLimiter
+from scheduler import AdaptiveLimiter, DownloadScheduler, JobDeferred
+
+
+def test_deferred_job_frees_its_place() -> None:
+    order = []
+    deferred = set()
+
+    async def handler(url: str) -> dict:
+        if url == 'slow' and url not in deferred:
+            deferred.add(url)
+            raise JobDeferred(0.2)
+        order.append(url)
+        return {'url': url}
+
+    async def run() -> list:
+        scheduler = DownloadScheduler(handler, {'small': AdaptiveLimiter('small', 1)}, stats_interval=0)
+        scheduler.start()
+        futures = [scheduler.submit('small', url=url) for url in ('slow', 'fast1', 'fast2')]
+        results = await asyncio.wait_for(asyncio.gather(*futures), 5)
+        await scheduler.stop()
+        stats = scheduler.get_stats()['small']
+        assert stats['deferred'] == 1
+        assert stats['in_flight'] == 0
+        assert stats['completed'] == 3
+        return results
+
+    results = asyncio.run(run())
+    assert [result['url'] for result in results] == ['slow', 'fast1', 'fast2']
+    # Пока отложенная задача ждет, ее место занимают следующие задачи
+    assert order == ['fast1', 'fast2', 'slow']
+
+
+def test_job_waits_for_future() -> None:
+    async def run() -> list:
+        ready = asyncio.get_running_loop().create_future()
+        order = []
+
+        async def handler(url: str) -> dict:
+            if url == 'waiting' and not ready.done():
+                raise JobDeferred(ready)
+            order.append(url)
+            if url == 'owner':
+                ready.set_result(None)
+            return {'url': url}
+
+        scheduler = DownloadScheduler(handler, {'small': AdaptiveLimiter('small', 1)}, stats_interval=0)
+        scheduler.start()
+        futures = [scheduler.submit('small', url=url) for url in ('waiting', 'owner')]
+        await asyncio.wait_for(asyncio.gather(*futures), 5)
+        await scheduler.stop()
+        return order
+
+    assert asyncio.run(run()) == ['owner', 'waiting']
+
+
+def test_rate_limited_jobs_are_deferred_once() -> None:
+    limiter = HostRateLimiter({'vk': (100.0, 10), 'cdn': (0.0, 50), 'other': (0.0, 10)})
+    calls = []
+
+    async def handler(url: str) -> dict:
+        calls.append(url)
+        delay = limiter.try_acquire(url)
+        if delay > 0:
+            raise JobDeferred(delay)
+        return {'url': url}
+
+    async def run() -> dict:
+        scheduler = DownloadScheduler(handler, {'small': AdaptiveLimiter('small', 10)}, stats_interval=0)
+        scheduler.start()
+        futures = [scheduler.submit('small', url=f'https://vk.com/photo1_{i}') for i in range(100)]
+        await asyncio.wait_for(asyncio.gather(*futures), 10)
+        await scheduler.stop()
+        return scheduler.get_stats()['small']
+
+    stats = asyncio.run(run())
+    # Запросы сверх `burst` откладываются ровно один раз, до своего места в очереди запросов
+    assert 85 <= stats['deferred'] <= 95
+    assert len(calls) == 100 + stats['deferred']
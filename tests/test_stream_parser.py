@@ -0,0 +1,71 @@
+'''
+Проверка потребления памяти и скорости потокового обработчика `stream` на больших файлах сообщений
+'''
+import time
+import tracemalloc
+from os.path import getsize, join
+
+import pytest
+
+from archive_reader import directory_source
+from benchmarks.archive_generator import generate_archive
+from html_parsers import BS4Parser, StreamParser
+
+# Нижняя граница скорости разбора, МиБ/с. Заведомо ниже реальной, чтобы не зависеть от машины
+min_stream_speed = 0.5
+
+
+def make_dialog_page(root: str, messages: int) -> str:
+    '''
+    Создает диалог из одного файла `messages0.html` с `messages` сообщениями без вложений
+    и возвращает путь до него. Без вложений результат разбора пустой и не влияет на потребление памяти
+    '''
+    generate_archive(root, dialogs=1, pages=1, messages=messages, attachment_share=0, albums=0, likes=0, documents=0)
+    return join(root, 'messages', '-2000000000', 'messages0.html')
+
+
+@pytest.fixture(scope='module')
+def dialog_pages(tmp_path_factory) -> tuple:
+    small = make_dialog_page(str(tmp_path_factory.mktemp('small')), 2000)
+    large = make_dialog_page(str(tmp_path_factory.mktemp('large')), 16000)
+    return small, large
+
+
+def get_peak_memory(file_path: str) -> int:
+    '''
+    Возвращает наибольший объем памяти в байтах, выделенный за разбор файла потоковым обработчиком
+    '''
+    tracemalloc.start()
+    try:
+        with directory_source.open(file_path) as f:
+            StreamParser.get_messages(f)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def get_parse_time(parser: type, file_path: str, repeat: int = 3) -> float:
+    best = None
+    for _ in range(repeat):
+        with directory_source.open(file_path) as f:
+            start = time.perf_counter()
+            parser.get_messages(f)
+            elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def test_stream_memory_is_flat(dialog_pages: tuple) -> None:
+    small, large = dialog_pages
+    assert getsize(large) > getsize(small) * 6
+    small_peak = get_peak_memory(small)
+    large_peak = get_peak_memory(large)
+    # Файл читается частями, поэтому память зависит от размера части, а не от размера файла
+    assert large_peak < getsize(large) / 4
+    assert large_peak - small_peak < (getsize(large) - getsize(small)) / 10
+
+
+def test_stream_speed(dialog_pages: tuple) -> None:
+    small, large = dialog_pages
+    assert get_parse_time(StreamParser, small) < get_parse_time(BS4Parser, small)
+    assert getsize(large) / 1024 / 1024 / get_parse_time(StreamParser, large, repeat=1) > min_stream_speed
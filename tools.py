@@ -32,6 +32,12 @@ months_dict = {
     'дек': '12'
 }
 
+# Суффикс временного файла, в который идет скачивание. Под своим именем файл появляется только после завершения скачивания
+part_file_suffix = '.part'
+
+# Папки, уже созданные `create_folder_cached`
+created_folders = set()
+
 
 def get_numberic_date(date: str) -> str:
     '''
@@ -62,6 +68,25 @@ def create_folder(path: str) -> None:
         logger.debug(f'Создана папка по пути {path}')
 
 
+def create_folder_cached(path: str) -> None:
+    '''
+    Создает все папки по пути из `path`, если они еще не создавались этой функцией.
+    Не обращается к файловой системе для уже созданных папок
+    `path`: путь для создания папок и подпапок
+    '''
+    if path not in created_folders:
+        makedirs(path, exist_ok=True)
+        created_folders.add(path)
+
+
+def get_part_path(path: str) -> str:
+    '''
+    Возвращает путь до временного файла, в который идет скачивание файла `path`
+    `path`: путь до файла
+    '''
+    return f'{path}{part_file_suffix}'
+
+
 def listdir_nohidden(path: str) -> Generator:
     '''
     Возвращает не скрытые файлы и папки по пути `path`
@@ -81,15 +106,16 @@ def clear_folder(path: str) -> None:
         folder_path = join(path, f)
         if isdir(folder_path):
             rmtree(folder_path)
+    created_folders.clear()
 
 
 def clear_jsons(path: str) -> None:
     '''
-    Удаляет все `JSON` файлы по пути из `path`
+    Удаляет все `JSON` и `NDJSON` файлы по пути из `path`
     `path`: путь для удаления папок и файлов
     '''
     for f in listdir_nohidden(path):
-        if '.json' in f:
+        if '.json' in f or '.ndjson' in f:
             remove(join(path, f))
 
 